@@ -1,6 +1,12 @@
 """dds2app admin site classes"""
 
+import json
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .forms import (
     StorageCredentialForm,
 )
@@ -16,16 +22,96 @@ from .models import (
     Sender,
     Attachment,
     Broadcast,
-    DataSet
+    DataSet,
+    Suppression,
+    Job,
+    RetentionPolicy,
+    Archive,
 )
 
 
+CURSOR_VAR = 'cursor'
+# below this estimate the paginator runs the exact COUNT(*)
+EXACT_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes the row count from the planner statistics
+       (pg_class.reltuples, or the plan estimate when filtered) instead
+       of running COUNT(*) on large tables"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        with connections[queryset.db].cursor() as cursor:
+            if queryset.query.where:
+                # QuerySet.explain() returns the repr of the decoded plan
+                sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]['Plan']['Plan Rows'])
+            else:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                estimate = int(row[0]) if row else 0
+        if estimate < EXACT_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+class CursorChangeList(ChangeList):
+    """Changelist paged by primary key (keyset) instead of OFFSET, so the
+       cost of a page does not grow with its depth"""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    @staticmethod
+    def get_cursor(request):
+        """Primary key the page starts below, None on the first page or
+           when it is not one"""
+        try:
+            return int(request.GET.get(CURSOR_VAR, ''))
+        except ValueError:
+            return None
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset.order_by('-pk')
+        cursor = self.get_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(pk__lt=cursor)
+        rows = list(queryset[:self.list_per_page + 1])
+        self.next_cursor = (rows[self.list_per_page - 1].pk
+                            if len(rows) > self.list_per_page else None)
+        self.next_url = (self.get_query_string({CURSOR_VAR: self.next_cursor})
+                         if self.next_cursor else None)
+        self.first_url = (self.get_query_string(remove=[CURSOR_VAR])
+                          if cursor is not None else None)
+        self.cursor_paginated = True
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = cursor is not None or self.next_cursor is not None
+        self.paginator = paginator
+
+
 class AdminAuthSignature(admin.ModelAdmin):
     """Abstract class that overrides save_model'
        and updates the model with the user that created or
        modified the model instance"""
 
     exclude = ('created_by', 'modified_by')
+    list_select_related = ('created_by', 'modified_by')
 
     def save_model(self, request, obj, form, change):
         if change:
@@ -38,9 +124,34 @@ class AdminAuthSignature(admin.ModelAdmin):
         abstract = True
 
 
+class AdminTenantAware(AdminAuthSignature):
+    """Abstract class for TenantAware models, the tenant is picked
+       with an autocomplete widget"""
+
+    list_select_related = ('tenant', 'created_by', 'modified_by')
+    autocomplete_fields = ('tenant',)
+
+    class Meta:
+        abstract = True
+
+
+class LargeTableAdmin:
+    """Admin performance mode for tables with millions of rows: estimated
+       counts, keyset pagination and no column sorting"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    sortable_by = ()
+    ordering = ('-pk',)
+
+    def get_changelist(self, request, **kwargs):
+        return CursorChangeList
+
+
 class TenantAdmin(AdminAuthSignature):
     """ Tenant """
     list_display = ('tenant', 'description', 'created_by', 'modified_by')
+    search_fields = ('tenant',)
     #prepopulated_fields = {'slug': ['title']}
 
     # def has_change_permission(self, request, obj=None):
@@ -58,53 +169,103 @@ class TenantAdmin(AdminAuthSignature):
     #     return Entry.objects.filter(author=request.user)
 
 
-class AdminBalanceEntry(AdminAuthSignature):
+class AdminRole(AdminTenantAware):
+    """Role"""
+    list_display = ('tenant', 'role')
+    search_fields = ('role', 'tenant__tenant')
+
+
+class AdminProfile(admin.ModelAdmin):
+    """Profile"""
+    list_select_related = ('user',)
+    autocomplete_fields = ('user', 'tenant', 'roles')
+
+
+class AdminBalanceEntry(LargeTableAdmin, AdminTenantAware):
     """Balance Entry"""
 
     list_display = ('channel_type', 'qty', 'created_on',
                     'created_by', 'modified_on', 'modified_by')
 
 
-class AdminTag(AdminAuthSignature):
+class AdminTag(AdminTenantAware):
     """Tag"""
 
     list_display = ('tenant', 'tag')
+    search_fields = ('tag',)
 
 
-class AdminStorageCredential(AdminAuthSignature):
+class AdminStorageCredential(AdminTenantAware):
     """Storage Credential """
     form = StorageCredentialForm
+    search_fields = ('name',)
 
 
-class AdminDomain(AdminAuthSignature):
+class AdminDomain(AdminTenantAware):
     """Domain"""
-    list_display = ('name', 'verified')
+    list_display = ('name', 'verified', 'checked_on', 'next_check_on')
+    readonly_fields = ('verified', 'dns_records', 'checked_on', 'next_check_on')
+    search_fields = ('name',)
 
 
-class AdminSender(AdminAuthSignature):
+class AdminSender(AdminTenantAware):
     """Sender"""
     list_display = ('name', 'email', 'mobile_number',
                     'mobile_verified', 'email_verified')
+    search_fields = ('name', 'email')
 
 
-class AdminAttachment(AdminAuthSignature):
+class AdminAttachment(AdminTenantAware):
     """Attachment"""
     list_display = ('description', 'original_filename', 'created_on',
                     'created_by', 'modified_on', 'modified_by')
     readonly_fields = ('original_filename',)
+    search_fields = ('description',)
+    autocomplete_fields = ('tenant', 'credentials')
 
 
-class AdminBroadcast(AdminAuthSignature):
+class AdminBroadcast(AdminTenantAware):
     """Broadcast"""
+    autocomplete_fields = ('tenant', 'domain', 'sender', 'storage_credentials',
+                           'tags', 'email_attachments')
 
 
-class AdminDataSet(AdminAuthSignature):
+class AdminDataSet(AdminTenantAware):
     """Broadcast"""
 
 
+class AdminSuppression(AdminTenantAware):
+    """Suppression"""
+    list_display = ('address', 'channel_type', 'reason')
+    list_filter = ('channel_type',)
+    search_fields = ('address',)
+
+
+class AdminJob(admin.ModelAdmin):
+    """Job"""
+    list_display = ('task', 'tenant', 'status', 'priority', 'attempts',
+                    'run_after', 'finished_on')
+    list_filter = ('status', 'task')
+    readonly_fields = ('worker', 'last_error', 'finished_on')
+
+
+class AdminRetentionPolicy(admin.ModelAdmin):
+    """RetentionPolicy"""
+    list_display = ('tenant', 'table', 'keep_days')
+    list_filter = ('table',)
+    autocomplete_fields = ('tenant',)
+
+
+class AdminArchive(admin.ModelAdmin):
+    """Archive"""
+    list_display = ('tenant', 'table', 'period_start', 'rows', 'purged_on')
+    list_filter = ('table',)
+    readonly_fields = ('rows', 'last_id', 'purged_on')
+
+
 admin.site.register(Tenant, TenantAdmin)
-admin.site.register(Profile)
-admin.site.register(Role)
+admin.site.register(Profile, AdminProfile)
+admin.site.register(Role, AdminRole)
 admin.site.register(BalanceEntry, AdminBalanceEntry)
 admin.site.register(Tag, AdminTag)
 admin.site.register(StorageCredential, AdminStorageCredential)
@@ -113,3 +274,7 @@ admin.site.register(Sender, AdminSender)
 admin.site.register(Attachment, AdminAttachment)
 admin.site.register(Broadcast, AdminBroadcast)
 admin.site.register(DataSet, AdminDataSet)
+admin.site.register(Suppression, AdminSuppression)
+admin.site.register(Job, AdminJob)
+admin.site.register(RetentionPolicy, AdminRetentionPolicy)
+admin.site.register(Archive, AdminArchive)
@@ -0,0 +1,160 @@
+"""
+asyncio helpers for the ASGI endpoints
+
+fetch() is a small streaming HTTP/1.0 client on asyncio streams, enough to
+proxy attachment sources without holding a thread per request. HTTP/1.0
+keeps responses free of chunked encoding and the server closes the
+connection at the end of the body.
+
+Attachment URLs come from tenant data, so fetch() only connects to public
+addresses: a host that resolves to a loopback, private, link-local or
+otherwise reserved address is refused, at every redirect.
+"""
+
+import asyncio
+import ipaddress
+import socket
+import ssl
+from urllib.parse import urljoin, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+CHUNK_SIZE = 64 * 1024
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class HTTPError(Exception):
+    pass
+
+
+def database_sync_to_async(func):
+    """sync_to_async for ORM code, the thread's connection is released
+       the same way it is at the end of a request"""
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+class HTTPResponse:
+
+    def __init__(self, status, headers, reader, writer, timeout):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+
+    async def iter_chunks(self, size=CHUNK_SIZE):
+        try:
+            while True:
+                chunk = await asyncio.wait_for(self._reader.read(size), self._timeout)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    async def read(self, limit=None):
+        """The whole body, HTTPError when it is longer than limit bytes"""
+        length = self.headers.get('content-length', '')
+        if limit is not None and length.isdigit() and int(length) > limit:
+            self.close()
+            raise HTTPError(f'response of {length} bytes is over {limit}')
+        chunks, size = [], 0
+        async for chunk in self.iter_chunks():
+            size += len(chunk)
+            if limit is not None and size > limit:
+                self.close()
+                raise HTTPError(f'response is over {limit} bytes')
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self._writer.close()
+
+
+def is_public(address):
+    try:
+        address = ipaddress.ip_address(address.split('%')[0])
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+async def public_addresses(host, port, timeout):
+    """Addresses of host, HTTPError unless all of them are public"""
+    try:
+        infos = await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM),
+            timeout)
+    except socket.gaierror as exc:
+        raise HTTPError(f'cannot resolve {host}: {exc}')
+    addresses = [sockaddr[0] for *_, sockaddr in infos]
+    for address in addresses:
+        if not is_public(address):
+            raise HTTPError(f'{host} resolves to the non-public address {address}')
+    return addresses
+
+
+async def _request(method, url, headers, body, timeout):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise HTTPError(f'unsupported url {url}')
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    # connect to the address that was checked, not to a second lookup
+    addresses = await public_addresses(parts.hostname, port, timeout)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(addresses[0], port,
+                                ssl=ssl.create_default_context() if secure else None,
+                                server_hostname=parts.hostname if secure else None),
+        timeout)
+    path = parts.path or '/'
+    if parts.query:
+        path = f'{path}?{parts.query}'
+    lines = [f'{method} {path} HTTP/1.0',
+             f'Host: {parts.hostname}' + (f':{parts.port}' if parts.port else ''),
+             'User-Agent: dds2',
+             'Connection: close']
+    lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+    if body is not None:
+        lines.append(f'Content-Length: {len(body)}')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+    await writer.drain()
+
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        writer.close()
+        raise HTTPError(f'bad status line from {url}: {status_line!r}')
+    response_headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    return HTTPResponse(status, response_headers, reader, writer, timeout)
+
+
+async def fetch(url, method='GET', headers=None, body=None, timeout=30, max_redirects=3):
+    """Open url and return an HTTPResponse whose body is streamed with
+       iter_chunks(), redirects to http(s) URLs of public hosts are
+       followed"""
+    for _ in range(max_redirects + 1):
+        response = await _request(method, url, headers, body, timeout)
+        if response.status not in REDIRECTS or 'location' not in response.headers:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['location'])
+        if response.status == 303:
+            method, body = 'GET', None
+    raise HTTPError(f'too many redirects for {url}')
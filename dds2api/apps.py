@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class Dds2ApiConfig(AppConfig):
     name = 'dds2api'
+
+    def ready(self):
+        from . import checks, signals, tasks  # pylint: disable=W0611
@@ -0,0 +1,216 @@
+"""
+Native async endpoints of the ASGI deployment (dds2be.asgi)
+
+They answer the same URLs as the viewset actions of the same name, which
+keep serving the WSGI deployment, but wait on the attachment sources and
+the mail server without holding a worker thread. They authenticate Bearer
+(JWT) tokens themselves, requests with any other credentials (sessions)
+are handed to the WSGI application and its DRF authentication classes.
+Request bodies are limited to DATA_UPLOAD_MAX_MEMORY_SIZE.
+"""
+
+import asyncio
+import json
+import math
+import re
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .aio import HTTPError, database_sync_to_async
+from .attachments import AttachmentSourceError, content_disposition
+from .authentication import PERMS_CLAIM, claims_are_fresh, stateless_enabled
+from .models import Attachment, Broadcast, Sender
+from .rbac import PERM_MANAGE, PERM_READ, PERM_TEMPLATES, PermissionSet, load_permissions
+from .senders import TokenRateLimited, issue_token
+from .serializers import TestSendSerializer
+from .services import open_attachment, send_sender_verification, send_test_email
+from .throttling import charge_tenants
+
+
+class HTTPException(Exception):
+
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+async def send_json(send, status, data):
+    await send({'type': 'http.response.start',
+                'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode('utf-8')})
+
+
+async def read_body(scope, receive):
+    """Request body, up to DATA_UPLOAD_MAX_MEMORY_SIZE bytes"""
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    too_large = HTTPException(413, f'Request body is over {limit} bytes.')
+    length = dict(scope['headers']).get(b'content-length', b'')
+    if limit is not None and length.isdigit() and int(length) > limit:
+        raise too_large
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPException(400, 'Client disconnected.')
+        body += message.get('body', b'')
+        if limit is not None and len(body) > limit:
+            raise too_large
+        if not message.get('more_body'):
+            return body
+
+
+async def read_json(scope, receive):
+    try:
+        return json.loads(await read_body(scope, receive) or b'{}')
+    except ValueError as exc:
+        raise HTTPException(400, f'JSON parse error - {exc}')
+
+
+def _token_permissions(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError as exc:
+        raise HTTPException(401, str(exc))
+    if stateless_enabled() and claims_are_fresh(token):
+        return PermissionSet.from_claim(token[PERMS_CLAIM])
+    user_id = token[jwt_settings.USER_ID_CLAIM]
+    if not get_user_model().objects.filter(**{jwt_settings.USER_ID_FIELD: user_id},
+                                           is_active=True).exists():
+        raise HTTPException(401, 'User not found or inactive.')
+    return load_permissions(user_id)
+
+
+def bearer_token(scope):
+    """Raw Bearer token of the request, '' without one"""
+    header = dict(scope['headers']).get(b'authorization', b'').decode('latin-1')
+    keyword, _, raw_token = header.partition(' ')
+    return raw_token if keyword in jwt_settings.AUTH_HEADER_TYPES else ''
+
+
+async def authenticate(scope):
+    """PermissionSet of the Bearer token of the request"""
+    raw_token = bearer_token(scope)
+    if not raw_token:
+        raise HTTPException(401, 'Authentication credentials were not provided.')
+    return await database_sync_to_async(_token_permissions)(raw_token)
+
+
+async def get_object(queryset, pk, perms, perm):
+    """Like the viewsets, objects of tenants where the user lacks perm
+       are not found"""
+    obj = await database_sync_to_async(queryset.filter(pk=pk).first)()
+    if obj is None or not perms.allows(obj.tenant_id, perm):
+        raise HTTPException(404, 'Not found.')
+    return obj
+
+
+async def attachment_preview(scope, receive, send, pk):
+    """Stream the content of an attachment, the query string is the row"""
+    perms = await authenticate(scope)
+    attachment = await get_object(Attachment.objects.select_related('credentials'),
+                                  pk, perms, PERM_READ)
+    row = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+    try:
+        response, filename = await open_attachment(attachment, row, supplied_row=True)
+    except AttachmentSourceError as exc:
+        raise HTTPException(400, str(exc))
+    except (HTTPError, OSError, asyncio.TimeoutError) as exc:
+        raise HTTPException(502, str(exc))
+    content_type = response.headers.get('content-type', 'application/octet-stream')
+    await send({'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-disposition',
+                             content_disposition(filename).encode('latin-1'))]})
+    async for chunk in response.iter_chunks():
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def sender_verify(scope, receive, send, pk):
+    perms = await authenticate(scope)
+    sender = await get_object(Sender.objects.all(), pk, perms, PERM_MANAGE)
+    try:
+        token = await database_sync_to_async(issue_token)(sender)
+    except TokenRateLimited as exc:
+        raise HTTPException(
+            429, f'Request was throttled. Expected available in {exc.wait} seconds.')
+    await send_sender_verification(sender, token)
+    await send_json(send, 202, {'detail': 'Verification code sent.'})
+
+
+async def broadcast_test_send(scope, receive, send, pk):
+    perms = await authenticate(scope)
+    broadcast = await get_object(Broadcast.objects.all(), pk, perms, PERM_TEMPLATES)
+    wait = await sync_to_async(charge_tenants)('broadcast-test-send', [broadcast.tenant_id])
+    if wait is not None:
+        raise HTTPException(
+            429, f'Request was throttled. Expected available in {math.ceil(wait)} seconds.')
+    serializer = TestSendSerializer(data=await read_json(scope, receive))
+    if not serializer.is_valid():
+        await send_json(send, 400, serializer.errors)
+        return
+    try:
+        await send_test_email(broadcast, serializer.validated_data['to'],
+                              serializer.validated_data['row'])
+    except AttachmentSourceError as exc:
+        await send_json(send, 400, {'row': [str(exc)]})
+        return
+    except (HTTPError, OSError, asyncio.TimeoutError) as exc:
+        raise HTTPException(502, str(exc))
+    await send_json(send, 202, {'detail': 'Test e-mail sent.'})
+
+
+ROUTES = (
+    ('GET', re.compile(r'^/api/attachment/(?P<pk>\d+)/preview/$'), attachment_preview),
+    ('POST', re.compile(r'^/api/sender/(?P<pk>\d+)/verify/$'), sender_verify),
+    ('POST', re.compile(r'^/api/broadcast/(?P<pk>\d+)/test-send/$'), broadcast_test_send),
+)
+
+
+def resolve(scope):
+    """(view, kwargs) of the async route of an http scope, or (None, None)
+       when it is not one or has no Bearer token"""
+    if not bearer_token(scope):
+        return None, None
+    for method, pattern, view in ROUTES:
+        match = pattern.match(scope['path'])
+        if match and scope['method'] == method:
+            return view, match.groupdict()
+    return None, None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def asgi_application(fallback):
+    """ASGI application serving ROUTES natively and everything else with
+       the fallback application"""
+    async def application(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+            return
+        view, kwargs = resolve(scope) if scope['type'] == 'http' else (None, None)
+        if view is None:
+            await fallback(scope, receive, send)
+            return
+        try:
+            await view(scope, receive, send, **kwargs)
+        except HTTPException as exc:
+            await send_json(send, exc.status, {'detail': exc.detail})
+    return application
@@ -0,0 +1,86 @@
+"""Where the content of an Attachment comes from, for a DataSet row"""
+
+import json
+import posixpath
+import re
+from urllib.parse import quote, urlencode, urlsplit, unquote
+
+from .credentials import s3_client
+from .messages import render
+from .models import Attachment
+
+PRESIGNED_URL_SECONDS = 300
+FILENAME_RE = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+
+
+class AttachmentSourceError(ValueError):
+    """The source of an attachment can't be fetched"""
+
+
+class SuppliedRowError(AttachmentSourceError):
+    """A row given by the API caller can't name the source of an attachment"""
+
+
+def is_template(text):
+    return '{{' in text or '{%' in text
+
+
+def attachment_request(attachment, row, supplied_row=False):
+    """(method, url, body) of the HTTP request that fetches the content of
+       attachment for row. S3 objects are fetched through a presigned URL.
+       A supplied_row comes from the caller (previews, test sends) and is
+       refused for URL attachments, their URL is read from the row, and for
+       S3 objects whose bucket or key is a template. S3 objects are only
+       read with the StorageCredential of the attachment, never with the
+       credentials of the platform"""
+    if attachment.origin == Attachment.ORIGIN_FROM_URL:
+        if supplied_row:
+            raise SuppliedRowError(
+                f'{attachment} is fetched from the {attachment.field_name} URL of '
+                f'DataSet rows, it cannot be fetched for a given row')
+        url = row.get(attachment.field_name, '')
+        params = {name: render(str(value), row)
+                  for name, value in (attachment.url_json_params or {}).items()}
+        if attachment.http_method == 'POST':
+            return 'POST', url, json.dumps(params).encode('utf-8')
+        if params:
+            url = f'{url}{"&" if "?" in url else "?"}{urlencode(params)}'
+        return 'GET', url, None
+    if attachment.origin == Attachment.ORIGIN_FROM_S3_OBJECT_KEY:
+        if attachment.credentials is None:
+            raise AttachmentSourceError(f'{attachment} has no storage credentials')
+        if supplied_row and (is_template(attachment.aws_s3_bucket_name) or
+                             is_template(attachment.aws_s3_object_key)):
+            raise SuppliedRowError(
+                f'{attachment} is fetched from an S3 object named by DataSet rows, '
+                f'it cannot be fetched for a given row')
+        url = s3_client(attachment.credentials).generate_presigned_url(
+            'get_object',
+            Params={'Bucket': render(attachment.aws_s3_bucket_name, row),
+                    'Key': render(attachment.aws_s3_object_key, row)},
+            ExpiresIn=PRESIGNED_URL_SECONDS)
+        return 'GET', url, None
+    return 'GET', attachment.file.url, None
+
+
+def attachment_filename(attachment, row, url, headers):
+    """Name of the attachment following its url_origing_naming_mode,
+       headers are the (lower cased) response headers"""
+    mode = attachment.url_origing_naming_mode
+    if mode == Attachment.ATTACHMENT_NAME_SPECIFY and attachment.specify_name:
+        return render(attachment.specify_name, row)
+    if mode == Attachment.ATTACHMENT_NAME_FROM_URL_CONTENT_DISPOSITION:
+        match = FILENAME_RE.search(headers.get('content-disposition', ''))
+        if match:
+            return unquote(match.group(1))
+    if attachment.origin == Attachment.ORIGIN_FROM_S3_OBJECT_KEY:
+        return posixpath.basename(render(attachment.aws_s3_object_key, row))
+    if attachment.origin == Attachment.ORIGIN_FROM_URL:
+        return posixpath.basename(urlsplit(url).path) or 'attachment'
+    if attachment.origin == Attachment.ORIGIN_GENERATED:
+        return f'document.{attachment.document_format.lower()}'
+    return attachment.original_filename
+
+
+def content_disposition(filename, disposition='inline'):
+    return f"{disposition}; filename*=UTF-8''{quote(filename)}"
@@ -0,0 +1,89 @@
+"""dds2api authentication
+
+Optional stateless JWT mode: the access token carries the user's tenant
+ids, roles and compiled permissions as claims, so authenticated requests
+can be authorised without loading the user row or the profile's tenants.
+It is enabled with the ``DDS2API_JWT_STATELESS`` setting.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .rbac import compile_permissions, user_memberships
+
+TENANTS_CLAIM = 'tenants'
+ROLES_CLAIM = 'roles'
+PERMS_CLAIM = 'perms'
+CLAIMS_AT_CLAIM = 'tenants_at'
+REVOCATION_KEY = 'dds2api:tenants-changed:{}'
+
+
+def stateless_enabled():
+    return getattr(settings, 'DDS2API_JWT_STATELESS', False)
+
+
+def add_tenant_claims(token, user):
+    """Embed the user's tenant ids, (tenant id, role) pairs and compiled
+       permissions in token"""
+    tenants, roles = user_memberships(user.id)
+    token[TENANTS_CLAIM] = tenants
+    token[ROLES_CLAIM] = [list(pair) for pair in roles]
+    token[PERMS_CLAIM] = compile_permissions(tenants, roles).to_claim()
+    token[CLAIMS_AT_CLAIM] = int(time.time())
+    token['username'] = user.get_username()
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    return token
+
+
+def revoke_tenant_claims(user_id):
+    """Mark the tenant claims of every token issued to user_id before now
+       as stale. The marker lives as long as a refresh token, because
+       refreshed access tokens copy their claims from the refresh token."""
+    lifetime = jwt_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+    cache.set(REVOCATION_KEY.format(user_id), time.time(), int(lifetime) + 1)
+
+
+def revoked_since(user_id, timestamp):
+    """True when the memberships of user_id changed at or after timestamp"""
+    changed_at = cache.get(REVOCATION_KEY.format(user_id))
+    return changed_at is not None and changed_at >= timestamp
+
+
+def claims_are_fresh(token):
+    """True when token carries tenant claims that were not revoked"""
+    if token is None or PERMS_CLAIM not in token:
+        return False
+    return not revoked_since(token.get(jwt_settings.USER_ID_CLAIM),
+                             token.get(CLAIMS_AT_CLAIM, 0))
+
+
+class TenantTokenUser(TokenUser):
+    """TokenUser that also exposes the tenant and role claims"""
+
+    @cached_property
+    def tenants(self):
+        return self.token.get(TENANTS_CLAIM, [])
+
+    @cached_property
+    def roles(self):
+        return [tuple(pair) for pair in self.token.get(ROLES_CLAIM, [])]
+
+
+class TenantJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that skips the user lookup when stateless mode is
+    enabled and the token tenant claims are still fresh. Otherwise it
+    behaves exactly like JWTAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        if stateless_enabled() and claims_are_fresh(validated_token):
+            return TenantTokenUser(validated_token)
+        return super().get_user(validated_token)
@@ -0,0 +1,80 @@
+"""
+Benchmark suite, run with ``python manage.py benchmark``
+
+It seeds a test database (local PostgreSQL) with synthetic tenants, tags,
+balance entries and DataSets, under dds2be.settings_benchmark the files are
+written to a local directory instead of S3. Results are flat {metric: value}
+dicts that are compared against a JSON baseline, see compare().
+"""
+
+import json
+import os
+import time
+
+CALIBRATION = 'host.calibration_ms'
+CALIBRATION_RUNS = 5
+
+
+def calibrate():
+    """Best time of a fixed pure Python workload, in ms, the unit the
+       timings of different hosts are compared in"""
+    timings = []
+    for _ in range(CALIBRATION_RUNS):
+        started = time.perf_counter()
+        for number in range(20000):
+            json.loads(json.dumps({'id': number, 'name': f'row {number}', 'tags': [number] * 5}))
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def higher_is_better(metric):
+    return metric.endswith('_per_sec')
+
+
+def is_timing(metric):
+    return metric.endswith(('_ms', '_per_sec')) and metric != CALIBRATION
+
+
+def host_speed(results, baseline):
+    """How many times slower the host of results is than the one of the
+       baseline, 1 when either was not calibrated"""
+    if results.get(CALIBRATION) and baseline.get(CALIBRATION):
+        return results[CALIBRATION] / baseline[CALIBRATION]
+    return 1.0
+
+
+def compare(results, baseline, tolerance):
+    """[(metric, baseline, value, change)] of the metrics that regressed
+       more than tolerance (a fraction), any increase of a query count
+       is a regression. Timings are scaled by the host speed first, so a
+       baseline recorded on another machine still compares"""
+    speed = host_speed(results, baseline)
+    regressions = []
+    for metric, value in sorted(results.items()):
+        base = baseline.get(metric)
+        if not base or metric == CALIBRATION:
+            continue
+        if is_timing(metric):
+            base = base / speed if higher_is_better(metric) else base * speed
+        if higher_is_better(metric):
+            change = (base - value) / base
+        else:
+            change = (value - base) / base
+        allowed = 0 if metric.endswith('.queries') else tolerance
+        if change > allowed:
+            regressions.append((metric, base, value, change))
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as baseline:
+        json.dump(results, baseline, indent=2, sort_keys=True)
+        baseline.write('\n')
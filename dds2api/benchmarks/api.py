@@ -0,0 +1,63 @@
+"""In process latency and query count of the dds2api endpoints"""
+
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from dds2api.models import BalanceEntry
+
+ENDPOINTS = (
+    ('balance-entry.list', '/api/balance-entry/'),
+    ('tag.list', '/api/tag/'),
+    ('broadcast.list', '/api/broadcast/'),
+    ('dataset.list', '/api/dataset/'),
+    ('profile.list', '/api/profile/'),
+)
+WARMUP = 3
+# page of the deep balance entry list, or the last one with fewer entries
+DEEP_PAGE = 100
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def deep_page(user):
+    """Page of the balance-entry.list.deep probe, None when the seeded
+       entries of user fit in one page"""
+    entries = BalanceEntry.objects.filter(tenant__tenant=user.username).count()
+    last_page = -(-entries // settings.REST_FRAMEWORK['PAGE_SIZE'])
+    return min(DEEP_PAGE, last_page) if last_page > 1 else None
+
+
+def run(user, iterations):
+    client = APIClient()
+    client.force_authenticate(user)
+    endpoints = list(ENDPOINTS)
+    page = deep_page(user)
+    if page is not None:
+        endpoints.insert(1, ('balance-entry.list.deep', f'/api/balance-entry/?page={page}'))
+    results = {}
+    for name, url in endpoints:
+        for _ in range(WARMUP):
+            client.get(url)
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} answered {response.status_code}')
+            queries = max(queries, len(captured))
+        results[f'api.{name}.p50_ms'] = statistics.median(timings)
+        results[f'api.{name}.p95_ms'] = percentile(timings, 0.95)
+        results[f'api.{name}.p99_ms'] = percentile(timings, 0.99)
+        results[f'api.{name}.queries'] = queries
+    return results
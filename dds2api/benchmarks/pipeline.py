@@ -0,0 +1,43 @@
+"""Throughput of the send pipeline stages, in rows per second"""
+
+import os
+import time
+from itertools import islice
+
+from dds2api.datasets import open_rows
+from dds2api.messages import build_email, render
+
+SUBJECT = 'Your statement {{ account }}'
+BODY = ('<p>Dear {{ name }},</p>'
+        '<p>the balance of account {{ account }} is {{ amount|floatformat:2 }}.</p>'
+        '{% if email %}<p>This statement was sent to {{ email }}.</p>{% endif %}')
+RENDER_ROWS = 20000
+MIME_ROWS = 5000
+ATTACHMENT = ('statement.pdf', os.urandom(50 * 1024), 'application/pdf')
+
+
+def _rate(rows, seconds):
+    return rows / seconds if seconds else 0.0
+
+
+def run(dataset):
+    results = {}
+
+    started = time.perf_counter()
+    rows = sum(1 for _ in open_rows(dataset))
+    results['pipeline.parse.rows_per_sec'] = _rate(rows, time.perf_counter() - started)
+
+    sample = list(islice(open_rows(dataset), RENDER_ROWS))
+    started = time.perf_counter()
+    for row in sample:
+        render(SUBJECT, row)
+        render(BODY, row)
+    results['pipeline.render.rows_per_sec'] = _rate(len(sample), time.perf_counter() - started)
+
+    sample = sample[:MIME_ROWS]
+    started = time.perf_counter()
+    for row in sample:
+        build_email(f'Your statement {row["account"]}', BODY, 'bench@example.com',
+                    row['email'], attachments=[ATTACHMENT])
+    results['pipeline.mime.rows_per_sec'] = _rate(len(sample), time.perf_counter() - started)
+    return results
@@ -0,0 +1,91 @@
+"""Synthetic data for the benchmarks"""
+
+import csv
+import io
+import random
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+
+from dds2api.models import (
+    BalanceEntry,
+    DataSet,
+    Profile,
+    Role,
+    Tag,
+    Tenant,
+)
+
+TENANT_PREFIX = 'bench-'
+DATASET_FIELDS = ['email', 'name', 'account', 'amount']
+BATCH_SIZE = 10000
+
+
+def seeded_users():
+    return list(get_user_model().objects
+                .filter(username__startswith=TENANT_PREFIX)
+                .order_by('username'))
+
+
+def seed(tenants, tags, balance_entries, dataset_rows):
+    """Create tenants, each with an admin user, tags, balance entries and
+       one DataSet of dataset_rows rows. Returns the users"""
+    users = []
+    for index in range(tenants):
+        name = f'{TENANT_PREFIX}{index}'
+        tenant = Tenant.objects.create(tenant=name)
+        user = get_user_model().objects.create_user(name)
+        profile = Profile.objects.create(user=user, mobile_number='',
+                                         verified_number=False, enable_2fa=False)
+        profile.tenant.add(tenant)
+        profile.roles.add(Role.objects.create(tenant=tenant, role=Role.ADMIN))
+        Tag.objects.bulk_create(
+            Tag(tenant=tenant, tag=f'tag {number}', slug=f'tag-{number}')
+            for number in range(tags))
+        seed_balance_entries(tenant, balance_entries)
+        seed_dataset(tenant, dataset_rows)
+        users.append(user)
+    return users
+
+
+def seed_balance_entries(tenant, count):
+    channels = [BalanceEntry.CHANNEL_EMAIL, BalanceEntry.CHANNEL_SMS]
+    balance = 0.0
+    for start in range(0, count, BATCH_SIZE):
+        entries = []
+        for number in range(start, min(start + BATCH_SIZE, count)):
+            qty = round(random.uniform(-10, 100), 2)
+            balance += qty
+            entries.append(BalanceEntry(tenant=tenant,
+                                        channel_type=channels[number % 2],
+                                        qty=qty,
+                                        balance=balance,
+                                        origin_type=BalanceEntry.PAYMENT,
+                                        origin_id=str(number)))
+        BalanceEntry.objects.bulk_create(entries)
+
+
+def write_csv(stream, rows):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(DATASET_FIELDS)
+    for number in range(rows):
+        writer.writerow([f'user{number}@example.com', f'User {number}',
+                         f'{number:010d}', f'{random.uniform(0, 5000):.2f}'])
+    text.detach()
+
+
+def seed_dataset(tenant, rows):
+    dataset = DataSet(tenant=tenant,
+                      original_filename='recipients.csv',
+                      description=f'{rows} rows',
+                      system_tag='benchmark',
+                      file_has_header=True,
+                      file_fields=DATASET_FIELDS)
+    with tempfile.TemporaryFile() as stream:
+        write_csv(stream, rows)
+        stream.seek(0)
+        dataset.uploaded_file.save('recipients.csv', File(stream), save=False)
+    dataset.save()
+    return dataset
@@ -0,0 +1,41 @@
+"""Process start up time, measured in fresh interpreters"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROFILES = (
+    ('web', 'dds2be.settings'),
+    ('worker', 'dds2be.settings_worker'),
+)
+RUNS = 5
+# django.setup() and the modules every process ends up importing
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from dds2api import models
+print(json.dumps({"ms": (time.perf_counter() - started) * 1000,
+                  "boto3": "boto3" in sys.modules}))
+'''
+
+
+def measure(settings_module, runs=RUNS):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], env=env, check=True,
+                                stdout=subprocess.PIPE).stdout
+        probe = json.loads(output)
+        if probe['boto3']:
+            raise RuntimeError(f'{settings_module}: importing the models imported boto3')
+        timings.append(probe['ms'])
+    return statistics.median(timings)
+
+
+def run():
+    return {f'startup.{name}.setup_ms': measure(settings_module)
+            for name, settings_module in PROFILES}
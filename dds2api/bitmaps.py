@@ -0,0 +1,169 @@
+"""
+Compressed integer sets, after roaring bitmaps
+
+Values are split by their high 16 bits into containers. A container holds
+the low 16 bits either as a sorted array('H') while it has at most
+ARRAY_MAX values, or as a 65536 bit int bitset beyond that, so sparse and
+dense sets both stay small and set operations work a container at a time.
+"""
+
+from array import array
+from bisect import bisect_left
+
+ARRAY_MAX = 4096
+LOW_MASK = 0xFFFF
+BITSET_BYTES = 65536 // 8
+# positions of the set bits of every byte value
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+def _bits(container):
+    if isinstance(container, int):
+        return container
+    bits = 0
+    for value in container:
+        bits |= 1 << value
+    return bits
+
+
+def _cardinality(container):
+    return bin(container).count('1') if isinstance(container, int) else len(container)
+
+
+def _values(container):
+    if not isinstance(container, int):
+        return iter(container)
+    return _bit_values(container)
+
+
+def _bit_values(bits):
+    for index, byte in enumerate(bits.to_bytes(BITSET_BYTES, 'little')):
+        if byte:
+            base = index << 3
+            for offset in BYTE_BITS[byte]:
+                yield base | offset
+
+
+def _copy(container):
+    # arrays are changed in place by Bitmap.add, ints are immutable
+    return container if isinstance(container, int) else array('H', container)
+
+
+def _compact(container):
+    """Smallest representation of a container, None when empty"""
+    if isinstance(container, int):
+        if not container:
+            return None
+        if _cardinality(container) <= ARRAY_MAX:
+            return array('H', _bit_values(container))
+        return container
+    if not container:
+        return None
+    if len(container) > ARRAY_MAX:
+        return _bits(container)
+    return container
+
+
+def _and(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return _compact(left & right)
+    if isinstance(left, int):
+        left, right = right, left
+    if isinstance(right, int):
+        return _compact(array('H', (value for value in left if right >> value & 1)))
+    return _compact(array('H', sorted(set(left).intersection(right))))
+
+
+def _or(left, right):
+    if isinstance(left, int) or isinstance(right, int) or len(left) + len(right) > ARRAY_MAX:
+        return _compact(_bits(left) | _bits(right))
+    return _compact(array('H', sorted(set(left).union(right))))
+
+
+def _andnot(left, right):
+    if isinstance(left, int):
+        return _compact(left & ~_bits(right))
+    if isinstance(right, int):
+        return _compact(array('H', (value for value in left if not right >> value & 1)))
+    return _compact(array('H', sorted(set(left).difference(right))))
+
+
+class Bitmap:
+    """Set of non negative ints"""
+
+    __slots__ = ('_containers',)
+
+    def __init__(self, values=()):
+        self._containers = {}
+        pending = {}
+        for value in values:
+            pending.setdefault(value >> 16, set()).add(value & LOW_MASK)
+        for key, low in pending.items():
+            self._containers[key] = _compact(array('H', sorted(low)))
+
+    @classmethod
+    def _from_containers(cls, containers):
+        bitmap = cls()
+        bitmap._containers = {key: container for key, container in containers.items()
+                              if container is not None}
+        return bitmap
+
+    def add(self, value):
+        key, low = value >> 16, value & LOW_MASK
+        container = self._containers.get(key)
+        if container is None:
+            self._containers[key] = array('H', [low])
+        elif isinstance(container, int):
+            self._containers[key] = container | 1 << low
+        else:
+            index = bisect_left(container, low)
+            if index == len(container) or container[index] != low:
+                container.insert(index, low)
+                if len(container) > ARRAY_MAX:
+                    self._containers[key] = _bits(container)
+
+    def __contains__(self, value):
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __len__(self):
+        return sum(map(_cardinality, self._containers.values()))
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def __iter__(self):
+        for key in sorted(self._containers):
+            high = key << 16
+            for low in _values(self._containers[key]):
+                yield high | low
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and list(self) == list(other)
+
+    def __and__(self, other):
+        return Bitmap._from_containers({
+            key: _and(container, other._containers[key])
+            for key, container in self._containers.items() if key in other._containers})
+
+    def __or__(self, other):
+        containers = {key: _copy(container) for key, container in self._containers.items()}
+        for key, container in other._containers.items():
+            containers[key] = (_or(containers[key], container) if key in containers
+                               else _copy(container))
+        return Bitmap._from_containers(containers)
+
+    def __sub__(self, other):
+        return Bitmap._from_containers({
+            key: (_andnot(container, other._containers[key])
+                  if key in other._containers else _copy(container))
+            for key, container in self._containers.items()})
+
+    def __repr__(self):
+        return f'<Bitmap of {len(self)}>'
@@ -0,0 +1,23 @@
+"""dds2api system checks"""
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):  # pylint: disable=W0613
+    """The revocation markers of the token claims and sessions and the
+       read replica pins are written by the process that handles the
+       change and read by all the others"""
+    backend = import_string(settings.CACHES['default']['BACKEND'])
+    if settings.DEBUG or not issubclass(backend, LocMemCache):
+        return []
+    return [Error(
+        'The default cache is a per process LocMemCache, a revoked tenant or '
+        'role claim stays valid and a replica pin is missed in the other '
+        'processes.',
+        hint="Set DJANGO_CACHE_BACKEND to a shared cache, e.g. "
+             "'dds2api.instrumentation.InstrumentedMemcachedCache'.",
+        id='dds2api.E001')]
@@ -0,0 +1,93 @@
+"""
+Decrypted StorageCredential secrets
+
+Decrypting the envelope and building a boto3 client both cost more than
+the request they serve, so every process keeps the last
+DDS2API_CREDENTIAL_CACHE_SIZE of them for DDS2API_CREDENTIAL_CACHE_SECONDS.
+Entries are keyed by secrets_version: a credential saved with new secrets
+misses in every process, invalidate() drops it at once in this one.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .kms import decrypt
+
+
+def _client(**kwargs):
+    import boto3  # imported here to keep boto3 out of the process start up
+    # a session per client, the default one is not thread safe
+    return boto3.session.Session().client('s3', **kwargs)
+
+
+class CredentialEntry:
+    """Secrets of one version of a StorageCredential and its client"""
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.lock = threading.Lock()
+        self._client = None
+
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                self._client = _client(
+                    aws_access_key_id=self.secrets['access_key_id'],
+                    aws_secret_access_key=self.secrets['secret_access_key'])
+            return self._client
+
+
+class CredentialCache:
+    """LRU of CredentialEntry with a time to live"""
+
+    def __init__(self, max_entries, max_age):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, credential):
+        key = (credential.pk, credential.secrets_version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+        entry = CredentialEntry(json.loads(decrypt(credential.secrets_envelope).decode('utf-8')))
+        with self._lock:
+            self._entries[key] = (now + self.max_age, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, credential_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == credential_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache(settings.DDS2API_CREDENTIAL_CACHE_SIZE,  # pylint: disable=C0103
+                                   settings.DDS2API_CREDENTIAL_CACHE_SECONDS)
+
+
+def credential_secrets(credential):
+    """{'access_key_id': ..., 'secret_access_key': ...} of credential"""
+    return credential_cache.get(credential).secrets
+
+
+def s3_client(credential):
+    return credential_cache.get(credential).client()
+
+
+def invalidate(credential_id):
+    credential_cache.invalidate(credential_id)
@@ -0,0 +1,542 @@
+"""
+DataSet file parsing and versions
+
+An uploaded file is ingested into segments: immutable chunks of at most
+DDS2API_DATASET_SEGMENT_ROWS rows in a canonical form (utf-8 CSV of the
+DataSet fields), each with its own statistics. A version is an ordered list
+of segments and reading one is reading a consistent snapshot, whatever is
+ingested afterwards.
+
+Deltas never rewrite segments: an append adds segments, an upsert adds
+UPSERT segments whose rows replace the ones with the same key in the
+earlier segments when the version is read (the keys of the UPSERT segments
+are kept in memory meanwhile). The version statistics are merged from the
+ones of its segments, so a delta only computes the statistics of its own
+rows. Once the upserted rows pass DDS2API_DATASET_COMPACT_RATIO of the
+DataSet a compaction rewrites the current version into plain segments.
+
+Segments are written before the DataSet row is locked, the lock is only
+held to make the new version current; segments that lose that race are
+deleted with the unused ones by prune_versions().
+"""
+
+import csv
+import io
+import random
+import sys
+import tempfile
+import uuid
+import zlib
+from array import array
+from base64 import b64decode, b64encode
+from collections import Counter
+from datetime import timedelta
+from heapq import nlargest
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    DataSet,
+    DataSetDelta,
+    DataSetSegment,
+    DataSetStats,
+    DataSetVersion,
+)
+from .sketches import HyperLogLog, hash64
+
+# a sketch per field and segment, 4 KiB and a 1.6% standard error
+SEGMENT_PRECISION = 12
+
+
+# changing any of these DataSet fields means ingesting its file again
+PARSING_FIELDS = ('uploaded_file', 'file_encoding', 'file_has_header',
+                  'file_fields', 'file_delimiter', 'file_quotechar', 'key_field')
+
+
+class DataSetNotIngested(Exception):
+    """A delta arrived before the DataSet file was ingested, retried"""
+
+
+class VersionMoved(Exception):
+    """The fields of the current version changed while a delta was written,
+       retried"""
+
+
+class DeltaRejected(Exception):
+    pass
+
+
+def read_rows(dataset, stream):
+    """Yield the rows of a DataSet file (a binary stream) as dicts keyed
+       by the DataSet file_fields"""
+    text = io.TextIOWrapper(stream, encoding=dataset.file_encoding, newline='')
+    reader = csv.reader(text,
+                        delimiter=dataset.file_delimiter,
+                        quotechar=dataset.file_quotechar)
+    if dataset.file_has_header:
+        next(reader, None)
+    fields = dataset.file_fields
+    for row in reader:
+        yield dict(zip(fields, row))
+
+
+def open_rows(dataset, version=None):
+    """Rows of version, by default the current version of dataset and its
+       uploaded file until it is ingested"""
+    version = version or dataset.current_version
+    if version is not None:
+        yield from version_rows(version)
+        return
+    with dataset.uploaded_file.open('rb') as stream:
+        yield from read_rows(dataset, stream)
+
+
+def snapshot_key(dataset):
+    """Changes whenever the rows open_rows(dataset) reads change, for the
+       caches of decoded rows"""
+    if dataset.current_version_id is not None:
+        return ('version', dataset.current_version_id)
+    return ('file', dataset.uploaded_file.name, dataset.modified_on)
+
+
+def normalize(value):
+    """Form used to dedupe addresses and numbers"""
+    return value.strip().lower()
+
+
+def compute_stats(dataset, sample_size=None):
+    """Row count, estimated distinct and empty values per field and a
+       uniform sample (reservoir) of the rows, in one pass over the file.
+       Ingested DataSets get the ones of their current version"""
+    if dataset.current_version_id is not None:
+        return version_stats(dataset.current_version)
+    sample_size = sample_size or settings.DDS2API_DATASET_SAMPLE_ROWS
+    rng = random.Random(dataset.pk)
+    sketches = {field: HyperLogLog() for field in dataset.file_fields if field}
+    empty = Counter()
+    sample = []
+    rows = 0
+    for row in open_rows(dataset):
+        rows += 1
+        for field, sketch in sketches.items():
+            value = normalize(row.get(field, ''))
+            if value:
+                sketch.add(value)
+            else:
+                empty[field] += 1
+        if len(sample) < sample_size:
+            sample.append(row)
+        else:
+            index = rng.randrange(rows)
+            if index < sample_size:
+                sample[index] = row
+    return DataSetStats(
+        dataset=dataset,
+        rows=rows,
+        size=dataset.uploaded_file.size,
+        fields={field: {'distinct': sketch.count(), 'empty': empty[field]}
+                for field, sketch in sketches.items()},
+        sample=sample)
+
+
+def row_key(row, key_field):
+    return row.get(key_field, '').strip()
+
+
+def _pack_keys(hashes):
+    packed = array('Q', sorted(hashes))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_keys(data):
+    hashes = array('Q')
+    hashes.frombytes(data)
+    if sys.byteorder == 'big':
+        hashes.byteswap()
+    return hashes
+
+
+def _encode_sketch(sketch):
+    return b64encode(zlib.compress(sketch.to_bytes())).decode('ascii')
+
+
+def _decode_sketch(encoded):
+    return HyperLogLog.from_bytes(zlib.decompress(b64decode(encoded)))
+
+
+class SegmentWriter:
+    """Writes rows into segments of at most max_rows rows, with their
+       statistics and, for a key_field, their key hashes"""
+
+    def __init__(self, dataset, fields, key_field='', kind=DataSetSegment.BASE,
+                 max_rows=None, sample_size=None):
+        self.dataset = dataset
+        self.fields = list(fields)
+        self.key_field = key_field
+        self.kind = kind
+        self.max_rows = max_rows or settings.DDS2API_DATASET_SEGMENT_ROWS
+        self.sample_size = sample_size or settings.DDS2API_DATASET_SAMPLE_ROWS
+        self.segments = []
+        self.rows = 0
+        self._rng = random.Random(dataset.pk)
+        self._start()
+
+    def _start(self):
+        self._text = io.TextIOWrapper(tempfile.TemporaryFile(), encoding='utf-8', newline='')
+        self._writer = csv.writer(self._text)
+        self._sketches = {field: HyperLogLog(SEGMENT_PRECISION)
+                          for field in self.fields if field}
+        self._empty = Counter()
+        self._sample = []
+        self._keys = []
+        self._rows = 0
+
+    def write(self, row):
+        self._writer.writerow([row.get(field, '') for field in self.fields])
+        self._rows += 1
+        self.rows += 1
+        for field, sketch in self._sketches.items():
+            value = normalize(row.get(field, ''))
+            if value:
+                sketch.add(value)
+            else:
+                self._empty[field] += 1
+        if len(self._sample) < self.sample_size:
+            self._sample.append(row)
+        else:
+            index = self._rng.randrange(self._rows)
+            if index < self.sample_size:
+                self._sample[index] = row
+        if self.key_field:
+            self._keys.append(hash64(row_key(row, self.key_field)))
+        if self._rows >= self.max_rows:
+            self._flush()
+            self._start()
+
+    def _flush(self):
+        if not self._rows:
+            self._text.close()
+            return
+        self._text.flush()
+        stream = self._text.buffer
+        size = stream.tell()
+        stream.seek(0)
+        segment = DataSetSegment(
+            dataset=self.dataset,
+            kind=self.kind,
+            rows=self._rows,
+            size=size,
+            stats={
+                'fields': {field: {'sketch': _encode_sketch(sketch),
+                                   'empty': self._empty[field]}
+                           for field, sketch in self._sketches.items()},
+                'sample': self._sample,
+            })
+        name = f'{self.dataset.pk}-{uuid.uuid4().hex}'
+        segment.file.save(f'{name}.csv', File(stream), save=False)
+        if self.key_field:
+            segment.keys_file.save(f'{name}.keys', ContentFile(_pack_keys(self._keys)),
+                                   save=False)
+        segment.save()
+        self._text.close()
+        self.segments.append(segment)
+
+    def close(self):
+        """The segments written"""
+        self._flush()
+        return self.segments
+
+
+def version_segments(version):
+    segments = DataSetSegment.objects.in_bulk(version.segments)
+    return [segments[segment_id] for segment_id in version.segments]
+
+
+def segment_keys(segment):
+    with segment.keys_file.open('rb') as stream:
+        return _unpack_keys(stream.read())
+
+
+def superseded_keys(segments):
+    """key hash -> index of the last UPSERT segment with the key"""
+    latest = {}
+    for index, segment in enumerate(segments):
+        if segment.kind == DataSetSegment.UPSERT:
+            for hashed in segment_keys(segment):
+                latest[hashed] = index
+    return latest
+
+
+def segment_rows(segment, fields):
+    with segment.file.open('rb') as stream:
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        for row in csv.reader(text):
+            yield dict(zip(fields, row))
+
+
+def live_rows(segments, key_field, latest):
+    """Rows of segments, without the ones replaced by a later UPSERT segment"""
+    for index, rows in enumerate(segments):
+        if not latest:
+            yield from rows
+            continue
+        for row in rows:
+            if latest.get(hash64(row_key(row, key_field)), index) <= index:
+                yield row
+
+
+def version_rows(version):
+    segments = version_segments(version)
+    yield from live_rows((segment_rows(segment, version.fields) for segment in segments),
+                         version.key_field, superseded_keys(segments))
+
+
+def merge_sample(samples, sample_size, rng):
+    """Sample of sample_size rows out of (rows, segment rows) samples,
+       each row weighted by the segment rows it stands for"""
+    weighted = []
+    for sample, rows in samples:
+        if sample:
+            weight = rows / len(sample)
+            weighted.extend((rng.random() ** (1 / weight), index, row)
+                            for index, row in enumerate(sample))
+    return [row for _, _, row in nlargest(sample_size, weighted, key=lambda item: item[:2])]
+
+
+def version_stats(version, sample_size=None):
+    """DataSetStats of a version from the statistics of its segments. The
+       distinct counts are the ones of the union, upserted rows add their
+       values without taking the replaced ones away until a compaction"""
+    sample_size = sample_size or settings.DDS2API_DATASET_SAMPLE_ROWS
+    segments = version_segments(version)
+    latest = superseded_keys(segments)
+    sketches = {}
+    empty = Counter()
+    samples = []
+    for index, segment in enumerate(segments):
+        for field, stats in segment.stats['fields'].items():
+            sketch = _decode_sketch(stats['sketch'])
+            if field in sketches:
+                sketches[field].merge(sketch)
+            else:
+                sketches[field] = sketch
+            empty[field] += stats['empty']
+        sample = segment.stats['sample']
+        if latest:
+            sample = [row for row in sample
+                      if latest.get(hash64(row_key(row, version.key_field)), index) <= index]
+        samples.append((sample, segment.rows))
+    return DataSetStats(
+        dataset_id=version.dataset_id,
+        version=version,
+        rows=version.rows,
+        size=sum(segment.size for segment in segments),
+        fields={field: {'distinct': sketch.count(), 'empty': empty[field]}
+                for field, sketch in sketches.items()},
+        sample=merge_sample(samples, sample_size, random.Random(version.pk)))
+
+
+def _publish(dataset, kind, segment_ids, rows):
+    """Make a new version of dataset current, with its statistics"""
+    number = dataset.versions.aggregate(Max('number'))['number__max'] or 0
+    version = DataSetVersion.objects.create(
+        dataset=dataset,
+        number=number + 1,
+        kind=kind,
+        fields=dataset.file_fields if kind == DataSetVersion.FULL
+        else dataset.current_version.fields,
+        key_field=dataset.key_field if kind == DataSetVersion.FULL
+        else dataset.current_version.key_field,
+        segments=segment_ids,
+        rows=rows)
+    # update(), a save() would write an OutboxEvent
+    DataSet.objects.filter(pk=dataset.pk).update(current_version=version)
+    dataset.current_version = version
+    stats = version_stats(version)
+    DataSetStats.objects.filter(dataset=dataset).delete()
+    stats.save()
+    return version
+
+
+def parsing_state(dataset):
+    return [str(getattr(dataset, name)) for name in PARSING_FIELDS]
+
+
+def ingest(dataset_id):
+    """New version of a DataSet from its uploaded file, None without one or
+       when the file or its parsing changed meanwhile (that change ingests
+       it again)"""
+    dataset = DataSet.objects.filter(pk=dataset_id).exclude(uploaded_file='').first()
+    if dataset is None:
+        return None
+    writer = SegmentWriter(dataset, dataset.file_fields, dataset.key_field)
+    with dataset.uploaded_file.open('rb') as stream:
+        for row in read_rows(dataset, stream):
+            writer.write(row)
+    segments = writer.close()
+    with transaction.atomic():
+        locked = DataSet.objects.select_for_update().filter(pk=dataset_id).first()
+        if locked is None or parsing_state(locked) != parsing_state(dataset):
+            return None
+        return _publish(locked, DataSetVersion.FULL,
+                        [segment.pk for segment in segments], writer.rows)
+
+
+def _delta_rows(dataset, delta, key_field):
+    with delta.uploaded_file.open('rb') as stream:
+        rows = read_rows(dataset, stream)
+        if delta.mode == DataSetDelta.APPEND:
+            yield from rows
+            return
+        # the last row of a key wins
+        keyed = {}
+        for number, row in enumerate(rows):
+            key = row_key(row, key_field)
+            if not key:
+                raise DeltaRejected(f'Row {number} has no {key_field}.')
+            keyed[key] = row
+    yield from keyed.values()
+
+
+def replaced_rows(segments, upserted):
+    """Live rows of segments whose key hash is in upserted: every row of a
+       key no UPSERT segment has, duplicates included, else the row of its
+       last UPSERT segment"""
+    latest = superseded_keys(segments)
+    replaced = 0
+    for index, segment in enumerate(segments):
+        replaced += sum(1 for hashed in segment_keys(segment)
+                        if hashed in upserted and latest.get(hashed, index) == index)
+    return replaced
+
+
+def _write_delta(dataset, version, delta):
+    """(segments, rows) of the rows of delta, keys repeated in an UPSERT
+       delta are written once"""
+    if delta.mode == DataSetDelta.UPSERT and not version.key_field:
+        raise DeltaRejected('The DataSet has no key field.')
+    kind = (DataSetSegment.UPSERT if delta.mode == DataSetDelta.UPSERT
+            else DataSetSegment.BASE)
+    writer = SegmentWriter(dataset, version.fields, version.key_field, kind)
+    for row in _delta_rows(dataset, delta, version.key_field):
+        writer.write(row)
+    return writer.close(), writer.rows
+
+
+def _apply(dataset, delta, segments, rows):
+    version = dataset.current_version
+    replaced = 0
+    if delta.mode == DataSetDelta.UPSERT and segments:
+        upserted = set()
+        for segment in segments:
+            upserted.update(segment_keys(segment))
+        replaced = replaced_rows(version_segments(version), upserted)
+    new_version = _publish(dataset, delta.mode,
+                           version.segments + [segment.pk for segment in segments],
+                           version.rows + rows - replaced)
+    DataSetDelta.objects.filter(pk=delta.pk).update(
+        status=DataSetDelta.APPLIED, version=new_version, rows=rows, replaced=replaced)
+    return new_version
+
+
+def needs_compaction(version):
+    upserted = (DataSetSegment.objects
+                .filter(pk__in=version.segments, kind=DataSetSegment.UPSERT)
+                .values_list('rows', flat=True))
+    return sum(upserted) > settings.DDS2API_DATASET_COMPACT_RATIO * max(version.rows, 1)
+
+
+def apply_delta(delta_id):
+    """Apply a pending DataSetDelta on top of the current version, returns
+       the new version, None when the delta was rejected"""
+    delta = DataSetDelta.objects.filter(pk=delta_id, status=DataSetDelta.PENDING).first()
+    if delta is None:
+        return None
+    dataset = DataSet.objects.select_related('current_version').get(pk=delta.dataset_id)
+    version = dataset.current_version
+    if version is None:
+        raise DataSetNotIngested(f'DataSet {dataset.pk} is not ingested yet')
+    try:
+        segments, rows = _write_delta(dataset, version, delta)
+        with transaction.atomic():
+            # deltas of a DataSet apply one after the other
+            dataset = (DataSet.objects
+                       .select_for_update()
+                       .select_related('current_version')
+                       .get(pk=delta.dataset_id))
+            if not DataSetDelta.objects.filter(pk=delta.pk,
+                                               status=DataSetDelta.PENDING).exists():
+                # applied by another run of the job
+                return None
+            current = dataset.current_version
+            if (current.fields, current.key_field) != (version.fields, version.key_field):
+                raise VersionMoved(f'DataSet {dataset.pk} was ingested again')
+            return _apply(dataset, delta, segments, rows)
+    except DeltaRejected as exc:
+        DataSetDelta.objects.filter(pk=delta.pk).update(status=DataSetDelta.REJECTED,
+                                                        error=str(exc))
+    except (UnicodeDecodeError, csv.Error) as exc:
+        DataSetDelta.objects.filter(pk=delta.pk).update(status=DataSetDelta.REJECTED,
+                                                        error=str(exc)[:256])
+    return None
+
+
+def compact(dataset_id):
+    """Rewrite the current version without UPSERT segments, None when
+       there are none"""
+    dataset = DataSet.objects.select_related('current_version').get(pk=dataset_id)
+    version = dataset.current_version
+    if version is None or not (DataSetSegment.objects
+                               .filter(pk__in=version.segments,
+                                       kind=DataSetSegment.UPSERT)
+                               .exists()):
+        return None
+    writer = SegmentWriter(dataset, version.fields, version.key_field)
+    for row in version_rows(version):
+        writer.write(row)
+    segments = writer.close()
+    with transaction.atomic():
+        dataset = DataSet.objects.select_for_update().get(pk=dataset_id)
+        if dataset.current_version_id != version.pk:
+            # a delta or an ingestion came first, the next delta compacts
+            return None
+        return _publish(dataset, DataSetVersion.COMPACT,
+                        [segment.pk for segment in segments], writer.rows)
+
+
+def prune_versions(max_age=None):
+    """Delete the versions older than max_age seconds that are neither
+       current nor pinned by a Broadcast, then the segments and files no
+       version uses. Returns (versions, segments) deleted"""
+    max_age = (settings.DDS2API_DATASET_VERSION_RETENTION_SECONDS
+               if max_age is None else max_age)
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    current = (DataSet.objects
+               .filter(current_version__isnull=False)
+               .values('current_version'))
+    versions, _ = (DataSetVersion.objects
+                   .filter(created_on__lt=cutoff)
+                   .exclude(pk__in=current)
+                   .exclude(broadcast__isnull=False)
+                   .delete())
+    used = set()
+    for segment_ids in DataSetVersion.objects.values_list('segments', flat=True).iterator():
+        used.update(segment_ids)
+    orphans = [segment for segment in DataSetSegment.objects
+               .filter(created_on__lt=cutoff)
+               .only('id', 'file', 'keys_file')
+               .iterator()
+               if segment.pk not in used]
+    for segment in orphans:
+        segment.file.delete(save=False)
+        if segment.keys_file:
+            segment.keys_file.delete(save=False)
+    DataSetSegment.objects.filter(pk__in=[segment.pk for segment in orphans]).delete()
+    return versions, len(orphans)
@@ -0,0 +1,327 @@
+"""
+Generated attachments
+
+An Attachment with the GENERATED origin renders its document_template (a
+Django template, HTML) for every row, as HTML or, with weasyprint
+installed, PDF. Its file is an optional zip of the assets the template
+refers to as asset:<name> (stylesheets, images, fonts); nothing else is
+fetched.
+
+Starting a renderer (Django, weasyprint and its fonts) takes far longer
+than rendering a statement, so documents are rendered by a pool of
+long-lived run_renderer processes that talk length prefixed frames over
+their stdin and stdout. A renderer keeps the compiled templates and decoded
+assets of the last DDS2API_RENDERER_TEMPLATES attachment versions, the
+pool only sends a template to a renderer that does not have it. The
+document comes back in chunks that stay in memory, no temporary files.
+"""
+
+import io
+import json
+import mimetypes
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import zipfile
+from base64 import b64decode, b64encode
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.template import Context
+
+from .models import Attachment
+from .template_builtins import TenantEngine
+
+FRAME = struct.Struct('>I')
+CHUNK_SIZE = 64 * 1024
+CONTENT_TYPES = {
+    Attachment.DOCUMENT_HTML: 'text/html; charset=utf-8',
+    Attachment.DOCUMENT_PDF: 'application/pdf',
+}
+ASSET_SCHEME = 'asset:'
+
+Document = namedtuple('Document', 'key format source assets')
+
+
+class RenderError(Exception):
+    pass
+
+
+class RendererExited(RenderError):
+    """The renderer process died or was killed, it is not reused"""
+
+
+def read_frame(stream):
+    """Payload of the next frame, None at the end of the stream"""
+    header = stream.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None
+    size, = FRAME.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return payload
+
+
+def write_frame(stream, payload):
+    stream.write(FRAME.pack(len(payload)) + payload)
+
+
+def document_key(attachment):
+    """Changes whenever the template, the format or the assets change"""
+    return f'{attachment.pk}:{attachment.modified_on.timestamp()}'
+
+
+def load_assets(attachment):
+    """{name: base64 content} of the assets zip of attachment, the zip and
+       its uncompressed assets may not exceed DDS2API_DOCUMENT_ASSETS_MAX_BYTES"""
+    if not attachment.file:
+        return {}
+    limit = settings.DDS2API_DOCUMENT_ASSETS_MAX_BYTES
+    with attachment.file.open('rb') as stream:
+        content = stream.read(limit + 1)
+    if len(content) > limit:
+        raise RenderError(f'the assets of {attachment} are over {limit} bytes')
+    assets, left = {}, limit
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            # file_size is what the archive claims, read no more than is left
+            with archive.open(info) as member:
+                data = member.read(left + 1)
+            left -= len(data)
+            if left < 0:
+                raise RenderError(
+                    f'the assets of {attachment} uncompress to over {limit} bytes')
+            assets[info.filename] = b64encode(data).decode('ascii')
+    except zipfile.BadZipFile as exc:
+        raise RenderError(f'the assets of {attachment} are not a valid zip: {exc}')
+    return assets
+
+
+# renderer side
+
+class DocumentRenderer:
+    """Renders requests with the compiled templates of the last
+       max_templates documents"""
+
+    def __init__(self, max_templates=None):
+        self.max_templates = max_templates or settings.DDS2API_RENDERER_TEMPLATES
+        self._engine = TenantEngine()
+        self._documents = OrderedDict()
+
+    def _document(self, request):
+        key = request['key']
+        if 'source' in request:
+            assets = {name: b64decode(content)
+                      for name, content in request.get('assets', {}).items()}
+            self._documents[key] = (self._engine.from_string(request['source']), assets)
+            while len(self._documents) > self.max_templates:
+                self._documents.popitem(last=False)
+        elif key not in self._documents:
+            return None
+        self._documents.move_to_end(key)
+        return self._documents[key]
+
+    def render(self, request):
+        """(content type, bytes) of a request, None when the template of the
+           request is not cached and was not sent"""
+        document = self._document(request)
+        if document is None:
+            return None
+        template, assets = document
+        html = template.render(Context(request['row']))
+        if request['format'] == Attachment.DOCUMENT_PDF:
+            return CONTENT_TYPES[Attachment.DOCUMENT_PDF], html_to_pdf(html, assets)
+        return CONTENT_TYPES[Attachment.DOCUMENT_HTML], html.encode('utf-8')
+
+
+def html_to_pdf(html, assets):
+    try:
+        import weasyprint  # optional, only needed for PDF documents
+    except ImportError:
+        raise RenderError('PDF documents need the weasyprint package')
+
+    def fetch(url):
+        if not url.startswith(ASSET_SCHEME) or url[len(ASSET_SCHEME):] not in assets:
+            raise ValueError(f'{url} is not an asset')
+        name = url[len(ASSET_SCHEME):]
+        return {'string': assets[name], 'mime_type': mimetypes.guess_type(name)[0]}
+    return weasyprint.HTML(string=html, url_fetcher=fetch).write_pdf()
+
+
+def serve(stdin, stdout, renderer=None):
+    """Answer the requests of stdin until it closes: a header frame
+       ({"content_type"}, {"missing": true} or {"error"}), then the content
+       in frames and an empty frame"""
+    renderer = renderer or DocumentRenderer()
+    while True:
+        request = read_frame(stdin)
+        if request is None:
+            return
+        try:
+            rendered = renderer.render(json.loads(request.decode('utf-8')))
+        except Exception as exc:  # pylint: disable=W0703
+            header, rendered = {'error': f'{type(exc).__name__}: {exc}'}, None
+        else:
+            header = {'missing': True} if rendered is None else {'content_type': rendered[0]}
+        write_frame(stdout, json.dumps(header).encode('utf-8'))
+        if rendered is not None:
+            content = rendered[1]
+            for start in range(0, len(content), CHUNK_SIZE):
+                write_frame(stdout, content[start:start + CHUNK_SIZE])
+            write_frame(stdout, b'')
+        stdout.flush()
+
+
+# pool side
+
+class RendererProcess:
+    """A run_renderer process and the documents it has been sent"""
+
+    def __init__(self, command, max_templates):
+        self.max_templates = max_templates
+        self.known = OrderedDict()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         cwd=settings.BASE_DIR)
+
+    def _send(self, request):
+        write_frame(self._process.stdin, json.dumps(request).encode('utf-8'))
+        self._process.stdin.flush()
+        header = read_frame(self._process.stdout)
+        if header is None:
+            raise RendererExited('the renderer exited')
+        return json.loads(header.decode('utf-8'))
+
+    def render(self, document, row):
+        """(content type, chunks) of document for row"""
+        request = {'key': document.key, 'format': document.format, 'row': row}
+        if document.key not in self.known:
+            request.update(source=document.source, assets=document.assets)
+        header = self._send(request)
+        if header.get('missing'):
+            # it evicted the template before we expected it to
+            request.update(source=document.source, assets=document.assets)
+            header = self._send(request)
+        self.known[document.key] = True
+        self.known.move_to_end(document.key)
+        while len(self.known) > self.max_templates:
+            self.known.popitem(last=False)
+        if 'error' in header:
+            raise RenderError(header['error'])
+        chunks = []
+        while True:
+            chunk = read_frame(self._process.stdout)
+            if chunk is None:
+                raise RendererExited('the renderer exited')
+            if not chunk:
+                return header['content_type'], chunks
+            chunks.append(chunk)
+
+    def kill(self):
+        self._process.kill()
+        self._process.wait()
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+class RendererPool:
+    """Up to size warm renderer processes, started on first use. A request
+       that times out kills its process"""
+
+    def __init__(self, size=None, command=None, timeout=None, max_templates=None):
+        self.size = size or settings.DDS2API_RENDERER_PROCESSES
+        self.command = command or [sys.executable, '-m', 'django', 'run_renderer']
+        self.timeout = timeout or settings.DDS2API_RENDERER_TIMEOUT
+        self.max_templates = max_templates or settings.DDS2API_RENDERER_TEMPLATES
+        self._idle = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start = self._started < self.size
+            if start:
+                self._started += 1
+        if not start:
+            return self._idle.get()
+        try:
+            return RendererProcess(self.command, self.max_templates)
+        except OSError:
+            with self._lock:
+                self._started -= 1
+            raise
+
+    def render(self, document, row):
+        """(content type, chunks) of document for row"""
+        process = self._checkout()
+        watchdog = threading.Timer(self.timeout, process.kill)
+        watchdog.start()
+        try:
+            rendered = process.render(document, row)
+        except (RendererExited, OSError) as exc:
+            with self._lock:
+                self._started -= 1
+            process.kill()
+            raise RendererExited(f'renderer failed: {exc}')
+        except RenderError:
+            self._idle.put(process)
+            raise
+        finally:
+            watchdog.cancel()
+        self._idle.put(process)
+        return rendered
+
+    def close(self):
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._started -= 1
+            process.close()
+
+
+class DocumentCache:
+    """Documents (template source and assets) of the last max_documents
+       attachment versions, so that assets are read from storage once"""
+
+    def __init__(self, max_documents):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, attachment):
+        key = document_key(attachment)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+        document = Document(key, attachment.document_format, attachment.document_template,
+                            load_assets(attachment))
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return document
+
+
+renderer_pool = RendererPool()  # pylint: disable=C0103
+documents = DocumentCache(settings.DDS2API_RENDERER_TEMPLATES)  # pylint: disable=C0103
+
+
+def render_attachment(attachment, row):
+    """(content type, chunks) of the document of a GENERATED attachment"""
+    return renderer_pool.render(documents.get(attachment), row)
@@ -0,0 +1,139 @@
+"""
+Domain verification
+
+A domain is verified when it publishes an SPF policy (that includes
+DDS2API_SPF_INCLUDE when it is set), the DKIM key of the
+DDS2API_DKIM_SELECTOR selector and a DMARC policy. MX hosts are recorded
+for the sending pipeline. verify_due_domains() is run on a schedule by the
+verify_domains command; broadcasts only read the stored result
+(Domain.is_sendable()), they never query DNS.
+"""
+
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Domain
+from .resolver import DNSError, Resolver, TYPE_MX, TYPE_TXT
+
+
+def _spf(records):
+    for record in records:
+        if record.lower().startswith('v=spf1'):
+            return record
+    return ''
+
+
+def _dkim(records):
+    for record in records:
+        tags = dict(tag.strip().partition('=')[::2] for tag in record.split(';'))
+        if tags.get('p'):
+            return record
+    return ''
+
+
+def _dmarc(records):
+    for record in records:
+        if record.replace(' ', '').lower().startswith('v=dmarc1'):
+            return record
+    return ''
+
+
+async def check_domain(resolver, name):
+    """DNS records and verification result of a domain name, raises
+       DNSError when a lookup fails"""
+    selector = settings.DDS2API_DKIM_SELECTOR
+    spf, dkim, dmarc, mx = await asyncio.gather(
+        resolver.query(name, TYPE_TXT),
+        resolver.query(f'{selector}._domainkey.{name}', TYPE_TXT),
+        resolver.query(f'_dmarc.{name}', TYPE_TXT),
+        resolver.query(name, TYPE_MX))
+    records = {
+        'spf': _spf(spf.records),
+        'dkim': _dkim(dkim.records),
+        'dmarc': _dmarc(dmarc.records),
+        'mx': [host for _, host in sorted(mx.records)],
+    }
+    include = settings.DDS2API_SPF_INCLUDE
+    spf_ok = bool(records['spf']) and (
+        not include or f'include:{include}' in records['spf'].lower().split())
+    return {
+        'records': records,
+        'verified': spf_ok and bool(records['dkim']) and bool(records['dmarc']),
+        'ttl': min(answer.ttl for answer in (spf, dkim, dmarc, mx)),
+    }
+
+
+async def check_domains(names, resolver, concurrency):
+    """{name: check_domain() result or DNSError} of the distinct names"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(name):
+        async with semaphore:
+            try:
+                return name, await check_domain(resolver, name)
+            except DNSError as exc:
+                return name, exc
+
+    return dict(await asyncio.gather(*(check(name) for name in set(names))))
+
+
+def next_check(now, ttl):
+    """Re-check when the records may have changed, within the configured
+       bounds"""
+    seconds = max(settings.DDS2API_DOMAIN_RECHECK_MIN_SECONDS,
+                  min(ttl, settings.DDS2API_DOMAIN_RECHECK_MAX_SECONDS))
+    return now + timedelta(seconds=seconds)
+
+
+def due_domains(now):
+    return Domain.objects.filter(
+        Q(next_check_on__isnull=True) | Q(next_check_on__lte=now)
+    ).order_by(F('next_check_on').asc(nulls_first=True))
+
+
+_resolver = None  # pylint: disable=C0103
+
+
+def get_resolver():
+    """Process wide resolver, its cache lives as long as the worker"""
+    global _resolver  # pylint: disable=W0603,C0103
+    if _resolver is None:
+        _resolver = Resolver(timeout=settings.DDS2API_DNS_TIMEOUT)
+    return _resolver
+
+
+def verify_due_domains(batch_size=500, concurrency=50, resolver=None):
+    """Check up to batch_size domains that are due, returns how many were
+       checked. Lookup failures keep the current result and are retried
+       after DDS2API_DOMAIN_RETRY_SECONDS"""
+    now = timezone.now()
+    retry_on = now + timedelta(seconds=settings.DDS2API_DOMAIN_RETRY_SECONDS)
+    # claim the batch so that other workers skip it, without keeping the
+    # rows locked during the lookups
+    with transaction.atomic():
+        domains = list(due_domains(now).select_for_update(skip_locked=True)[:batch_size])
+        Domain.objects.filter(pk__in=[domain.pk for domain in domains]).update(
+            next_check_on=retry_on)
+    if not domains:
+        return 0
+    results = async_to_sync(check_domains)(
+        [domain.name for domain in domains], resolver or get_resolver(), concurrency)
+    checked = []
+    for domain in domains:
+        result = results[domain.name]
+        if isinstance(result, DNSError):
+            continue
+        domain.verified = result['verified']
+        domain.dns_records = result['records']
+        domain.checked_on = now
+        domain.next_check_on = next_check(now, result['ttl'])
+        checked.append(domain)
+    Domain.objects.bulk_update(
+        checked, ['verified', 'dns_records', 'checked_on', 'next_check_on'])
+    return len(domains)
@@ -8,14 +8,31 @@ from .models import (
 
 
 class StorageCredentialForm(forms.ModelForm):
-    """Storage Credentials"""
-    access_key_id = forms.CharField(widget=forms.PasswordInput)
-    secret_access_key = forms.CharField(widget=forms.PasswordInput)
+    """Storage Credentials, the secrets are encrypted and never shown,
+       leave them empty to keep the current ones"""
+    access_key_id = forms.CharField(widget=forms.PasswordInput, max_length=128, required=False)
+    secret_access_key = forms.CharField(widget=forms.PasswordInput, max_length=128,
+                                        required=False)
 
     class Meta:
         model = StorageCredential
         fields = '__all__'
 
+    def clean(self):
+        cleaned_data = super().clean()
+        given = [name for name in ('access_key_id', 'secret_access_key')
+                 if cleaned_data.get(name)]
+        if len(given) == 1 or (not self.instance.secrets_envelope and not given):
+            raise forms.ValidationError(
+                'access key id and secret access key are required together')
+        return cleaned_data
+
+    def save(self, commit=True):
+        if self.cleaned_data.get('access_key_id'):
+            self.instance.set_secrets(self.cleaned_data['access_key_id'],
+                                      self.cleaned_data['secret_access_key'])
+        return super().save(commit)
+
 
 class AttachmentForm(forms.ModelForm):
     # original_filename = forms.CharField()
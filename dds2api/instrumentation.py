@@ -0,0 +1,342 @@
+"""
+Request instrumentation
+
+RequestMetricsMiddleware records, for every request, the wall time, the
+number and time of the DB queries, cache hits and misses and the response
+rendering time, labelled by viewset and action. The totals are kept in
+process and exported in the Prometheus text format by ``metrics_view``.
+
+Requests slower than DDS2API_SLOW_REQUEST_SECONDS are sampled (a fraction
+DDS2API_PROFILE_SAMPLE_RATE of them) by a background thread that collects
+their stacks into folded files (flamegraph.pl / speedscope input) in
+DDS2API_PROFILE_DIR.
+
+Everything on the request path is a few perf_counter() calls and a dict
+update under a lock, so it is meant to be always on.
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import MemcachedCache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_MISSING = object()
+
+
+class RequestStats:
+    __slots__ = ('db_queries', 'db_seconds', 'cache_hits', 'cache_misses',
+                 'serialize_seconds', 'render_seconds', 'serializing')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.serializing = False
+
+
+def current_stats():
+    """Stats of the request being served by this thread, or None"""
+    return getattr(_local, 'stats', None)
+
+
+class MetricsRegistry:
+    """Per process totals by (view, action, method, status class)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = defaultdict(lambda: {
+            'count': 0,
+            'seconds': 0.0,
+            'buckets': [0] * len(DURATION_BUCKETS),
+            'db_queries': 0,
+            'db_seconds': 0.0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'serialize_seconds': 0.0,
+            'render_seconds': 0.0,
+        })
+
+    def observe(self, labels, seconds, stats):
+        with self._lock:
+            series = self._series[labels]
+            series['count'] += 1
+            series['seconds'] += seconds
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['db_queries'] += stats.db_queries
+            series['db_seconds'] += stats.db_seconds
+            series['cache_hits'] += stats.cache_hits
+            series['cache_misses'] += stats.cache_misses
+            series['serialize_seconds'] += stats.serialize_seconds
+            series['render_seconds'] += stats.render_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: {**series, 'buckets': list(series['buckets'])}
+                    for labels, series in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def exposition(self):
+        """Prometheus text exposition format"""
+        counters = (
+            ('dds2_requests_total', 'count', 'Requests served'),
+            ('dds2_db_queries_total', 'db_queries', 'Database queries'),
+            ('dds2_db_query_seconds_total', 'db_seconds', 'Time spent in database queries'),
+            ('dds2_cache_hits_total', 'cache_hits', 'Cache hits'),
+            ('dds2_cache_misses_total', 'cache_misses', 'Cache misses'),
+            ('dds2_serialize_seconds_total', 'serialize_seconds',
+             'Time spent serializing responses, without their queries'),
+            ('dds2_render_seconds_total', 'render_seconds', 'Time spent rendering responses'),
+        )
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+        for name, field, help_text in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, series in snapshot:
+                lines.append(f'{name}{{{_labels(labels)}}} {series[field]}')
+        name = 'dds2_request_duration_seconds'
+        lines.append(f'# HELP {name} Request wall time')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, hits in zip(DURATION_BUCKETS, series['buckets']):
+                cumulative += hits
+                lines.append(f'{name}_bucket{{{_labels(labels)},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{_labels(labels)},le="+Inf"}} {series["count"]}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {series["seconds"]}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {series["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    view, action, method, status = labels
+    return f'view="{view}",action="{action}",method="{method}",status="{status}"'
+
+
+registry = MetricsRegistry()  # pylint: disable=C0103
+
+
+class StackSampler:
+    """Background thread that samples the stacks of in flight requests
+       once they run longer than the slow request threshold"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, thread_id, started):
+        samples = Counter()
+        with self._lock:
+            self._requests[thread_id] = (started, samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dds2-stack-sampler',
+                                                daemon=True)
+                self._thread.start()
+        return samples
+
+    def unregister(self, thread_id):
+        with self._lock:
+            self._requests.pop(thread_id, None)
+
+    def _run(self):
+        threshold = settings.DDS2API_SLOW_REQUEST_SECONDS
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = {thread_id: samples
+                        for thread_id, (started, samples) in self._requests.items()
+                        if now - started >= threshold}
+            if not slow:
+                continue
+            frames = sys._current_frames()  # pylint: disable=W0212
+            for thread_id, samples in slow.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_fold(frame)] += 1
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+_sampler = None  # pylint: disable=C0103
+
+
+def get_sampler():
+    global _sampler  # pylint: disable=W0603,C0103
+    if _sampler is None:
+        _sampler = StackSampler(settings.DDS2API_PROFILE_INTERVAL)
+    return _sampler
+
+
+def write_profile(labels, seconds, samples):
+    view, action, method, _ = labels
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{view}-{action}-{method}-{seconds:.3f}s.folded'
+    os.makedirs(settings.DDS2API_PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(settings.DDS2API_PROFILE_DIR, name), 'w') as profile:
+        for stack, hits in list(samples.items()):
+            profile.write(f'{stack} {hits}\n')
+
+
+def _db_timer(execute, sql, params, many, context):
+    stats = current_stats()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+class RequestMetricsMiddleware:
+    """Keep it high in MIDDLEWARE so that it times the other middlewares"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        stats = _local.stats = RequestStats()
+        request.metrics_labels = ('', '')
+        thread_id = threading.get_ident()
+        samples = None
+        if (
+                settings.DDS2API_PROFILE_SAMPLE_RATE and
+                random.random() < settings.DDS2API_PROFILE_SAMPLE_RATE
+        ):
+            samples = get_sampler().register(thread_id, started)
+        try:
+            for alias in connections:
+                connections[alias].execute_wrappers.append(_db_timer)
+            try:
+                response = self.get_response(request)
+            finally:
+                for alias in connections:
+                    connections[alias].execute_wrappers.remove(_db_timer)
+        finally:
+            _local.stats = None
+            if samples is not None:
+                get_sampler().unregister(thread_id)
+        seconds = time.perf_counter() - started
+        view, action = request.metrics_labels
+        labels = (view, action, request.method, f'{response.status_code // 100}xx')
+        registry.observe(labels, seconds, stats)
+        if samples:
+            write_profile(labels, seconds, samples)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        cls = getattr(view_func, 'cls', None)
+        if cls is None:
+            request.metrics_labels = (view_func.__name__, '')
+        else:
+            actions = getattr(view_func, 'actions', None) or {}
+            request.metrics_labels = (cls.__name__,
+                                      actions.get(request.method.lower(), ''))
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that records the rendering time of the request"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.render_seconds += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Serializer that records its to_representation time in the request
+       stats, less the queries it runs. Nested and list children count once"""
+
+    def to_representation(self, instance):
+        stats = current_stats()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+        stats.serializing = True
+        started = time.perf_counter()
+        db_seconds = stats.db_seconds
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializing = False
+            stats.serialize_seconds += (time.perf_counter() - started -
+                                        (stats.db_seconds - db_seconds))
+
+
+class CacheStatsMixin:
+    """Count the hits and misses of a cache backend in the request stats"""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version=version)
+        stats = current_stats()
+        if stats is not None:
+            if value is _MISSING:
+                stats.cache_misses += 1
+            else:
+                stats.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version=version)
+        stats = current_stats()
+        if stats is not None:
+            stats.cache_hits += len(values)
+            stats.cache_misses += len(keys) - len(values)
+        return values
+
+
+class InstrumentedLocMemCache(CacheStatsMixin, LocMemCache):
+    pass
+
+
+class InstrumentedMemcachedCache(CacheStatsMixin, MemcachedCache):
+    pass
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for the Bearer DDS2API_METRICS_TOKEN.
+       Closed while no token is set"""
+    token = settings.DDS2API_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(authorization.encode('utf-8'),
+                                            f'Bearer {token}'.encode('utf-8')):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,205 @@
+"""
+Background jobs
+
+A job is a row of the Job table, so a job enqueued in a transaction only
+exists once it commits. The run_jobs workers claim jobs in batches, one
+round trip for as many jobs as they have free threads:
+
+- lanes: the priority of a job comes from its lane, interactive jobs are
+  claimed before default ones, which go before bulk ones.
+- tenants: a tenant never has more than DDS2API_JOB_TENANT_CONCURRENCY
+  jobs running across the workers.
+- visibility timeout: a claimed job is leased for the timeout of its task,
+  once the lease expires another worker takes it over, e.g. after a crash.
+- retries: a failed job is queued again with an exponential backoff until
+  it runs out of attempts.
+
+Tasks are functions registered with @task, called with the args of the
+job as keyword arguments. They may run more than once and should be
+idempotent.
+"""
+
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .models import Job
+from .pgnotify import notify
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+LANES = {
+    'interactive': 0,
+    'default': 5,
+    'bulk': 9,
+}
+# serializes the claims, so that the tenant caps hold
+CLAIM_LOCK = 0x64647332
+# characters of the traceback kept in last_error
+ERROR_LENGTH = 4000
+
+TASKS = {}
+
+
+class Task:
+
+    def __init__(self, name, func, lane, max_attempts, timeout):
+        self.name = name
+        self.func = func
+        self.lane = lane
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+def task(name, lane='default', max_attempts=None, timeout=None):
+    """Register the decorated function as the task name"""
+    if lane not in LANES:
+        raise ValueError(f'unknown lane {lane}')
+
+    def register(func):
+        TASKS[name] = Task(name, func, lane,
+                           max_attempts or settings.DDS2API_JOB_MAX_ATTEMPTS,
+                           timeout or settings.DDS2API_JOB_VISIBILITY_SECONDS)
+        return func
+    return register
+
+
+def enqueue(name, args=None, tenant=None, lane=None, delay=0):
+    """Queue a run of the task name, returns the Job"""
+    try:
+        registered = TASKS[name]
+    except KeyError:
+        raise ValueError(f'unknown task {name}')
+    job = Job.objects.create(
+        task=name,
+        args=args or {},
+        tenant=tenant,
+        priority=LANES[lane or registered.lane],
+        max_attempts=registered.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay))
+    # wakes the workers up on commit
+    notify(Job.CHANNEL)
+    return job
+
+
+def enqueue_on_commit(name, args=None, tenant=None, lane=None, delay=0):
+    """enqueue() once the current transaction commits, for jobs about rows
+       that are being saved"""
+    transaction.on_commit(lambda: enqueue(name, args, tenant, lane, delay))
+
+
+def backoff(attempts):
+    """Seconds before the next attempt, after attempts failed ones"""
+    seconds = min(settings.DDS2API_JOB_RETRY_SECONDS * 2 ** (attempts - 1),
+                  settings.DDS2API_JOB_RETRY_MAX_SECONDS)
+    return seconds * random.uniform(0.5, 1)
+
+
+def _lease(job, now):
+    registered = TASKS.get(job.task)
+    timeout = registered.timeout if registered else settings.DDS2API_JOB_VISIBILITY_SECONDS
+    return now + timedelta(seconds=timeout)
+
+
+def _claimable(limit, now, priorities):
+    """The next limit jobs that may run, the ones of a tenant ranked past
+       its free slots are left out in the query, so that a tenant at its
+       cap can't hide the jobs of the others"""
+    table = Job._meta.db_table  # pylint: disable=W0212
+    params = [Job.QUEUED, Job.RUNNING, now]
+    lanes = ''
+    if priorities is not None:
+        lanes = 'AND priority = ANY(%s)'
+        params.append(list(priorities))
+    params.extend([Job.RUNNING, now, settings.DDS2API_JOB_TENANT_CONCURRENCY, limit])
+    return list(Job.objects.raw(
+        f'SELECT ranked.* FROM ('
+        f' SELECT *, row_number() OVER ('
+        f'  PARTITION BY tenant_id ORDER BY priority, run_after, id) AS tenant_rank'
+        f' FROM {table} WHERE status IN (%s, %s) AND run_after <= %s {lanes}'
+        f') ranked LEFT JOIN ('
+        f' SELECT tenant_id, count(*) AS running FROM {table}'
+        f' WHERE status = %s AND run_after > %s AND tenant_id IS NOT NULL'
+        f' GROUP BY tenant_id'
+        f') busy ON busy.tenant_id = ranked.tenant_id '
+        f'WHERE ranked.tenant_id IS NULL'
+        f' OR ranked.tenant_rank <= %s - coalesce(busy.running, 0) '
+        f'ORDER BY ranked.priority, ranked.run_after, ranked.id LIMIT %s',
+        params))
+
+
+def claim(worker, limit, priorities=None):
+    """Lease up to limit jobs to worker, in priority order and within the
+       tenant caps"""
+    now = timezone.now()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLAIM_LOCK])
+        # the lease of the last attempt ran out
+        Job.objects.filter(status=Job.RUNNING, run_after__lte=now,
+                           attempts__gte=F('max_attempts')).update(
+                               status=Job.FAILED, finished_on=now,
+                               last_error='visibility timeout expired')
+        claimed = _claimable(limit, now, priorities)
+        for job in claimed:
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.worker = worker
+            job.run_after = _lease(job, now)
+        Job.objects.bulk_update(claimed, ['status', 'attempts', 'worker', 'run_after'])
+    return claimed
+
+
+def next_due(priorities=None):
+    """Seconds until a queued job becomes runnable or a lease expires,
+       None when no job is waiting on its run_after"""
+    now = timezone.now()
+    jobs = Job.objects.filter(status__in=(Job.QUEUED, Job.RUNNING), run_after__gt=now)
+    if priorities is not None:
+        jobs = jobs.filter(priority__in=priorities)
+    due = jobs.aggregate(due=Min('run_after'))['due']
+    return None if due is None else (due - now).total_seconds()
+
+
+def _leased(job):
+    # the job is still this attempt's, not taken over after its lease
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, attempts=job.attempts)
+
+
+def run(job):
+    """Run a claimed job and record the outcome"""
+    registered = TASKS.get(job.task)
+    try:
+        if registered is None:
+            raise LookupError(f'unknown task {job.task}')
+        registered.func(**job.args)
+    except Exception:  # pylint: disable=W0703
+        logger.exception('job %s (%s) failed', job.pk, job.task)
+        now = timezone.now()
+        error = traceback.format_exc()[-ERROR_LENGTH:]
+        if registered is None or job.attempts >= job.max_attempts:
+            _leased(job).update(status=Job.FAILED, finished_on=now, last_error=error)
+        else:
+            _leased(job).update(
+                status=Job.QUEUED, last_error=error,
+                run_after=now + timedelta(seconds=backoff(job.attempts)))
+    else:
+        _leased(job).update(status=Job.DONE, finished_on=timezone.now(), last_error='')
+    if job.tenant_id is not None:
+        # a slot of the tenant is free, for the jobs other workers left out
+        notify(Job.CHANNEL)
+
+
+def purge_finished(max_age=None):
+    """Delete the jobs that finished more than max_age seconds ago"""
+    max_age = settings.DDS2API_JOB_RETENTION_SECONDS if max_age is None else max_age
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED),
+        finished_on__lt=timezone.now() - timedelta(seconds=max_age)).delete()
+    return deleted
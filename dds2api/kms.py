@@ -0,0 +1,149 @@
+"""
+Envelope encryption with a local key file standing in for a KMS
+
+Every encrypt() call makes a fresh data key, encrypts the plaintext with it
+(AES-256-GCM) and stores the data key wrapped by the active key encryption
+key of DDS2API_KMS_KEY_FILE:
+
+    {"active": "<key id>", "keys": {"<key id>": "<base64 32 bytes>", ...}}
+
+Older keys stay in the file to decrypt what they wrapped until rewrap()
+has moved it to the active key (rotate_kms_key command). The functions
+mirror KMS GenerateDataKey / Decrypt so that a real KMS can replace
+LocalKMS.
+"""
+
+import base64
+import json
+import os
+import secrets
+import threading
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+ENVELOPE_VERSION = 'v1'
+NONCE_BYTES = 12
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text.encode('ascii'))
+
+
+class LocalKMS:
+
+    def __init__(self, path):
+        self.path = path
+        self.active = None
+        self.keys = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as key_file:
+                content = json.load(key_file)
+        except (OSError, ValueError) as exc:
+            raise ImproperlyConfigured(f'cannot read the KMS key file {self.path}: {exc}')
+        self.active = content['active']
+        self.keys = {key_id: AESGCM(_unb64(key)) for key_id, key in content['keys'].items()}
+
+    def generate_data_key(self):
+        """(data key, key id, wrapped data key)"""
+        data_key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(NONCE_BYTES)
+        wrapped = nonce + self.keys[self.active].encrypt(nonce, data_key,
+                                                          self.active.encode('utf-8'))
+        return data_key, self.active, wrapped
+
+    def decrypt_data_key(self, key_id, wrapped):
+        if key_id not in self.keys:
+            # added by another process since this one read the file
+            self.load()
+        key = self.keys.get(key_id)
+        if key is None:
+            raise DecryptionError(f'unknown key {key_id}')
+        try:
+            return key.decrypt(wrapped[:NONCE_BYTES], wrapped[NONCE_BYTES:],
+                               key_id.encode('utf-8'))
+        except InvalidTag:
+            raise DecryptionError(f'data key does not match key {key_id}')
+
+
+_kms = None  # pylint: disable=C0103
+_kms_lock = threading.Lock()
+
+
+def get_kms():
+    global _kms  # pylint: disable=W0603,C0103
+    with _kms_lock:
+        if _kms is None or _kms.path != settings.DDS2API_KMS_KEY_FILE:
+            _kms = LocalKMS(settings.DDS2API_KMS_KEY_FILE)
+        return _kms
+
+
+def encrypt(plaintext, kms=None):
+    """Envelope of plaintext (bytes), as text"""
+    data_key, key_id, wrapped = (kms or get_kms()).generate_data_key()
+    nonce = os.urandom(NONCE_BYTES)
+    ciphertext = AESGCM(data_key).encrypt(nonce, plaintext, None)
+    return ':'.join((ENVELOPE_VERSION, key_id, _b64(wrapped), _b64(nonce + ciphertext)))
+
+
+def _split(envelope):
+    try:
+        version, key_id, wrapped, payload = envelope.split(':')
+    except ValueError:
+        raise DecryptionError('malformed envelope')
+    if version != ENVELOPE_VERSION:
+        raise DecryptionError(f'unsupported envelope {version}')
+    return key_id, _unb64(wrapped), _unb64(payload)
+
+
+def decrypt(envelope, kms=None):
+    key_id, wrapped, payload = _split(envelope)
+    data_key = (kms or get_kms()).decrypt_data_key(key_id, wrapped)
+    try:
+        return AESGCM(data_key).decrypt(payload[:NONCE_BYTES], payload[NONCE_BYTES:], None)
+    except InvalidTag:
+        raise DecryptionError('ciphertext does not match its data key')
+
+
+def rewrap(envelope, kms=None):
+    """Same envelope with its data key wrapped by the active key, the
+       payload is not decrypted"""
+    kms = kms or get_kms()
+    key_id, wrapped, payload = _split(envelope)
+    if key_id == kms.active:
+        return envelope
+    data_key = kms.decrypt_data_key(key_id, wrapped)
+    nonce = os.urandom(NONCE_BYTES)
+    wrapped = nonce + kms.keys[kms.active].encrypt(nonce, data_key, kms.active.encode('utf-8'))
+    return ':'.join((ENVELOPE_VERSION, kms.active, _b64(wrapped), _b64(payload)))
+
+
+def add_key(path):
+    """Add a new key to the key file (created if missing) and make it the
+       active one, returns its id"""
+    try:
+        with open(path) as key_file:
+            content = json.load(key_file)
+    except FileNotFoundError:
+        content = {'keys': {}}
+    key_id = secrets.token_hex(4)
+    content['keys'][key_id] = _b64(AESGCM.generate_key(bit_length=256))
+    content['active'] = key_id
+    temporary = f'{path}.tmp'
+    with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as key_file:
+        json.dump(content, key_file, indent=2)
+    os.replace(temporary, path)
+    return key_id
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dds2api.retention import TABLES, apply_retention
+
+
+class Command(BaseCommand):
+    help = ('Roll up, archive to private storage and delete the rows older than '
+            'the retention policy of their tenant')
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*',
+                            help=f'tables, all of {", ".join(TABLES)} by default')
+        parser.add_argument('--batch-size', type=int,
+                            help='rows deleted per transaction')
+
+    def handle(self, *args, **options):
+        unknown = set(options['table']) - set(TABLES)
+        if unknown:
+            raise CommandError(f'unknown tables {", ".join(sorted(unknown))}')
+        for archive in apply_retention(options['table'] or None,
+                                       batch_size=options['batch_size']):
+            self.stdout.write(f'{archive.tenant_id} {archive}: {archive.rows} rows archived')
@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.utils.module_loading import import_string
+
+from dds2api import benchmarks
+from dds2api.benchmarks import api, pipeline, seed, startup
+from dds2api.models import DataSet
+
+
+class Command(BaseCommand):
+    help = ('Seed a test database with synthetic data, benchmark the API and '
+            'the send pipeline and compare the results with a JSON baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=3)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--balance-entries', type=int, default=100000,
+                            help='per tenant')
+        parser.add_argument('--dataset-rows', type=int, default=1000000,
+                            help='per tenant')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help='allowed regression, as a fraction of the baseline')
+        parser.add_argument('--baseline',
+                            default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='keep the seeded test database between runs')
+        parser.add_argument('--skip-api', action='store_true')
+        parser.add_argument('--skip-pipeline', action='store_true')
+        parser.add_argument('--skip-startup', action='store_true')
+
+    def handle(self, *args, **options):
+        if not issubclass(import_string(settings.PRIVATE_FILE_STORAGE), FileSystemStorage):
+            raise CommandError('the benchmarks would write the files to '
+                               f'{settings.PRIVATE_FILE_STORAGE}, run them with '
+                               'DJANGO_SETTINGS_MODULE=dds2be.settings_benchmark')
+        results = {benchmarks.CALIBRATION: benchmarks.calibrate()}
+        if not options['skip_startup']:
+            results.update(startup.run())
+        setup_test_environment()
+        old_config = setup_databases(options['verbosity'], interactive=False,
+                                     keepdb=options['keepdb'])
+        try:
+            results.update(self.run(options))
+        finally:
+            teardown_databases(old_config, options['verbosity'], keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        if options['save_baseline']:
+            benchmarks.save_baseline(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f'baseline saved to {options["baseline"]}'))
+            return
+        regressions = benchmarks.compare(results, benchmarks.load_baseline(options['baseline']),
+                                         options['tolerance'])
+        for metric, base, value, change in regressions:
+            self.stderr.write(f'{metric}: {base:.2f} -> {value:.2f} ({change:+.0%})')
+        if regressions:
+            raise CommandError(f'{len(regressions)} metric(s) regressed')
+
+    def run(self, options):
+        users = seed.seeded_users()
+        if not users:
+            self.stdout.write('seeding...')
+            users = seed.seed(options['tenants'], options['tags'],
+                              options['balance_entries'], options['dataset_rows'])
+        results = {}
+        if not options['skip_api']:
+            results.update(api.run(users[0], options['iterations']))
+        if not options['skip_pipeline']:
+            dataset = DataSet.objects.filter(tenant__tenant=users[0].username).first()
+            results.update(pipeline.run(dataset))
+        return results
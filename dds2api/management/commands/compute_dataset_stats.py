@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from dds2api.datasets import compute_stats
+from dds2api.models import DataSet, DataSetStats
+
+
+class Command(BaseCommand):
+    help = ('Compute the statistics (row count, distinct values, sample) the '
+            'broadcast dry run works from, for the DataSets that have none')
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', nargs='*', type=int,
+                            help='recompute these DataSets')
+
+    def handle(self, *args, **options):
+        if options['dataset']:
+            datasets = DataSet.objects.filter(pk__in=options['dataset'])
+        else:
+            datasets = DataSet.objects.filter(stats__isnull=True).exclude(uploaded_file='')
+        for dataset in datasets.iterator():
+            stats = compute_stats(dataset)
+            DataSetStats.objects.filter(dataset=dataset).delete()
+            stats.save()
+            self.stdout.write(f'{dataset.pk}: {stats.rows} rows')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from dds2api.models import Broadcast
+from dds2api.pgnotify import Listener
+from dds2api.schedules import Dispatcher
+
+
+class Command(BaseCommand):
+    help = ('Run the scheduled broadcasts as they become due, from an in memory '
+            'timing wheel loaded from next_run_at')
+
+    def handle(self, *args, **options):
+        # listen first, so that no change made while loading is missed
+        listener = Listener(Broadcast.SCHEDULE_CHANNEL)
+        dispatcher = Dispatcher()
+        try:
+            while True:
+                fired = dispatcher.run_due()
+                if fired and options['verbosity'] > 1:
+                    self.stdout.write(f'{fired} broadcasts run')
+                changed = [int(payload) for payload in
+                           listener.wait(dispatcher.seconds_to_next_tick()) if payload]
+                if changed:
+                    dispatcher.load(changed)
+        finally:
+            listener.close()
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from dds2api.models import (
+    BalanceEntry,
+    Tag,
+    StorageCredential,
+    Domain,
+    Sender,
+    Attachment,
+    Broadcast,
+    DataSet,
+)
+
+LIST_QUERIES = (
+    ('balance-entry', lambda tenants: BalanceEntry.objects.filter(tenant__in=tenants)),
+    ('balance-entry by channel', lambda tenants: BalanceEntry.objects.filter(
+        tenant__in=tenants, channel_type=BalanceEntry.CHANNEL_EMAIL)),
+    ('tag', lambda tenants: Tag.objects.filter(tenant__in=tenants)),
+    ('storage-credential', lambda tenants: StorageCredential.objects.filter(tenant__in=tenants)),
+    ('verified domains', lambda tenants: Domain.objects.filter(tenant__in=tenants, verified=True)),
+    ('verified senders', lambda tenants: Sender.objects.filter(
+        tenant__in=tenants, email_verified=True)),
+    ('attachment', lambda tenants: Attachment.objects.filter(tenant__in=tenants)),
+    ('broadcast', lambda tenants: Broadcast.objects.filter(tenant__in=tenants)),
+    ('dataset', lambda tenants: DataSet.objects.filter(tenant__in=tenants)),
+)
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN ANALYZE the first page and the count of the tenant scoped '
+            'list queries, to check which indexes serve them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant', nargs='+', type=int)
+        parser.add_argument('--page-size', type=int,
+                            default=settings.REST_FRAMEWORK['PAGE_SIZE'])
+
+    def handle(self, *args, **options):
+        for name, build in LIST_QUERIES:
+            queryset = build(options['tenant'])
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} (first page)'))
+            self.stdout.write(
+                queryset[:options['page_size']].explain(analyze=True, buffers=True))
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} (count)'))
+            self.stdout.write(self.explain_count(queryset))
+
+    @staticmethod
+    def explain_count(queryset):
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'EXPLAIN (ANALYZE, BUFFERS) SELECT COUNT(*) FROM ({sql}) AS page', params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from dds2api.datasets import prune_versions
+
+
+class Command(BaseCommand):
+    help = ('Delete the DataSet versions that are neither current nor pinned '
+            'by a Broadcast, and the segments no version uses')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int,
+                            help='seconds, defaults to '
+                                 'DDS2API_DATASET_VERSION_RETENTION_SECONDS')
+
+    def handle(self, *args, **options):
+        versions, segments = prune_versions(options['max_age'])
+        self.stdout.write(f'{versions} versions, {segments} segments deleted')
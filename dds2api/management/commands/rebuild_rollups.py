@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from dds2api.models import Tenant
+from dds2api.rollups import rebuild_balance_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the balance rollups from the balance entries, e.g. after '
+            'loading entries with bulk_create. Inserts of entries wait meanwhile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant', nargs='*', type=int,
+                            help='tenants, all by default')
+
+    def handle(self, *args, **options):
+        tenants = options['tenant'] or Tenant.objects.values_list('pk', flat=True)
+        for tenant_id in tenants:
+            rows = rebuild_balance_rollups(tenant_id)
+            self.stdout.write(f'{tenant_id}: {rows} rollups')
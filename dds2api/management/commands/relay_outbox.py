@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dds2api.models import OutboxEvent
+from dds2api.outbox import get_sink, purge_published, relay_batch
+from dds2api.pgnotify import Listener
+
+# seconds between purges of the published events
+PURGE_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = ('Publish the model change events of the outbox to DDS2API_OUTBOX_SINK, '
+            'woken up by the saves instead of polling')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='keep publishing events as they are saved')
+        parser.add_argument('--sink', help='file:///path or tcp://host:port, '
+                                           'DDS2API_OUTBOX_SINK by default')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--idle-seconds', type=float, default=30,
+                            help='longest wait for a notification')
+
+    def handle(self, *args, **options):
+        sink = get_sink(options['sink'])
+        listener = Listener(OutboxEvent.CHANNEL) if options['loop'] else None
+        purged_on = 0
+        try:
+            while True:
+                published = relay_batch(sink, options['batch_size'])
+                if options['verbosity'] > 1 or (published and not options['loop']):
+                    self.stdout.write(f'{published} events published')
+                if time.monotonic() - purged_on > PURGE_SECONDS:
+                    purge_published()
+                    purged_on = time.monotonic()
+                if not options['loop']:
+                    return
+                if published < options['batch_size']:
+                    listener.wait(options['idle_seconds'])
+        finally:
+            sink.close()
+            if listener is not None:
+                listener.close()
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dds2api.credentials import credential_cache
+from dds2api.kms import add_key, get_kms, rewrap
+from dds2api.models import StorageCredential
+
+
+class Command(BaseCommand):
+    help = ('Add a new key to DDS2API_KMS_KEY_FILE (created if missing), make it '
+            'the active one and rewrap the StorageCredential data keys with it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rewrap-only', action='store_true',
+                            help='only rewrap what older keys still wrap')
+        parser.add_argument('--key-only', action='store_true',
+                            help='only add the key, e.g. before the first migration')
+
+    def handle(self, *args, **options):
+        if not options['rewrap_only']:
+            key_id = add_key(settings.DDS2API_KMS_KEY_FILE)
+            self.stdout.write(f'active key: {key_id}')
+            if options['key_only']:
+                return
+        kms = get_kms()
+        kms.load()
+        rewrapped = 0
+        for pk in StorageCredential.objects.values_list('pk', flat=True).iterator():
+            with transaction.atomic():
+                credential = (StorageCredential.objects
+                              .select_for_update()
+                              .only('secrets_envelope')
+                              .get(pk=pk))
+                if not credential.secrets_envelope:
+                    continue
+                envelope = rewrap(credential.secrets_envelope, kms)
+                if envelope != credential.secrets_envelope:
+                    # same secrets, secrets_version stays
+                    StorageCredential.objects.filter(pk=pk).update(secrets_envelope=envelope)
+                    rewrapped += 1
+        credential_cache.clear()
+        self.stdout.write(f'{rewrapped} credentials rewrapped')
@@ -0,0 +1,99 @@
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from dds2api.jobs import LANES, claim, next_due, purge_finished, run
+from dds2api.models import Job
+from dds2api.pgnotify import Listener
+
+# seconds between purges of the finished jobs
+PURGE_SECONDS = 3600
+
+
+def run_in_thread(job):
+    try:
+        run(job)
+    finally:
+        # the thread's own connection, kept across jobs unless unusable
+        close_old_connections()
+
+
+def drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs, claiming as many at a time as there are '
+            'free threads')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='keep running jobs as they are enqueued')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='jobs run at the same time')
+        parser.add_argument('--lanes', default=','.join(LANES),
+                            help='comma separated lanes this worker runs')
+        parser.add_argument('--idle-seconds', type=float, default=30,
+                            help='longest wait for a notification')
+
+    def handle(self, *args, **options):
+        try:
+            priorities = [LANES[lane] for lane in options['lanes'].split(',')]
+        except KeyError as exc:
+            raise CommandError(f'unknown lane {exc}')
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        listener = Listener(Job.CHANNEL) if options['loop'] else None
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+        purged_on = 0
+        running = set()
+        # written to when a job finishes, wakes the wait for notifications
+        finished_read, finished_write = os.pipe()
+        os.set_blocking(finished_read, False)
+
+        def submit(job):
+            future = pool.submit(run_in_thread, job)
+            future.add_done_callback(lambda _: os.write(finished_write, b'.'))
+            return future
+
+        try:
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                while not stopping:
+                    free = options['concurrency'] - len(running)
+                    jobs = claim(worker, free, priorities) if free else []
+                    running.update(submit(job) for job in jobs)
+                    if options['verbosity'] > 1 and jobs:
+                        self.stdout.write(f'{len(jobs)} jobs claimed')
+                    if time.monotonic() - purged_on > PURGE_SECONDS:
+                        purge_finished()
+                        purged_on = time.monotonic()
+                    if len(jobs) < free:
+                        # the queue is empty for this worker, until a job is
+                        # enqueued or finishes, or a run_after or lease is due
+                        if not options['loop']:
+                            break
+                        timeout = options['idle_seconds']
+                        due = next_due(priorities)
+                        if due is not None:
+                            timeout = min(timeout, due)
+                        listener.wait(timeout, finished_read)
+                        drain(finished_read)
+                    elif running:
+                        _, running = wait(running, return_when=FIRST_COMPLETED)
+                    running = {future for future in running if not future.done()}
+        finally:
+            # the pool waits for the running jobs
+            if listener is not None:
+                listener.close()
+            os.close(finished_read)
+            os.close(finished_write)
+            connection.close()
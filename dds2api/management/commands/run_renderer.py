@@ -0,0 +1,16 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from dds2api.documents import serve
+
+
+class Command(BaseCommand):
+    help = ('Render generated attachments for the requests framed on stdin, '
+            'started by the renderer pool (dds2api.documents)')
+
+    def handle(self, *args, **options):
+        stdout = sys.stdout.buffer
+        # the frames own stdout, anything else printed goes to stderr
+        sys.stdout = sys.stderr
+        serve(sys.stdin.buffer, stdout)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dds2api.domains import verify_due_domains
+
+
+class Command(BaseCommand):
+    help = ('Check the SPF, DKIM, DMARC and MX records of the domains that are '
+            'due, concurrently and through a TTL respecting DNS cache')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='keep checking domains as they become due')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='domains checked at the same time')
+        parser.add_argument('--idle-seconds', type=float, default=30,
+                            help='wait between passes when nothing is due')
+
+    def handle(self, *args, **options):
+        while True:
+            checked = verify_due_domains(options['batch_size'], options['concurrency'])
+            if options['verbosity'] > 1 or (checked and not options['loop']):
+                self.stdout.write(f'{checked} domains checked')
+            if not options['loop']:
+                return
+            if checked < options['batch_size']:
+                time.sleep(options['idle_seconds'])
@@ -0,0 +1,39 @@
+"""Message rendering and MIME building"""
+
+from functools import lru_cache
+
+from django.core.mail import EmailMessage
+from django.template import Context
+
+from .template_builtins import TenantEngine
+
+_engine = TenantEngine()  # pylint: disable=C0103
+
+
+@lru_cache(maxsize=256)
+def compile_template(source):
+    """Compiled template of source, compiled once per process"""
+    return _engine.from_string(source)
+
+
+def render(source, row):
+    return compile_template(source).render(Context(row))
+
+
+def render_email(broadcast, row):
+    """(subject, body) of the broadcast for a DataSet row"""
+    return render(broadcast.email_subject, row), render(broadcast.email_body, row)
+
+
+def email_message(subject, body, from_email, to, attachments=()):
+    """html EmailMessage, attachments are (filename, content, mimetype)
+       tuples"""
+    message = EmailMessage(subject, body, from_email, [to],
+                           attachments=list(attachments))
+    message.content_subtype = 'html'
+    return message
+
+
+def build_email(subject, body, from_email, to, attachments=()):
+    """MIME bytes of an html e-mail"""
+    return email_message(subject, body, from_email, to, attachments).message().as_bytes()
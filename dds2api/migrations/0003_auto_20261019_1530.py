@@ -0,0 +1,164 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:30
+
+import dds2be.storage_backends
+from django.conf import settings
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dds2api', '0002_auto_20190502_1818'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='aws_s3_bucket_name',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='aws_s3_object_key',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='credentials',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='dds2api.StorageCredential'),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='field_name',
+            field=models.CharField(blank=True, max_length=80),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='http_method',
+            field=models.CharField(blank=True, choices=[('GET', 'GET'), ('POST', 'POST')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='origin',
+            field=models.CharField(blank=True, choices=[('URL', 'Retrieve attachment from a URL'), ('S3', 'Retrieve attachment from AWS S3 Object Key')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='specify_name',
+            field=models.CharField(blank=True, help_text='directly specify the name of the attachmentor use variables like {{myfield}}.pdf', max_length=256),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='unzip',
+            field=models.BooleanField(default=False, help_text='if file is compressed (.zip), extract files and then attach'),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='url_json_params',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, help_text='example: { "account": "{{my_account_no}}" }', null=True),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='url_origing_naming_mode',
+            field=models.CharField(blank=True, choices=[('URL_PARAM', 'extract name from URL param'), ('CONTENT_DISPOSITION', 'extract name from "Content-Disposition" header'), ('SPECIFIED', 'specify attachment name')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(blank=True, storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='uploads/'),
+        ),
+        migrations.AlterField(
+            model_name='balanceentry',
+            name='channel_type',
+            field=models.CharField(choices=[('EMAIL', 'e-mail'), ('SMS', 'text message (sms)')], max_length=20, verbose_name='type of channel'),
+        ),
+        migrations.AlterField(
+            model_name='balanceentry',
+            name='origin_type',
+            field=models.CharField(choices=[('PAYMENT', 'confirmed payment')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='role',
+            name='role',
+            field=models.CharField(choices=[('admin', 'Administrator'), ('template_editor', 'Template Editor')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='sender',
+            name='vefification_key',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='storagecredential',
+            name='stype',
+            field=models.CharField(choices=[('AWS_S3', 'AWS S3'), ('BASIC_AUTH_URL', 'URL WITH BASIC AUTH')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='Domain',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=128)),
+                ('verified', models.BooleanField(default=False)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_domain_created', to=settings.AUTH_USER_MODEL)),
+                ('modified_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_domain_modified', to=settings.AUTH_USER_MODEL)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DataSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('original_filename', models.CharField(max_length=256)),
+                ('uploaded_file', models.FileField(blank=True, storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='datasets/')),
+                ('description', models.CharField(max_length=256)),
+                ('system_tag', models.CharField(max_length=256)),
+                ('file_encoding', models.CharField(choices=[('ascii', 'ascii'), ('utf-8', 'utf-8'), ('iso-8859-1', 'iso-8859-1')], default='utf-8', max_length=20)),
+                ('file_has_header', models.BooleanField(default=False)),
+                ('file_fields', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(blank=True, max_length=64), size=None)),
+                ('file_delimiter', models.CharField(default=',', max_length=4)),
+                ('file_quotechar', models.CharField(default='"', max_length=1)),
+                ('status', models.CharField(default='', max_length=20)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_dataset_created', to=settings.AUTH_USER_MODEL)),
+                ('modified_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_dataset_modified', to=settings.AUTH_USER_MODEL)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('description', models.CharField(max_length=256)),
+                ('channel_type', models.CharField(choices=[('EMAIL', 'e-mail'), ('SMS', 'SMS text message')], max_length=20)),
+                ('email_subject', models.CharField(max_length=256)),
+                ('status', models.CharField(max_length=20)),
+                ('email_body', models.TextField()),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_broadcast_created', to=settings.AUTH_USER_MODEL)),
+                ('domain', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='dds2api.Domain')),
+                ('email_attachments', models.ManyToManyField(to='dds2api.Attachment')),
+                ('modified_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_broadcast_modified', to=settings.AUTH_USER_MODEL)),
+                ('storage_credentials', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.StorageCredential')),
+                ('tags', models.ManyToManyField(to='dds2api.Tag')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
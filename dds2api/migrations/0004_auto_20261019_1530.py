@@ -0,0 +1,71 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0003_auto_20261019_1530'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='broadcast',
+            options={'ordering': ('-created_on',)},
+        ),
+        migrations.AlterModelOptions(
+            name='dataset',
+            options={'ordering': ('-created_on',)},
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='description',
+            field=models.CharField(max_length=80),
+        ),
+        migrations.AlterField(
+            model_name='storagecredential',
+            name='name',
+            field=models.CharField(max_length=40),
+        ),
+        migrations.AlterUniqueTogether(
+            name='attachment',
+            unique_together={('description', 'tenant')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='storagecredential',
+            unique_together={('name', 'tenant')},
+        ),
+        migrations.AddIndex(
+            model_name='balanceentry',
+            index=models.Index(fields=['tenant', '-created_on'], name='balanceentry_tenant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='balanceentry',
+            index=models.Index(fields=['tenant', 'channel_type', '-created_on'], name='balanceentry_tenant_channel'),
+        ),
+        migrations.AddIndex(
+            model_name='broadcast',
+            index=models.Index(fields=['tenant', '-created_on'], name='broadcast_tenant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='broadcast',
+            index=models.Index(fields=['tenant', 'channel_type', '-created_on'], name='broadcast_tenant_channel'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['tenant', '-created_on'], name='dataset_tenant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='domain',
+            index=models.Index(condition=models.Q(verified=True), fields=['tenant', 'name'], name='domain_tenant_verified'),
+        ),
+        migrations.AddIndex(
+            model_name='sender',
+            index=models.Index(condition=models.Q(email_verified=True), fields=['tenant', 'email'], name='sender_tenant_email_verified'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['tenant', 'slug'], name='tag_tenant_slug'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:41
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0004_auto_20261019_1530'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='checked_on',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='dns_records',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='next_check_on',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='domain',
+            name='verified',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='domain',
+            index=models.Index(fields=['next_check_on'], name='domain_next_check'),
+        ),
+    ]
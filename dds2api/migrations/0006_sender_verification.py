@@ -0,0 +1,33 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0005_domain_verification'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='sender',
+            name='vefification_key',
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='sender',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='dds2api.Sender'),
+        ),
+        migrations.AddField(
+            model_name='sender',
+            name='verification_expires_on',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sender',
+            name='verification_token',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
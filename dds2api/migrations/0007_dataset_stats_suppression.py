@@ -0,0 +1,45 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:44
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dds2api', '0006_sender_verification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataSetStats',
+            fields=[
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='dds2api.DataSet')),
+                ('rows', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('fields', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('sample', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('computed_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('channel_type', models.CharField(choices=[('EMAIL', 'e-mail'), ('SMS', 'text message (sms)')], max_length=20)),
+                ('address', models.CharField(max_length=254)),
+                ('reason', models.CharField(blank=True, max_length=256)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_suppression_created', to=settings.AUTH_USER_MODEL)),
+                ('modified_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_suppression_modified', to=settings.AUTH_USER_MODEL)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'unique_together': {('tenant', 'channel_type', 'address')},
+            },
+        ),
+    ]
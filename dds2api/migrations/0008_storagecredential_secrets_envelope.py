@@ -0,0 +1,91 @@
+# Generated by Django 2.2.1 on 2026-10-19 16:20
+
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import migrations, models
+
+# max_length of the plaintext columns this migration removes
+PLAINTEXT_LENGTH = 32
+
+
+def key_file_kms(count):
+    """The KMS of DDS2API_KMS_KEY_FILE, which the secrets of count
+       credentials need"""
+    from dds2api.kms import get_kms
+    try:
+        return get_kms()
+    except ImproperlyConfigured as exc:
+        raise ImproperlyConfigured(
+            f'{exc}. The secrets of {count} storage credentials are encrypted with this '
+            f'key file, create it with "python manage.py rotate_kms_key --key-only" '
+            f'and migrate again.')
+
+
+def encrypt_secrets(apps, schema_editor):
+    from dds2api.kms import encrypt
+    StorageCredential = apps.get_model('dds2api', 'StorageCredential')
+    credentials = StorageCredential.objects.using(schema_editor.connection.alias)
+    count = credentials.count()
+    if not count:
+        return
+    kms = key_file_kms(count)
+    for credential in credentials.iterator():
+        credential.secrets_envelope = encrypt(json.dumps({
+            'access_key_id': credential.access_key_id,
+            'secret_access_key': credential.secret_access_key,
+        }).encode('utf-8'), kms)
+        credential.secrets_version = 1
+        credential.save(update_fields=['secrets_envelope', 'secrets_version'])
+
+
+def decrypt_secrets(apps, schema_editor):
+    from dds2api.kms import decrypt
+    StorageCredential = apps.get_model('dds2api', 'StorageCredential')
+    credentials = (StorageCredential.objects
+                   .using(schema_editor.connection.alias)
+                   .exclude(secrets_envelope=''))
+    count = credentials.count()
+    if not count:
+        return
+    kms = key_file_kms(count)
+    for credential in credentials.iterator():
+        secrets = json.loads(decrypt(credential.secrets_envelope, kms))
+        credential.access_key_id = secrets.get('access_key_id', '')
+        credential.secret_access_key = secrets.get('secret_access_key', '')
+        if max(len(credential.access_key_id),
+               len(credential.secret_access_key)) > PLAINTEXT_LENGTH:
+            raise ImproperlyConfigured(
+                f'The secrets of storage credential {credential.pk} are longer than '
+                f'{PLAINTEXT_LENGTH} characters and cannot be stored unencrypted.')
+        credential.save(update_fields=['access_key_id', 'secret_access_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0007_dataset_stats_suppression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagecredential',
+            name='secrets_envelope',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='storagecredential',
+            name='secrets_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        # needs DDS2API_KMS_KEY_FILE when there are credentials, both ways
+        migrations.RunPython(encrypt_secrets, decrypt_secrets, elidable=False),
+        migrations.RemoveField(
+            model_name='storagecredential',
+            name='access_key_id',
+        ),
+        migrations.RemoveField(
+            model_name='storagecredential',
+            name='secret_access_key',
+        ),
+    ]
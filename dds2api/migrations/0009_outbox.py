@@ -0,0 +1,31 @@
+# Generated by Django 2.2.1 on 2026-10-19 16:31
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0008_storagecredential_secrets_envelope'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('topic', models.CharField(max_length=64)),
+                ('tenant_id', models.IntegerField(null=True)),
+                ('object_id', models.CharField(max_length=40)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('published_on', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(published_on__isnull=True), fields=['id'], name='outboxevent_unpublished'),
+        ),
+    ]
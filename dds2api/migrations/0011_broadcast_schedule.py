@@ -0,0 +1,42 @@
+# Generated by Django 2.2.1 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0010_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='last_run_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='next_run_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='recurrence',
+            field=models.CharField(blank=True, choices=[('HOURLY', 'every hour'), ('DAILY', 'every day'), ('WEEKLY', 'every week'), ('MONTHLY', 'every month')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='schedule_timezone',
+            field=models.CharField(default='UTC', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='scheduled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='broadcast',
+            index=models.Index(condition=models.Q(next_run_at__isnull=False), fields=['next_run_at'], name='broadcast_next_run'),
+        ),
+    ]
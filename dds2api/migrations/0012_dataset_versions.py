@@ -0,0 +1,93 @@
+# Generated by Django 2.2.1 on 2026-10-19 17:20
+
+import dds2be.storage_backends
+from django.conf import settings
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dds2api', '0011_broadcast_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='key_field',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='DataSetVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('FULL', 'uploaded file'), ('APPEND', 'appended rows'), ('UPSERT', 'upserted rows'), ('COMPACT', 'compaction')], max_length=20)),
+                ('fields', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(blank=True, max_length=64), size=None)),
+                ('key_field', models.CharField(blank=True, max_length=64)),
+                ('segments', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('rows', models.BigIntegerField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='dds2api.DataSet')),
+            ],
+            options={
+                'ordering': ('dataset', '-number'),
+                'unique_together': {('dataset', 'number')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DataSetSegment',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('BASE', 'rows'), ('UPSERT', 'rows replacing the ones with the same key')], default='BASE', max_length=20)),
+                ('file', models.FileField(storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='segments/')),
+                ('keys_file', models.FileField(blank=True, storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='segments/')),
+                ('rows', models.PositiveIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('stats', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='dds2api.DataSet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DataSetDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('mode', models.CharField(choices=[('APPEND', 'append'), ('UPSERT', 'upsert by the key field')], max_length=20)),
+                ('uploaded_file', models.FileField(storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='deltas/')),
+                ('status', models.CharField(choices=[('PENDING', 'pending'), ('APPLIED', 'applied'), ('REJECTED', 'rejected')], default='PENDING', editable=False, max_length=20)),
+                ('rows', models.PositiveIntegerField(editable=False, null=True)),
+                ('replaced', models.PositiveIntegerField(editable=False, null=True)),
+                ('error', models.CharField(blank=True, editable=False, max_length=256)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_datasetdelta_created', to=settings.AUTH_USER_MODEL)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deltas', to='dds2api.DataSet')),
+                ('modified_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dds2api_datasetdelta_modified', to=settings.AUTH_USER_MODEL)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+                ('version', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dds2api.DataSetVersion')),
+            ],
+            options={
+                'ordering': ('-created_on',),
+            },
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='dataset_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='dds2api.DataSetVersion'),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='current_version',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dds2api.DataSetVersion'),
+        ),
+        migrations.AddField(
+            model_name='datasetstats',
+            name='version',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dds2api.DataSetVersion'),
+        ),
+    ]
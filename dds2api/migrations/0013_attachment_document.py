@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0012_dataset_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='document_format',
+            field=models.CharField(choices=[('HTML', 'HTML'), ('PDF', 'PDF (needs weasyprint)')], default='PDF', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='document_template',
+            field=models.TextField(blank=True, help_text='HTML template of the document, with variables like {{myfield}} and assets like asset:logo.png'),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='origin',
+            field=models.CharField(blank=True, choices=[('URL', 'Retrieve attachment from a URL'), ('S3', 'Retrieve attachment from AWS S3 Object Key'), ('GENERATED', 'Render a document template for every row')], max_length=20),
+        ),
+    ]
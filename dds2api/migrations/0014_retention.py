@@ -0,0 +1,62 @@
+# Generated by Django 2.2.1 on 2026-10-19 18:03
+
+import dds2be.storage_backends
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0013_attachment_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(choices=[('balanceentry', 'balance entries')], max_length=64)),
+                ('keep_days', models.PositiveIntegerField()),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'unique_together': {('tenant', 'table')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('channel_type', models.CharField(choices=[('EMAIL', 'e-mail'), ('SMS', 'text message (sms)')], max_length=20)),
+                ('entries', models.BigIntegerField()),
+                ('qty', models.FloatField()),
+                ('closing_balance', models.FloatField()),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'ordering': ('tenant', '-month', 'channel_type'),
+                'unique_together': {('tenant', 'month', 'channel_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Archive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(choices=[('balanceentry', 'balance entries')], max_length=64)),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('rows', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('file', models.FileField(storage=dds2be.storage_backends.PrivateMediaStorage(), upload_to='archives/')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('purged_on', models.DateTimeField(null=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'ordering': ('tenant', 'table', '-period_start'),
+                'unique_together': {('tenant', 'table', 'period_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.1 on 2026-10-19 18:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds2api', '0014_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day'), ('month', 'month')], max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('sends', models.BigIntegerField(default=0)),
+                ('delivered', models.BigIntegerField(default=0)),
+                ('bounced', models.BigIntegerField(default=0)),
+                ('complained', models.BigIntegerField(default=0)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='dds2api.Broadcast')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'ordering': ('broadcast', 'granularity', 'bucket'),
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day'), ('month', 'month')], max_length=20)),
+                ('channel_type', models.CharField(choices=[('EMAIL', 'e-mail'), ('SMS', 'text message (sms)')], max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('entries', models.BigIntegerField(default=0)),
+                ('credits', models.FloatField(default=0)),
+                ('debits', models.FloatField(default=0)),
+                ('closing_balance', models.FloatField(default=0)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds2api.Tenant')),
+            ],
+            options={
+                'ordering': ('tenant', 'granularity', 'bucket'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='broadcastrollup',
+            index=models.Index(fields=['tenant', 'granularity', 'bucket'], name='broadcastrollup_tenant_bucket'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='broadcastrollup',
+            unique_together={('broadcast', 'granularity', 'bucket')},
+        ),
+        migrations.AddIndex(
+            model_name='balancerollup',
+            index=models.Index(fields=['tenant', 'granularity', 'bucket'], name='balancerollup_tenant_bucket'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='balancerollup',
+            unique_together={('tenant', 'granularity', 'channel_type', 'bucket')},
+        ),
+    ]
@@ -1,15 +1,23 @@
 """ dds2api models"""
 
+import json
 import uuid
 import base64
+from datetime import timedelta
 
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Q
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import JSONField, ArrayField
 
-from dds2be.storage_backends import PrivateMediaStorage
+from dds2be.lazy_storage import private_media_storage
+
+from .kms import encrypt
+from .pgnotify import notify
 
 KEY_LENGTH = 20
 
@@ -31,9 +39,74 @@ class AuthSignature(models.Model):
                                     null=True
                                     )
 
+    # fields whose changes are written to OutboxEvent in the transaction of
+    # the save, None publishes nothing. Inserts are published too;
+    # queryset.update() and bulk_create() are not
+    outbox_fields = None
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.outbox_state = instance.outbox_values()
+        return instance
+
+    def outbox_values(self):
+        # deferred fields are left out rather than loaded
+        return {name: self.__dict__[name] for name in self.outbox_fields or ()
+                if name in self.__dict__}
+
+    def outbox_payload(self):
+        return self.outbox_values()
+
+    def save(self, *args, **kwargs):  # pylint: disable=W0221
+        if self.outbox_fields is None:
+            super().save(*args, **kwargs)
+            return
+        created = self._state.adding
+        previous = getattr(self, 'outbox_state', {})
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            current = self.outbox_values()
+            changed = {name: [value, current[name]] for name, value in previous.items()
+                       if name in current and current[name] != value}
+            if created or changed:
+                OutboxEvent.objects.using(using).create(
+                    topic=f'{self._meta.model_name}.{"created" if created else "changed"}',
+                    tenant_id=getattr(self, 'tenant_id', None),
+                    object_id=str(self.pk),
+                    payload={'fields': self.outbox_payload(), 'changed': changed})
+                # wakes the relay up on commit
+                notify(OutboxEvent.CHANNEL, using)
+        self.outbox_state = current
+
+
+class OutboxEvent(models.Model):
+    """Change of a model, written in the transaction that saved it and
+       published by the relay_outbox command"""
+
+    CHANNEL = 'dds2api_outbox'
+
+    id = models.BigAutoField(primary_key=True)
+    # <model>.created or <model>.changed
+    topic = models.CharField(max_length=64)
+    # not a foreign key, events outlive what they describe
+    tenant_id = models.IntegerField(null=True)
+    object_id = models.CharField(max_length=40)
+    payload = JSONField(encoder=DjangoJSONEncoder)
+    created_on = models.DateTimeField(auto_now_add=True)
+    published_on = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'],
+                         name='outboxevent_unpublished',
+                         condition=Q(published_on__isnull=True)),
+        ]
+
 
 class TenantAware(models.Model):
     """Abstract class that defines a tenant on models"""
@@ -119,12 +192,24 @@ class BalanceEntry(TenantAware, AuthSignature):
                                    max_length=KEY_LENGTH)
     origin_id = models.CharField(max_length=40)
 
+    outbox_fields = ()
+
     class Meta:
         ordering = ('-created_on',)
+        indexes = [
+            models.Index(fields=['tenant', '-created_on'],
+                         name='balanceentry_tenant_created'),
+            models.Index(fields=['tenant', 'channel_type', '-created_on'],
+                         name='balanceentry_tenant_channel'),
+        ]
 
     def __str__(self):
         return f'{self.origin_type}  {self.channel_type} ${self.qty}'
 
+    def outbox_payload(self):
+        return {'channel_type': self.channel_type, 'qty': self.qty, 'balance': self.balance,
+                'origin_type': self.origin_type, 'origin_id': self.origin_id}
+
 
 class Tag(TenantAware, AuthSignature):
     """Tag"""
@@ -141,6 +226,10 @@ class Tag(TenantAware, AuthSignature):
     class Meta:
         ordering = ('slug',)
         unique_together = ('slug', 'tenant')
+        indexes = [
+            models.Index(fields=['tenant', 'slug'],
+                         name='tag_tenant_slug'),
+        ]
 
     def __str__(self):
         return self.tag
@@ -177,12 +266,24 @@ class StorageCredential(TenantAware, AuthSignature):
     )
     name = models.CharField(max_length=40,
                             null=False,
-                            blank=False,
-                            unique=True)
+                            blank=False)
     stype = models.CharField(max_length=KEY_LENGTH,
                              choices=STORAGE_TYPES)
-    access_key_id = models.CharField(max_length=32)
-    secret_access_key = models.CharField(max_length=32)
+    # access key id and secret access key, see set_secrets()
+    secrets_envelope = models.TextField(editable=False, default='')
+    # bumped on every change of the secrets, keys the decrypted cache
+    secrets_version = models.PositiveIntegerField(editable=False, default=0)
+
+    class Meta:
+        unique_together = ('name', 'tenant')
+
+    def set_secrets(self, access_key_id, secret_access_key):
+        """Encrypt the secrets into secrets_envelope, save() to store them"""
+        self.secrets_envelope = encrypt(json.dumps({
+            'access_key_id': access_key_id,
+            'secret_access_key': secret_access_key,
+        }).encode('utf-8'))
+        self.secrets_version += 1
 
 
 class Domain(TenantAware, AuthSignature):
@@ -191,7 +292,32 @@ class Domain(TenantAware, AuthSignature):
     """
 
     name = models.CharField(max_length=128)
-    verified = models.BooleanField(default=False)
+    # set by the verify_domains worker (dds2api.domains)
+    verified = models.BooleanField(default=False,
+                                   editable=False)
+    dns_records = JSONField(default=dict,
+                            editable=False)
+    checked_on = models.DateTimeField(null=True,
+                                      editable=False)
+    next_check_on = models.DateTimeField(null=True,
+                                         editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', 'name'],
+                         condition=models.Q(verified=True),
+                         name='domain_tenant_verified'),
+            models.Index(fields=['next_check_on'],
+                         name='domain_next_check'),
+        ]
+
+    def is_sendable(self, now=None):
+        """verified by a check recent enough to trust, no DNS lookup"""
+        if not self.verified or self.checked_on is None:
+            return False
+        now = now or timezone.now()
+        return now - self.checked_on <= timedelta(
+            seconds=settings.DDS2API_DOMAIN_VERIFICATION_MAX_AGE)
 
 
 class Sender(TenantAware, AuthSignature):
@@ -206,8 +332,20 @@ class Sender(TenantAware, AuthSignature):
                                          editable=False)
     mobile_verified = models.BooleanField(default=False,
                                           editable=False)
-    vefification_key = models.UUIDField(default=uuid.uuid4,
-                                        editable=False)
+    # sha256 of the pending verification token (dds2api.senders)
+    verification_token = models.CharField(max_length=64,
+                                          unique=True,
+                                          null=True,
+                                          editable=False)
+    verification_expires_on = models.DateTimeField(null=True,
+                                                   editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', 'email'],
+                         condition=models.Q(email_verified=True),
+                         name='sender_tenant_email_verified'),
+        ]
 
     def _get_formatted_email(self):
         """return the formated email in the form
@@ -226,9 +364,17 @@ class Attachment(TenantAware, AuthSignature):
     """
     ORIGIN_FROM_URL = 'URL'
     ORIGIN_FROM_S3_OBJECT_KEY = 'S3'
+    ORIGIN_GENERATED = 'GENERATED'
     ORIGINS = (
         (ORIGIN_FROM_URL, 'Retrieve attachment from a URL'),
         (ORIGIN_FROM_S3_OBJECT_KEY, 'Retrieve attachment from AWS S3 Object Key'),
+        (ORIGIN_GENERATED, 'Render a document template for every row'),
+    )
+    DOCUMENT_HTML = 'HTML'
+    DOCUMENT_PDF = 'PDF'
+    DOCUMENT_FORMATS = (
+        (DOCUMENT_HTML, 'HTML'),
+        (DOCUMENT_PDF, 'PDF (needs weasyprint)'),
     )
 
     ATTACHMENT_NAME_FROM_URL_PARAM = 'URL_PARAM'
@@ -243,12 +389,16 @@ class Attachment(TenantAware, AuthSignature):
     )
 
     description = models.CharField(max_length=80,
-                                   unique=True,
                                    null=False,
                                    blank=False)
     file = models.FileField(upload_to='uploads/',
-                            storage=PrivateMediaStorage(),
+                            storage=private_media_storage,
                             blank=True)
+    # bytes of file, recorded at upload so that planning does not ask the
+    # storage, None for files uploaded before it was recorded
+    file_size = models.BigIntegerField(null=True,
+                                       blank=True,
+                                       editable=False)
     field_name = models.CharField(max_length=80,
                                   blank=True)
     origin = models.CharField(max_length=KEY_LENGTH,
@@ -285,6 +435,16 @@ class Attachment(TenantAware, AuthSignature):
                                     null=True,
                                     blank=True,
                                     on_delete=models.CASCADE)
+    # GENERATED origin, the file is then a zip of the template assets
+    # (dds2api.documents)
+    document_template = models.TextField(blank=True,
+                                         help_text=(
+                                             'HTML template of the document, with variables '
+                                             'like {{myfield}} and assets like asset:logo.png'
+                                         ))
+    document_format = models.CharField(max_length=KEY_LENGTH,
+                                       choices=DOCUMENT_FORMATS,
+                                       default=DOCUMENT_PDF)
 
     def _original_filename(self):
         encoded_filename = self.file.name.split('/')[-1]
@@ -292,9 +452,23 @@ class Attachment(TenantAware, AuthSignature):
 
     original_filename = property(_original_filename)
 
+    class Meta:
+        unique_together = ('description', 'tenant')
+
     def __str__(self):
         return f'{self.description} ({self.original_filename})'
 
+    def save(self, *args, **kwargs):  # pylint: disable=W0221
+        if not self.file:
+            self.file_size = None
+        elif not self.file._committed:  # pylint: disable=W0212
+            # a new upload, its size is known before it is stored
+            self.file_size = self.file.size
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'file' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['file_size']
+        super().save(*args, **kwargs)
+
 
 class Broadcast(TenantAware, AuthSignature):
     EMAIL_CHANNEL = 'EMAIL'
@@ -304,6 +478,17 @@ class Broadcast(TenantAware, AuthSignature):
         (SMS_CHANNEL, 'SMS text message'),
     )
     STATUS_DRAFT = 'DRAFT'
+    RECUR_HOURLY = 'HOURLY'
+    RECUR_DAILY = 'DAILY'
+    RECUR_WEEKLY = 'WEEKLY'
+    RECUR_MONTHLY = 'MONTHLY'
+    RECURRENCES = (
+        (RECUR_HOURLY, 'every hour'),
+        (RECUR_DAILY, 'every day'),
+        (RECUR_WEEKLY, 'every week'),
+        (RECUR_MONTHLY, 'every month'),
+    )
+    SCHEDULE_CHANNEL = 'dds2api_schedules'
 
     uuid = models.UUIDField(default=uuid.uuid4,
                             editable=False)
@@ -315,7 +500,7 @@ class Broadcast(TenantAware, AuthSignature):
                                on_delete=models.CASCADE)
     sender = models.ForeignKey(Sender,
                                null=True,
-                               on_delete=models.CASCADE),
+                               on_delete=models.CASCADE)
     email_subject = models.CharField(max_length=256)
     status = models.CharField(max_length=KEY_LENGTH)
     tags = models.ManyToManyField(Tag)
@@ -323,6 +508,63 @@ class Broadcast(TenantAware, AuthSignature):
                                             on_delete=models.CASCADE)
     email_body = models.TextField()
     email_attachments = models.ManyToManyField(Attachment)
+    # first run, then every recurrence in the wall clock of schedule_timezone
+    # (dds2api.schedules)
+    scheduled_at = models.DateTimeField(null=True,
+                                        blank=True)
+    recurrence = models.CharField(max_length=KEY_LENGTH,
+                                  choices=RECURRENCES,
+                                  blank=True)
+    schedule_timezone = models.CharField(max_length=64,
+                                         default='UTC')
+    next_run_at = models.DateTimeField(null=True,
+                                       editable=False)
+    last_run_at = models.DateTimeField(null=True,
+                                       editable=False)
+    # snapshot of the recipients DataSet the sends read, later deltas do not
+    # change it
+    dataset_version = models.ForeignKey('DataSetVersion',
+                                        null=True,
+                                        blank=True,
+                                        on_delete=models.PROTECT)
+
+    outbox_fields = ('status',)
+
+    class Meta:
+        ordering = ('-created_on',)
+        indexes = [
+            models.Index(fields=['tenant', '-created_on'],
+                         name='broadcast_tenant_created'),
+            models.Index(fields=['tenant', 'channel_type', '-created_on'],
+                         name='broadcast_tenant_channel'),
+            models.Index(fields=['next_run_at'],
+                         name='broadcast_next_run',
+                         condition=Q(next_run_at__isnull=False)),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_next_run_at = instance.__dict__.get('next_run_at')
+        return instance
+
+    def save(self, *args, **kwargs):  # pylint: disable=W0221
+        from .schedules import next_run  # dds2api.schedules imports the models
+        if self.status == self.STATUS_DRAFT:
+            self.next_run_at = None
+        else:
+            self.next_run_at = next_run(self.scheduled_at, self.recurrence,
+                                        self.schedule_timezone, self.last_run_at)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'next_run_at' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['next_run_at']
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            if self.next_run_at != getattr(self, 'loaded_next_run_at', None):
+                # the dispatchers reload it on commit
+                notify(self.SCHEDULE_CHANNEL, using, str(self.pk))
+        self.loaded_next_run_at = self.next_run_at
 
 
 class DataSet(TenantAware, AuthSignature):
@@ -336,7 +578,7 @@ class DataSet(TenantAware, AuthSignature):
     )
     original_filename = models.CharField(max_length=256)
     uploaded_file = models.FileField(upload_to='datasets/',
-                                     storage=PrivateMediaStorage(),
+                                     storage=private_media_storage,
                                      blank=True)
     description = models.CharField(max_length=256)
     system_tag = models.CharField(max_length=256)
@@ -353,4 +595,350 @@ class DataSet(TenantAware, AuthSignature):
                                       default='"')
     status = models.CharField(max_length=KEY_LENGTH,
                               default='')
+    # upsert deltas replace the rows with the same value of key_field
+    key_field = models.CharField(max_length=64,
+                                 blank=True)
+    # version read by default, moved by dds2api.datasets on every ingestion
+    current_version = models.ForeignKey('DataSetVersion',
+                                        null=True,
+                                        editable=False,
+                                        related_name='+',
+                                        on_delete=models.SET_NULL)
     # fieldmap?
+
+    outbox_fields = ('status',)
+
+    class Meta:
+        ordering = ('-created_on',)
+        indexes = [
+            models.Index(fields=['tenant', '-created_on'],
+                         name='dataset_tenant_created'),
+        ]
+
+
+class DataSetStats(models.Model):
+    """Pre-aggregated statistics of a DataSet file, computed in one pass by
+       dds2api.datasets.compute_stats (compute_dataset_stats command)"""
+
+    dataset = models.OneToOneField(DataSet,
+                                   primary_key=True,
+                                   related_name='stats',
+                                   on_delete=models.CASCADE)
+    rows = models.BigIntegerField()
+    size = models.BigIntegerField()
+    # {field: {"distinct": estimated distinct values, "empty": count}}
+    fields = JSONField(default=dict)
+    # uniform random sample of the rows
+    sample = JSONField(default=list)
+    # the statistics are the ones of this version, of the file without one
+    version = models.ForeignKey('DataSetVersion',
+                                null=True,
+                                related_name='+',
+                                on_delete=models.SET_NULL)
+    computed_on = models.DateTimeField(auto_now=True)
+
+
+class DataSetSegment(models.Model):
+    """Immutable chunk of the rows of a DataSet, in the canonical form of
+       dds2api.datasets (utf-8 CSV of the version fields, no header)"""
+
+    BASE = 'BASE'
+    UPSERT = 'UPSERT'
+    KINDS = (
+        (BASE, 'rows'),
+        (UPSERT, 'rows replacing the ones with the same key'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    dataset = models.ForeignKey(DataSet,
+                                related_name='segments',
+                                on_delete=models.CASCADE)
+    kind = models.CharField(max_length=KEY_LENGTH,
+                            choices=KINDS,
+                            default=BASE)
+    file = models.FileField(upload_to='segments/',
+                            storage=private_media_storage)
+    # sorted 64 bit hashes of the key_field values, keyed DataSets only
+    keys_file = models.FileField(upload_to='segments/',
+                                 storage=private_media_storage,
+                                 blank=True)
+    rows = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    # {"fields": {field: {"sketch": HyperLogLog, "empty": count}},
+    #  "sample": rows}
+    stats = JSONField(default=dict)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+
+class DataSetVersion(models.Model):
+    """Consistent snapshot of a DataSet: an ordered list of segments, later
+       UPSERT segments replace the rows of the earlier ones with the same
+       key"""
+
+    FULL = 'FULL'
+    APPEND = 'APPEND'
+    UPSERT = 'UPSERT'
+    COMPACT = 'COMPACT'
+    KINDS = (
+        (FULL, 'uploaded file'),
+        (APPEND, 'appended rows'),
+        (UPSERT, 'upserted rows'),
+        (COMPACT, 'compaction'),
+    )
+
+    dataset = models.ForeignKey(DataSet,
+                                related_name='versions',
+                                on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+    kind = models.CharField(max_length=KEY_LENGTH,
+                            choices=KINDS)
+    fields = ArrayField(models.CharField(max_length=64, blank=True))
+    key_field = models.CharField(max_length=64,
+                                 blank=True)
+    segments = ArrayField(models.BigIntegerField(), default=list)
+    rows = models.BigIntegerField()
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('dataset', '-number')
+        unique_together = ('dataset', 'number')
+
+    def __str__(self):
+        return f'{self.dataset_id} v{self.number}'
+
+
+class DataSetDelta(TenantAware, AuthSignature):
+    """Rows to append or upsert to a DataSet, in the format of its file,
+       applied by the dataset.apply_delta task"""
+
+    APPEND = DataSetVersion.APPEND
+    UPSERT = DataSetVersion.UPSERT
+    MODES = (
+        (APPEND, 'append'),
+        (UPSERT, 'upsert by the key field'),
+    )
+    PENDING = 'PENDING'
+    APPLIED = 'APPLIED'
+    REJECTED = 'REJECTED'
+    STATUSES = (
+        (PENDING, 'pending'),
+        (APPLIED, 'applied'),
+        (REJECTED, 'rejected'),
+    )
+
+    dataset = models.ForeignKey(DataSet,
+                                related_name='deltas',
+                                on_delete=models.CASCADE)
+    mode = models.CharField(max_length=KEY_LENGTH,
+                            choices=MODES)
+    uploaded_file = models.FileField(upload_to='deltas/',
+                                     storage=private_media_storage)
+    status = models.CharField(max_length=KEY_LENGTH,
+                              choices=STATUSES,
+                              default=PENDING,
+                              editable=False)
+    version = models.ForeignKey(DataSetVersion,
+                                null=True,
+                                editable=False,
+                                on_delete=models.SET_NULL)
+    rows = models.PositiveIntegerField(null=True,
+                                       editable=False)
+    # rows of the previous version replaced by an upsert
+    replaced = models.PositiveIntegerField(null=True,
+                                           editable=False)
+    error = models.CharField(max_length=256,
+                             blank=True,
+                             editable=False)
+
+    class Meta:
+        ordering = ('-created_on',)
+
+
+class Suppression(TenantAware, AuthSignature):
+    """Address that must not receive messages of a channel (bounces,
+       complaints, unsubscribes)"""
+
+    channel_type = models.CharField(max_length=KEY_LENGTH,
+                                    choices=BalanceEntry.CHANNEL_TYPES)
+    address = models.CharField(max_length=254)
+    reason = models.CharField(max_length=256,
+                              blank=True)
+
+    class Meta:
+        unique_together = ('tenant', 'channel_type', 'address')
+
+    def save(self, *args, **kwargs):  # pylint: disable=W0221
+        self.address = self.address.strip().lower()
+        super().save(*args, **kwargs)
+
+
+class RetentionPolicy(TenantAware):
+    """Days the rows of a table are kept before dds2api.retention archives
+       them, overrides DDS2API_RETENTION_DAYS for a tenant"""
+
+    TABLE_BALANCE_ENTRIES = 'balanceentry'
+    TABLES = (
+        (TABLE_BALANCE_ENTRIES, 'balance entries'),
+    )
+
+    table = models.CharField(max_length=64,
+                             choices=TABLES)
+    keep_days = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('tenant', 'table')
+
+    def __str__(self):
+        return f'{self.table} {self.keep_days} days'
+
+
+class Archive(TenantAware):
+    """A month of the rows of a tenant in a table, exported to gzipped JSON
+       lines and then removed from the table"""
+
+    table = models.CharField(max_length=64,
+                             choices=RetentionPolicy.TABLES)
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    rows = models.BigIntegerField()
+    # highest id exported, later rows of the period are not removed
+    last_id = models.BigIntegerField()
+    file = models.FileField(upload_to='archives/',
+                            storage=private_media_storage)
+    created_on = models.DateTimeField(auto_now_add=True)
+    # the rows are gone from the table
+    purged_on = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ('tenant', 'table', '-period_start')
+        unique_together = ('tenant', 'table', 'period_start')
+
+    def __str__(self):
+        return f'{self.table} {self.period_start:%Y-%m}'
+
+
+class BalanceSummary(TenantAware):
+    """Monthly roll up of the archived balance entries"""
+
+    month = models.DateField()
+    channel_type = models.CharField(max_length=KEY_LENGTH,
+                                    choices=BalanceEntry.CHANNEL_TYPES)
+    entries = models.BigIntegerField()
+    qty = models.FloatField()
+    # balance of the last entry of the month
+    closing_balance = models.FloatField()
+
+    class Meta:
+        ordering = ('tenant', '-month', 'channel_type')
+        unique_together = ('tenant', 'month', 'channel_type')
+
+
+class BalanceRollup(TenantAware):
+    """Balance entries of a channel per hour, day and month (UTC), kept up
+       to date as entries are inserted (dds2api.rollups)"""
+
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+    GRANULARITIES = (
+        (HOUR, 'hour'),
+        (DAY, 'day'),
+        (MONTH, 'month'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    granularity = models.CharField(max_length=KEY_LENGTH,
+                                   choices=GRANULARITIES)
+    channel_type = models.CharField(max_length=KEY_LENGTH,
+                                    choices=BalanceEntry.CHANNEL_TYPES)
+    bucket = models.DateTimeField()
+    entries = models.BigIntegerField(default=0)
+    # sums of the positive and of the negative quantities
+    credits = models.FloatField(default=0)
+    debits = models.FloatField(default=0)
+    # balance of the last entry of the bucket
+    closing_balance = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ('tenant', 'granularity', 'bucket')
+        unique_together = ('tenant', 'granularity', 'channel_type', 'bucket')
+        indexes = [
+            models.Index(fields=['tenant', 'granularity', 'bucket'],
+                         name='balancerollup_tenant_bucket'),
+        ]
+
+
+class BroadcastRollup(TenantAware):
+    """Delivery counts of a broadcast per hour, day and month (UTC)"""
+
+    id = models.BigAutoField(primary_key=True)
+    broadcast = models.ForeignKey(Broadcast,
+                                  related_name='rollups',
+                                  on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=KEY_LENGTH,
+                                   choices=BalanceRollup.GRANULARITIES)
+    bucket = models.DateTimeField()
+    sends = models.BigIntegerField(default=0)
+    delivered = models.BigIntegerField(default=0)
+    bounced = models.BigIntegerField(default=0)
+    complained = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ('broadcast', 'granularity', 'bucket')
+        unique_together = ('broadcast', 'granularity', 'bucket')
+        indexes = [
+            models.Index(fields=['tenant', 'granularity', 'bucket'],
+                         name='broadcastrollup_tenant_bucket'),
+        ]
+
+
+class Job(models.Model):
+    """Background task run by the run_jobs workers (dds2api.jobs)"""
+
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUSES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+    CHANNEL = 'dds2api_jobs'
+
+    id = models.BigAutoField(primary_key=True)
+    # jobs of a tenant are capped at DDS2API_JOB_TENANT_CONCURRENCY
+    tenant = models.ForeignKey(Tenant,
+                               null=True,
+                               on_delete=models.CASCADE)
+    task = models.CharField(max_length=64)
+    args = JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # lower runs first, see dds2api.jobs.LANES
+    priority = models.SmallIntegerField()
+    status = models.CharField(max_length=KEY_LENGTH,
+                              choices=STATUSES,
+                              default=QUEUED)
+    # queued: not before (retry backoff), running: until the lease expires
+    # and another worker may take the job over
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    worker = models.CharField(max_length=64,
+                              blank=True)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    finished_on = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['priority', 'run_after', 'id'],
+                         name='job_claimable',
+                         condition=Q(status__in=['QUEUED', 'RUNNING'])),
+            models.Index(fields=['tenant'],
+                         name='job_running_tenant',
+                         condition=Q(status='RUNNING')),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} {self.status}'
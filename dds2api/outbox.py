@@ -0,0 +1,118 @@
+"""
+Change feed relay
+
+AuthSignature.save() writes an OutboxEvent for the models that declare
+outbox_fields (Broadcast and DataSet status, BalanceEntry inserts) in the
+transaction of the save, and NOTIFYs the relay. relay_batch() publishes the
+oldest unpublished events to the sink of DDS2API_OUTBOX_SINK and marks them
+published in one transaction: a failed publish is retried, so consumers get
+every event at least once and drop the ids they have already seen.
+Events are not delivered in any guaranteed order: ids are assigned at insert,
+not at commit, so an event whose transaction commits late is relayed after
+higher ids.
+"""
+
+import json
+import os
+import socket
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+
+def event_message(event):
+    return {
+        'id': event.id,
+        'topic': event.topic,
+        'tenant': event.tenant_id,
+        'object_id': event.object_id,
+        'payload': event.payload,
+        'created_on': event.created_on,
+    }
+
+
+def _lines(events):
+    return b''.join(json.dumps(event_message(event), cls=DjangoJSONEncoder).encode('utf-8') +
+                    b'\n' for event in events)
+
+
+class FileSink:
+    """Appends the events to a file as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, events):
+        with open(self.path, 'ab') as sink_file:
+            sink_file.write(_lines(events))
+            sink_file.flush()
+            os.fsync(sink_file.fileno())
+
+    def close(self):
+        pass
+
+
+class SocketSink:
+    """Writes the events as JSON lines to a TCP connection, reconnecting
+       after errors"""
+
+    def __init__(self, host, port, timeout=10):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._socket = None
+
+    def publish(self, events):
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address, self.timeout)
+        try:
+            self._socket.sendall(_lines(events))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def get_sink(url=None):
+    """Sink of a file:///path or tcp://host:port url"""
+    url = url or settings.DDS2API_OUTBOX_SINK
+    parts = urlsplit(url)
+    if parts.scheme == 'file':
+        return FileSink(parts.path)
+    if parts.scheme == 'tcp' and parts.hostname and parts.port:
+        return SocketSink(parts.hostname, parts.port)
+    raise ImproperlyConfigured(f'unsupported outbox sink {url}')
+
+
+def relay_batch(sink, batch_size=500):
+    """Publish up to batch_size committed events, oldest ids first, returns
+       how many were published"""
+    with transaction.atomic():
+        events = list(OutboxEvent.objects
+                      .filter(published_on__isnull=True)
+                      .select_for_update(skip_locked=True)
+                      .order_by('id')[:batch_size])
+        if not events:
+            return 0
+        sink.publish(events)
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            published_on=timezone.now())
+    return len(events)
+
+
+def purge_published(max_age=None):
+    """Delete the events published more than max_age seconds ago"""
+    max_age = settings.DDS2API_OUTBOX_RETENTION_SECONDS if max_age is None else max_age
+    deleted, _ = OutboxEvent.objects.filter(
+        published_on__lt=timezone.now() - timedelta(seconds=max_age)).delete()
+    return deleted
@@ -1,19 +1,93 @@
+import time
+
 from rest_framework import permissions
+from rest_framework.authentication import SessionAuthentication
+
+from .authentication import (
+    PERMS_CLAIM,
+    claims_are_fresh,
+    revoked_since,
+    stateless_enabled,
+)
+from .rbac import PERM_READ, PERM_MANAGE, PermissionSet, load_permissions
+
+SESSION_KEY = 'dds2api_perms'
+
+
+def _session_permissions(request):
+    """Compile once per session, until the user's memberships change"""
+    session = request._request.session  # pylint: disable=W0212
+    cached = session.get(SESSION_KEY)
+    if (
+            cached and
+            cached['user'] == request.user.id and
+            not revoked_since(request.user.id, cached['at'])
+    ):
+        return PermissionSet.from_claim(cached['table'])
+    perms = load_permissions(request.user.id)
+    session[SESSION_KEY] = {'user': request.user.id,
+                            'at': time.time(),
+                            'table': perms.to_claim()}
+    return perms
+
+
+def request_permissions(request):
+    """The compiled PermissionSet of the request user, from the token
+       claims, the session or the database in that order"""
+    perms = getattr(request, '_dds2api_perms', None)
+    if perms is not None:
+        return perms
+    token = getattr(request, 'auth', None)
+    if stateless_enabled() and claims_are_fresh(token):
+        perms = PermissionSet.from_claim(token[PERMS_CLAIM])
+    elif isinstance(getattr(request, 'successful_authenticator', None),
+                    SessionAuthentication):
+        perms = _session_permissions(request)
+    else:
+        perms = load_permissions(request.user.id)
+    request._dds2api_perms = perms  # pylint: disable=W0212
+    return perms
+
+
+def required_permission(request, view):
+    """Permission bit the request needs, views set write_permission"""
+    if request.method in permissions.SAFE_METHODS:
+        return PERM_READ
+    return getattr(view, 'write_permission', PERM_MANAGE)
 
 
 def user_tenants(request):
-    user = request.user
-    return [t.id for t in user.profile.tenant.all()]
+    return request_permissions(request).tenants()
+
+
+def action_tenants(request, view):
+    """Tenants where the user may perform the request action"""
+    return request_permissions(request).tenants(required_permission(request, view))
 
 
 class UserIsTenantMember(permissions.BasePermission):
     """
-    Custom permission allow only if the user is a member of the
-    object tenant
+    Custom permission allow only if the user's roles in the
+    object tenant grant the requested action
     """
 
+    def has_permission(self, request, view):
+        if (
+                request.method in permissions.SAFE_METHODS or
+                'tenant' not in request.data
+        ):
+            return True
+        try:
+            tenant_id = int(request.data['tenant'])
+        except (TypeError, ValueError):
+            # let the serializer report it
+            return True
+        return request_permissions(request).allows(
+            tenant_id, required_permission(request, view))
+
     def has_object_permission(self, request, view, obj):
-        return obj.tenant.id in user_tenants(request)
+        return request_permissions(request).allows(
+            obj.tenant_id, required_permission(request, view))
 
 
 class IsOwner(permissions.BasePermission):
@@ -23,4 +97,4 @@ class IsOwner(permissions.BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        return obj.user.id == request.user.id
+        return obj.user_id == request.user.id
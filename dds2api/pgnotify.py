@@ -0,0 +1,40 @@
+"""
+Postgres LISTEN / NOTIFY, so that the relay and the job workers wake up
+when there is work instead of polling tables
+"""
+
+import select
+
+import psycopg2
+from django.db import connection, connections
+
+
+def notify(channel, using='default', payload=''):
+    """Delivered once the current transaction commits, the same
+       notification repeated in a transaction is delivered once"""
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [channel, payload])
+
+
+class Listener:
+    """LISTENs on a connection of its own, outside the pool"""
+
+    def __init__(self, channel):
+        self._connection = psycopg2.connect(**connection.get_connection_params())
+        self._connection.set_session(autocommit=True)
+        with self._connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {channel}')
+
+    def wait(self, timeout, *wakers):
+        """Payloads of the notifications received before timeout seconds,
+           empty when there were none. Returns early as well when one of the
+           file descriptors wakers becomes readable"""
+        if not self._connection.notifies:
+            select.select([self._connection, *wakers], [], [], timeout)
+            self._connection.poll()
+        payloads = [notification.payload for notification in self._connection.notifies]
+        del self._connection.notifies[:]
+        return payloads
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,122 @@
+"""
+Broadcast dry run
+
+plan_broadcast() estimates what sending a broadcast to a DataSet would
+take without reading the file: recipients come from the DataSet
+statistics (distinct count sketch, sample), suppressions and message
+sizes are measured on the sample, credits are compared with the last
+BalanceEntry of the channel and the duration follows DDS2API_SEND_RATES.
+Its cost does not depend on the number of rows.
+"""
+
+import math
+
+from django.conf import settings
+
+from .datasets import normalize
+from .messages import build_email, render, render_email
+from .models import BalanceEntry, Broadcast, Suppression
+
+# rows of the sample rendered to measure the messages
+RENDERED_ROWS = 200
+# stands for the recipients, whose addresses may not be valid yet
+SIZE_PROBE_ADDRESS = 'recipient@example.com'
+GSM_SEGMENT = (160, 153)
+UNICODE_SEGMENT = (70, 67)
+GSM_CHARACTERS = frozenset(
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà')
+
+
+def sms_segments(text):
+    """Parts a text message is split into"""
+    single, concatenated = (GSM_SEGMENT if set(text) <= GSM_CHARACTERS
+                            else UNICODE_SEGMENT)
+    if len(text) <= single:
+        return 1
+    return math.ceil(len(text) / concatenated)
+
+
+def current_balance(tenant_id, channel_type):
+    entry = (BalanceEntry.objects
+             .filter(tenant_id=tenant_id, channel_type=channel_type)
+             .order_by('-created_on')
+             .values_list('balance', flat=True)
+             .first())
+    return entry or 0.0
+
+
+def attachment_sizes(broadcast):
+    """(bytes of the uploaded attachments, ids of the ones fetched at send
+       time whose size is unknown)"""
+    total, unsized = 0, []
+    for attachment in broadcast.email_attachments.all():
+        if attachment.origin or not attachment.file:
+            unsized.append(attachment.pk)
+        elif attachment.file_size is not None:
+            total += attachment.file_size
+        else:
+            # uploaded before file_size was recorded, asks the storage
+            total += attachment.file.size
+    return total, unsized
+
+
+def plan_broadcast(broadcast, stats, recipient_field):
+    sample = [row for row in stats.sample if normalize(row.get(recipient_field, ''))]
+    field = stats.fields.get(recipient_field, {'distinct': 0, 'empty': stats.rows})
+    distinct = min(field['distinct'], stats.rows - field['empty'])
+
+    addresses = {normalize(row[recipient_field]) for row in sample}
+    suppressed = Suppression.objects.filter(
+        tenant_id=broadcast.tenant_id,
+        channel_type=broadcast.channel_type,
+        address__in=addresses).count() if addresses else 0
+    suppressed_share = suppressed / len(addresses) if addresses else 0.0
+    recipients = int(round(distinct * (1 - suppressed_share)))
+
+    rendered = sample[:RENDERED_ROWS]
+    attachments_size, unsized = 0, []
+    if broadcast.channel_type == Broadcast.EMAIL_CHANNEL:
+        attachments_size, unsized = attachment_sizes(broadcast)
+        message_size = sum(
+            len(build_email(*render_email(broadcast, row), settings.DEFAULT_FROM_EMAIL,
+                            SIZE_PROBE_ADDRESS))
+            for row in rendered) / max(len(rendered), 1)
+        # base64 grows the attachments by 4/3
+        message_size += attachments_size * 4 / 3
+        credits_per_message = 1.0
+    else:
+        texts = [render(broadcast.email_body, row) for row in rendered]
+        message_size = sum(len(text.encode('utf-8')) for text in texts) / max(len(texts), 1)
+        credits_per_message = sum(map(sms_segments, texts)) / max(len(texts), 1)
+
+    credits = math.ceil(recipients * credits_per_message)
+    balance = current_balance(broadcast.tenant_id, broadcast.channel_type)
+    rate = settings.DDS2API_SEND_RATES[broadcast.channel_type]
+    return {
+        'rows': stats.rows,
+        'sampled_rows': len(stats.sample),
+        'recipients': {
+            'distinct': distinct,
+            'suppressed': distinct - recipients,
+            'total': recipients,
+        },
+        'messages': {broadcast.channel_type: recipients},
+        'bytes': {
+            'per_message': int(round(message_size)),
+            'attachments': attachments_size,
+            'total': int(round(message_size * recipients)),
+        },
+        'unsized_attachments': unsized,
+        'credits': {
+            'required': credits,
+            'balance': balance,
+            'sufficient': credits <= balance,
+        },
+        'estimated_seconds': math.ceil(recipients / rate),
+        'computed_on': stats.computed_on,
+    }
+
+
+def default_recipient_field(channel_type):
+    return 'email' if channel_type == Broadcast.EMAIL_CHANNEL else 'mobile_number'
@@ -0,0 +1,103 @@
+"""
+Rows for template previews
+
+Template editors render the same few rows over and over, so the decoded
+rows of the last DDS2API_PREVIEW_DATASETS DataSets are kept in process.
+Random rows come from the DataSet statistics sample when there is one (no
+file read at all), otherwise from the head of the file. Rows asked for by
+number are read once and kept with the rest, the last NUMBERED_ROWS of
+them. Only the first DDS2API_PREVIEW_SCAN_ROWS rows can be asked for, a
+preview never reads further into the file.
+"""
+
+import random
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+
+from .datasets import open_rows, snapshot_key
+from .models import DataSetStats
+
+# rows read from the head of the file when the DataSet has no statistics
+HEAD_ROWS = 1000
+# rows kept by number per DataSet
+NUMBERED_ROWS = 1000
+
+
+class SampleRows:
+    """Decoded rows of one version of a DataSet file"""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.numbered = OrderedDict()
+        self._pool = None
+
+    def pool(self):
+        with self.lock:
+            if self._pool is None:
+                sample = (DataSetStats.objects
+                          .filter(dataset=self.dataset,
+                                  version=self.dataset.current_version_id)
+                          .values_list('sample', flat=True)
+                          .first())
+                if not sample:
+                    sample = list(islice(open_rows(self.dataset), HEAD_ROWS))
+                    self.numbered.update(enumerate(sample))
+                self._pool = sample
+            return self._pool
+
+    def random(self, count):
+        pool = self.pool()
+        return random.sample(pool, min(count, len(pool)))
+
+    def numbers(self, numbers):
+        """Rows by number (from 0, header excluded), numbers past the end
+           of the file or the scanned rows are left out"""
+        numbers = [number for number in numbers
+                   if number < settings.DDS2API_PREVIEW_SCAN_ROWS]
+        with self.lock:
+            missing = sorted(set(numbers) - set(self.numbered))
+            if missing:
+                wanted = set(missing)
+                for number, row in enumerate(islice(open_rows(self.dataset), missing[-1] + 1)):
+                    if number in wanted:
+                        self.numbered[number] = row
+            rows = []
+            for number in numbers:
+                if number in self.numbered:
+                    self.numbered.move_to_end(number)
+                    rows.append((number, self.numbered[number]))
+            while len(self.numbered) > NUMBERED_ROWS:
+                self.numbered.popitem(last=False)
+            return rows
+
+
+class SampleRowCache:
+    """LRU of SampleRows, a new version, file or parsing options make a new
+       entry and the stale one ages out"""
+
+    def __init__(self, max_datasets):
+        self.max_datasets = max_datasets
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dataset):
+        key = (dataset.pk,) + snapshot_key(dataset)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = SampleRows(dataset)
+                while len(self._entries) > self.max_datasets:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+sample_rows = SampleRowCache(settings.DDS2API_PREVIEW_DATASETS)  # pylint: disable=C0103
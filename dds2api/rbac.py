@@ -0,0 +1,70 @@
+"""dds2api role based access
+
+A user's roles are compiled into a table of tenant id -> permission
+bitmask, so every access check is a dict lookup and a bitwise and.
+"""
+
+from .models import Profile, Role
+
+PERM_READ = 1
+PERM_TEMPLATES = 2
+PERM_MANAGE = 4
+
+# tenant membership alone grants PERM_READ
+ROLE_PERMISSIONS = {
+    Role.ADMIN: PERM_READ | PERM_TEMPLATES | PERM_MANAGE,
+    Role.TEMPLATE_EDITOR: PERM_READ | PERM_TEMPLATES,
+}
+
+
+class PermissionSet:
+    """Compiled permissions of a user, by tenant"""
+
+    __slots__ = ('table', '_tenants')
+
+    def __init__(self, table):
+        self.table = table
+        self._tenants = {}
+
+    def allows(self, tenant_id, perm):
+        return self.table.get(tenant_id, 0) & perm == perm
+
+    def tenants(self, perm=PERM_READ):
+        """ids of the tenants where perm is granted"""
+        if perm not in self._tenants:
+            self._tenants[perm] = [tenant_id for tenant_id, bits in self.table.items()
+                                   if bits & perm == perm]
+        return self._tenants[perm]
+
+    def to_claim(self):
+        return [[tenant_id, bits] for tenant_id, bits in self.table.items()]
+
+    @classmethod
+    def from_claim(cls, pairs):
+        return cls({tenant_id: bits for tenant_id, bits in pairs})
+
+
+def compile_permissions(tenants, roles):
+    """tenants is an iterable of tenant ids and roles of (tenant id, role)
+       pairs, roles in tenants the user is not a member of are ignored"""
+    table = dict.fromkeys(tenants, PERM_READ)
+    for tenant_id, role in roles:
+        if tenant_id in table:
+            table[tenant_id] |= ROLE_PERMISSIONS.get(role, 0)
+    return PermissionSet(table)
+
+
+def user_memberships(user_id):
+    """(tenant ids, (tenant id, role) pairs) of a user, two queries and
+       neither the user nor the profile row is loaded"""
+    tenants = list(Profile.tenant.through.objects
+                   .filter(profile__user_id=user_id)
+                   .values_list('tenant_id', flat=True))
+    roles = list(Role.objects
+                 .filter(profile__user_id=user_id)
+                 .values_list('tenant_id', 'role'))
+    return tenants, roles
+
+
+def load_permissions(user_id):
+    return compile_permissions(*user_memberships(user_id))
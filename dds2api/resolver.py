@@ -0,0 +1,257 @@
+"""
+Async DNS stub resolver with a TTL respecting cache
+
+Only what domain verification needs: TXT, MX and SOA (for negative
+caching) over UDP, retried over TCP when the answer is truncated.
+Concurrent queries for the same name and type share one lookup.
+"""
+
+import asyncio
+import random
+import struct
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+TYPE_A = 1
+TYPE_CNAME = 5
+TYPE_SOA = 6
+TYPE_MX = 15
+TYPE_TXT = 16
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+FLAG_QR = 0x8000
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+
+HEADER = struct.Struct('!HHHHHH')
+RR_HEADER = struct.Struct('!HHIH')
+
+# records is a tuple of str (TXT) or (preference, host) (MX), empty when
+# the name or the type does not exist
+Answer = namedtuple('Answer', 'records ttl rcode')
+
+
+class DNSError(Exception):
+    pass
+
+
+def nameservers():
+    """DDS2API_DNS_NAMESERVERS, or the ones of /etc/resolv.conf"""
+    if settings.DDS2API_DNS_NAMESERVERS:
+        return list(settings.DDS2API_DNS_NAMESERVERS)
+    try:
+        with open('/etc/resolv.conf') as resolv_conf:
+            servers = [line.split()[1] for line in resolv_conf
+                       if line.startswith('nameserver') and len(line.split()) > 1]
+    except OSError:
+        servers = []
+    return servers or ['127.0.0.1']
+
+
+def encode_name(name):
+    labels = name.rstrip('.').encode('idna').split(b'.') if name.strip('.') else []
+    return b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+
+
+def build_query(query_id, name, rtype):
+    return (HEADER.pack(query_id, FLAG_RD, 1, 0, 0, 0) +
+            encode_name(name) + struct.pack('!HH', rtype, CLASS_IN))
+
+
+def decode_name(packet, offset):
+    """(name, offset after the name), follows compression pointers"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | packet[offset + 1]
+        elif length:
+            labels.append(packet[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+            offset += 1 + length
+        else:
+            return '.'.join(labels).lower(), end if end is not None else offset + 1
+    raise DNSError('compression loop')
+
+
+def _decode_rdata(packet, rtype, offset, length):
+    if rtype == TYPE_TXT:
+        strings, position = [], offset
+        while position < offset + length:
+            size = packet[position]
+            strings.append(packet[position + 1:position + 1 + size])
+            position += 1 + size
+        return b''.join(strings).decode('utf-8', 'replace')
+    if rtype == TYPE_MX:
+        preference, = struct.unpack_from('!H', packet, offset)
+        return preference, decode_name(packet, offset + 2)[0]
+    if rtype == TYPE_SOA:
+        position = decode_name(packet, decode_name(packet, offset)[1])[1]
+        return struct.unpack_from('!IIIII', packet, position)[4]
+    return packet[offset:offset + length]
+
+
+def parse_response(packet, query_id, rtype, default_negative_ttl=300):
+    """Answer of a response packet, or None when it is truncated"""
+    try:
+        (response_id, flags, qdcount, ancount, nscount,
+         _) = HEADER.unpack_from(packet, 0)
+        if response_id != query_id or not flags & FLAG_QR:
+            raise DNSError('unexpected response')
+        if flags & FLAG_TC:
+            return None
+        rcode = flags & 0x000F
+        if rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            raise DNSError(f'server answered rcode {rcode}')
+        offset = HEADER.size
+        for _ in range(qdcount):
+            offset = decode_name(packet, offset)[1] + 4
+        records, ttls, negative_ttl = [], [], None
+        for index in range(ancount + nscount):
+            offset = decode_name(packet, offset)[1]
+            record_type, _, ttl, length = RR_HEADER.unpack_from(packet, offset)
+            offset += RR_HEADER.size
+            if index < ancount and record_type == rtype:
+                records.append(_decode_rdata(packet, record_type, offset, length))
+                ttls.append(ttl)
+            elif index >= ancount and record_type == TYPE_SOA:
+                negative_ttl = min(ttl, _decode_rdata(packet, TYPE_SOA, offset, length))
+            offset += length
+    except (IndexError, struct.error) as exc:
+        raise DNSError(f'malformed response: {exc}')
+    if records:
+        return Answer(tuple(records), min(ttls), rcode)
+    return Answer((), default_negative_ttl if negative_ttl is None else negative_ttl, rcode)
+
+
+class _UDPExchange(asyncio.DatagramProtocol):
+
+    def __init__(self, query):
+        self.query = query
+        self.response = asyncio.get_event_loop().create_future()
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        if not self.response.done():
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+class DNSCache:
+    """Answers by (name, type) until their TTL, clamped to
+       [min_ttl, max_ttl], runs out. The least recently used entries go
+       first beyond max_entries"""
+
+    def __init__(self, max_entries=10000, min_ttl=0, max_ttl=86400, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, answer = entry
+        remaining = expires - self.clock()
+        if remaining <= 0:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        # callers see the time left, as a downstream resolver would
+        return answer._replace(ttl=int(remaining))
+
+    def set(self, key, answer):
+        ttl = max(self.min_ttl, min(answer.ttl, self.max_ttl))
+        if not ttl:
+            return
+        self._entries[key] = (self.clock() + ttl, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class Resolver:
+    """
+    Stub resolver that asks the recursive nameservers (see nameservers())
+    on port. Timeouts and server failures raise DNSError and are not
+    cached, NXDOMAIN and empty answers are cached for the SOA minimum.
+    """
+
+    def __init__(self, servers=None, port=53, timeout=2.0, tries=2, cache=None):
+        self.servers = servers or nameservers()
+        self.port = port
+        self.timeout = timeout
+        self.tries = tries
+        self.cache = DNSCache() if cache is None else cache
+        self._inflight = {}
+
+    async def query(self, name, rtype):
+        key = (name.rstrip('.').lower(), rtype)
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = self._inflight[key] = asyncio.ensure_future(self._resolve(*key))
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _resolve(self, name, rtype):
+        answer = await self.lookup(name, rtype)
+        self.cache.set((name, rtype), answer)
+        return answer
+
+    async def lookup(self, name, rtype):
+        """Ask the nameservers, without the cache"""
+        error = None
+        for attempt in range(self.tries):
+            server = self.servers[attempt % len(self.servers)]
+            query_id = random.getrandbits(16)
+            query = build_query(query_id, name, rtype)
+            try:
+                packet = await self._udp(server, query)
+                answer = parse_response(packet, query_id, rtype)
+                if answer is None:
+                    answer = parse_response(await self._tcp(server, query), query_id, rtype)
+                if answer is not None:
+                    return answer
+            except (OSError, asyncio.TimeoutError, DNSError) as exc:
+                error = exc
+        raise DNSError(f'{name} ({rtype}): {error or "truncated answer"}')
+
+    async def _udp(self, server, query):
+        loop = asyncio.get_event_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _UDPExchange(query), remote_addr=(server, self.port))
+        try:
+            return await asyncio.wait_for(protocol.response, self.timeout)
+        finally:
+            transport.close()
+
+    async def _tcp(self, server, query):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(server, self.port), self.timeout)
+        try:
+            writer.write(struct.pack('!H', len(query)) + query)
+            length, = struct.unpack('!H', await asyncio.wait_for(reader.readexactly(2),
+                                                                 self.timeout))
+            return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+        finally:
+            writer.close()
@@ -0,0 +1,215 @@
+"""
+Retention and archival
+
+The rows of an append-only table (the ledger; delivery logs as they come)
+are kept for the days of the RetentionPolicy of their tenant, or the
+DDS2API_RETENTION_DAYS default of the table. apply_retention() takes the
+months that ended before that, per tenant, one at a time:
+
+1. the month is rolled up into its summary table, if the table has one,
+   and exported as gzipped JSON lines (a header with the field names, then
+   a list of values per row) to an Archive in private storage, in one
+   transaction;
+2. the rows are deleted in batches of DDS2API_RETENTION_BATCH_SIZE, each
+   in a short transaction of its own, so no DELETE holds locks or bloats
+   the table for long. A run that stops halfway resumes the deletion.
+   Rows the live data still depends on stay: the newest balance entry of
+   each channel of a tenant holds its balance, however old it is.
+
+Archived rows are read back with archived_rows(), the API streams them.
+"""
+
+import gzip
+import io
+import json
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+from .models import Archive, BalanceEntry, BalanceSummary, RetentionPolicy, Tenant
+
+ArchivedTable = namedtuple('ArchivedTable', 'model summarize kept')
+
+
+def month_start(moment):
+    moment = moment.astimezone(pytz.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=pytz.utc)
+
+
+def next_month(start):
+    return month_start(start + timedelta(days=32))
+
+
+def due_months(oldest, cutoff):
+    """(start, end) of the months from the one of oldest that end before
+       cutoff"""
+    start, last = month_start(oldest), month_start(cutoff)
+    months = []
+    while start < last:
+        months.append((start, next_month(start)))
+        start = next_month(start)
+    return months
+
+
+def write_archive(names, rows, stream):
+    """Write rows (lists of values of names) gzipped to stream, returns how
+       many"""
+    count = 0
+    with gzip.GzipFile(fileobj=stream, mode='wb') as archive:
+        archive.write(json.dumps(names).encode('utf-8') + b'\n')
+        for row in rows:
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+            count += 1
+    return count
+
+
+def read_archive(stream):
+    """Rows of an archive as dicts"""
+    with gzip.GzipFile(fileobj=stream, mode='rb') as archive:
+        lines = io.TextIOWrapper(archive, encoding='utf-8')
+        names = json.loads(next(lines))
+        for line in lines:
+            yield dict(zip(names, json.loads(line)))
+
+
+def archived_rows(archive):
+    with archive.file.open('rb') as stream:
+        yield from read_archive(stream)
+
+
+def summarize_balance(tenant_id, start, end):
+    entries = BalanceEntry.objects.filter(tenant_id=tenant_id, created_on__gte=start,
+                                          created_on__lt=end)
+    closing = dict(entries
+                   .order_by('channel_type', '-created_on', '-pk')
+                   .distinct('channel_type')
+                   .values_list('channel_type', 'balance'))
+    for channel_type, count, qty in (entries
+                                     .order_by()
+                                     .values_list('channel_type')
+                                     .annotate(Count('id'), Sum('qty'))):
+        BalanceSummary.objects.update_or_create(
+            tenant_id=tenant_id, month=start.date(), channel_type=channel_type,
+            defaults={'entries': count, 'qty': qty, 'closing_balance': closing[channel_type]})
+
+
+def latest_balances(tenant_id):
+    """ids of the newest entry of each channel of a tenant"""
+    return list(BalanceEntry.objects
+                .filter(tenant_id=tenant_id)
+                .order_by('channel_type', '-created_on', '-pk')
+                .distinct('channel_type')
+                .values_list('pk', flat=True))
+
+
+TABLES = {
+    RetentionPolicy.TABLE_BALANCE_ENTRIES: ArchivedTable(BalanceEntry, summarize_balance,
+                                                         latest_balances),
+}
+
+
+def archived_fields(table):
+    """Names of the fields the archives of table hold"""
+    return [field.attname for field in
+            TABLES[table].model._meta.concrete_fields]  # pylint: disable=W0212
+
+
+def row_filters(archive, params):
+    """The field=value pairs of params that name a field of the archive,
+       other parameters (format, page, cursor...) are not filters"""
+    names = set(archived_fields(archive.table))
+    return {name: value for name, value in params.items() if name in names}
+
+
+def _period_rows(table, tenant_id, start, end):
+    return TABLES[table].model.objects.filter(tenant_id=tenant_id, created_on__gte=start,
+                                              created_on__lt=end)
+
+
+def export_period(table, tenant_id, start, end):
+    """Archive (and roll up) a month of a table, None when it has no rows"""
+    rows = _period_rows(table, tenant_id, start, end).order_by('pk')
+    last_id = rows.values_list('pk', flat=True).last()
+    if last_id is None:
+        return None
+    rows = rows.filter(pk__lte=last_id)
+    names = archived_fields(table)
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as stream:
+        count = write_archive(names, rows.values_list(*names).iterator(chunk_size=2000), stream)
+        stream.seek(0)
+        with transaction.atomic():
+            if TABLES[table].summarize is not None:
+                TABLES[table].summarize(tenant_id, start, end)
+            archive = Archive(tenant_id=tenant_id, table=table, period_start=start,
+                              period_end=end, rows=count, last_id=last_id)
+            archive.file.save(f'{table}-{tenant_id}-{start:%Y-%m}.jsonl.gz', File(stream),
+                              save=False)
+            archive.save()
+    return archive
+
+
+def purge_archived(archive, batch_size=None):
+    """Delete the archived rows from their table, in batches, but the
+       kept ones. Returns how many"""
+    batch_size = batch_size or settings.DDS2API_RETENTION_BATCH_SIZE
+    model, _, kept = TABLES[archive.table]
+    rows = _period_rows(archive.table, archive.tenant_id, archive.period_start,
+                        archive.period_end).filter(pk__lte=archive.last_id)
+    if kept is not None:
+        rows = rows.exclude(pk__in=kept(archive.tenant_id))
+    deleted = 0
+    while True:
+        ids = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        # autocommit, a transaction per batch
+        batch, _ = model.objects.filter(pk__in=ids).delete()
+        deleted += batch
+    Archive.objects.filter(pk=archive.pk).update(purged_on=timezone.now())
+    return deleted
+
+
+def keep_days(table):
+    """{tenant id: days} of the tenants whose rows of table expire"""
+    default = settings.DDS2API_RETENTION_DAYS.get(table)
+    days = {}
+    if default is not None:
+        days = dict.fromkeys(Tenant.objects.values_list('pk', flat=True), default)
+    days.update(RetentionPolicy.objects.filter(table=table).values_list('tenant', 'keep_days'))
+    return days
+
+
+def apply_retention(tables=None, now=None, batch_size=None):
+    """Archive and purge what the policies let go of, yields the archives
+       as they are done"""
+    now = now or timezone.now()
+    for table in tables or TABLES:
+        # runs that stopped before the rows were deleted
+        for archive in Archive.objects.filter(table=table, purged_on__isnull=True):
+            purge_archived(archive, batch_size)
+            yield archive
+        for tenant_id, days in keep_days(table).items():
+            cutoff = now - timedelta(days=days)
+            oldest = (TABLES[table].model.objects
+                      .filter(tenant_id=tenant_id, created_on__lt=month_start(cutoff))
+                      .aggregate(oldest=Min('created_on'))['oldest'])
+            if oldest is None:
+                continue
+            archived = set(Archive.objects
+                           .filter(table=table, tenant_id=tenant_id)
+                           .values_list('period_start', flat=True))
+            for start, end in due_months(oldest, cutoff):
+                if start in archived:
+                    continue
+                archive = export_period(table, tenant_id, start, end)
+                if archive is not None:
+                    purge_archived(archive, batch_size)
+                    yield archive
@@ -0,0 +1,110 @@
+"""
+Usage rollups for the dashboards
+
+Every balance entry inserted adds itself to the hour, day and month (UTC)
+BalanceRollup rows of its tenant and channel in the transaction of the
+insert, one INSERT ... ON CONFLICT DO UPDATE for the three of them, so the
+analytics endpoints read a few pre-aggregated rows whatever the history.
+The rollups outlive the entries, archived ones (dds2api.retention) stay
+counted. bulk_create() skips them like it skips the outbox; rebuild the
+rollups of a tenant after loading entries that way.
+
+Delivery counts of broadcasts are added the same way by the send pipeline
+with add_delivery_events().
+"""
+
+import pytz
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Archive, BalanceEntry, BalanceRollup, BroadcastRollup, RetentionPolicy
+from .retention import month_start
+
+
+def buckets(moment):
+    """(granularity, bucket start) of the rollups moment falls in"""
+    hour = moment.astimezone(pytz.utc).replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    return ((BalanceRollup.HOUR, hour),
+            (BalanceRollup.DAY, day),
+            (BalanceRollup.MONTH, day.replace(day=1)))
+
+
+def _upsert(using, table, columns, conflict, rows, assignments):
+    values = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES {values} '
+            f'ON CONFLICT ({", ".join(conflict)}) DO UPDATE SET {assignments}',
+            [value for row in rows for value in row])
+
+
+def add_balance_entry(entry, using='default'):
+    table = BalanceRollup._meta.db_table  # pylint: disable=W0212
+    _upsert(using, table,
+            ('tenant_id', 'granularity', 'channel_type', 'bucket',
+             'entries', 'credits', 'debits', 'closing_balance'),
+            ('tenant_id', 'granularity', 'channel_type', 'bucket'),
+            [(entry.tenant_id, granularity, entry.channel_type, bucket,
+              1, max(entry.qty, 0), min(entry.qty, 0), entry.balance)
+             for granularity, bucket in buckets(entry.created_on)],
+            f'entries = {table}.entries + EXCLUDED.entries, '
+            f'credits = {table}.credits + EXCLUDED.credits, '
+            f'debits = {table}.debits + EXCLUDED.debits, '
+            f'closing_balance = EXCLUDED.closing_balance')
+
+
+def add_delivery_events(broadcast, moment=None, sends=0, delivered=0, bounced=0,
+                        complained=0, using='default'):
+    """Count delivery events of broadcast at moment (now)"""
+    table = BroadcastRollup._meta.db_table  # pylint: disable=W0212
+    _upsert(using, table,
+            ('tenant_id', 'broadcast_id', 'granularity', 'bucket',
+             'sends', 'delivered', 'bounced', 'complained'),
+            ('broadcast_id', 'granularity', 'bucket'),
+            [(broadcast.tenant_id, broadcast.pk, granularity, bucket,
+              sends, delivered, bounced, complained)
+             for granularity, bucket in buckets(moment or timezone.now())],
+            ', '.join(f'{name} = {table}.{name} + EXCLUDED.{name}'
+                      for name in ('sends', 'delivered', 'bounced', 'complained')))
+
+
+def rebuild_balance_rollups(tenant_id, using='default'):
+    """Recompute the rollups of a tenant from its balance entries. The
+       months before its oldest entry and the archived ones are kept.
+       Inserts of entries wait meanwhile"""
+    rollups = BalanceRollup._meta.db_table  # pylint: disable=W0212
+    entries = BalanceEntry._meta.db_table  # pylint: disable=W0212
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {entries} IN SHARE MODE')
+        oldest = (BalanceEntry.objects.using(using)
+                  .filter(tenant_id=tenant_id)
+                  .aggregate(oldest=Min('created_on'))['oldest'])
+        if oldest is None:
+            return 0
+        start = month_start(oldest)
+        # the newest entry of a channel outlives the purge of its month
+        archived = (Archive.objects.using(using)
+                    .filter(tenant_id=tenant_id, table=RetentionPolicy.TABLE_BALANCE_ENTRIES)
+                    .aggregate(end=Max('period_end'))['end'])
+        if archived is not None and archived > start:
+            start = archived
+        BalanceRollup.objects.using(using).filter(tenant_id=tenant_id,
+                                                  bucket__gte=start).delete()
+        rebuilt = 0
+        with connections[using].cursor() as cursor:
+            for granularity, _ in BalanceRollup.GRANULARITIES:
+                cursor.execute(
+                    f"INSERT INTO {rollups} (tenant_id, granularity, channel_type, bucket, "
+                    f"entries, credits, debits, closing_balance) "
+                    f"SELECT tenant_id, %s, channel_type, "
+                    f"date_trunc(%s, created_on AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', "
+                    f"count(*), sum(greatest(qty, 0)), sum(least(qty, 0)), "
+                    f"(array_agg(balance ORDER BY created_on DESC, id DESC))[1] "
+                    f"FROM {entries} WHERE tenant_id = %s AND created_on >= %s "
+                    f"GROUP BY tenant_id, channel_type, 4",
+                    [granularity, granularity, tenant_id, start])
+                rebuilt += cursor.rowcount
+    return rebuilt
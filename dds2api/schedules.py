@@ -0,0 +1,146 @@
+"""
+Scheduled and recurring broadcasts
+
+A broadcast that is not a draft and has scheduled_at runs at scheduled_at
+and then, with a recurrence, every hour, day, week or month after it in
+the wall clock of schedule_timezone (monthly runs on the 29th to 31st run
+on the last day of shorter months). Broadcast.save() keeps next_run_at up
+to date.
+
+The dispatch_broadcasts command keeps the runs of the next
+DDS2API_SCHEDULE_HORIZON_SECONDS in a TimingWheel, loaded from the
+next_run_at index and reloaded as the horizon moves or when a save
+NOTIFYs a changed schedule. A run writes a broadcast.run OutboxEvent for
+the send workers and moves next_run_at to the first run after now, so a
+dispatcher that was down fires an overdue broadcast once. Everything is
+in next_run_at, restarting loses nothing.
+"""
+
+import calendar
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Broadcast, OutboxEvent
+from .pgnotify import notify
+from .timewheel import TimingWheel
+
+
+def _add_months(moment, months):
+    month = moment.month - 1 + months
+    year, month = moment.year + month // 12, month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def _occurrence(start, recurrence, number):
+    """number-th run after start, a naive local datetime"""
+    if recurrence == Broadcast.RECUR_DAILY:
+        return start + timedelta(days=number)
+    if recurrence == Broadcast.RECUR_WEEKLY:
+        return start + timedelta(weeks=number)
+    return _add_months(start, number)
+
+
+def next_run(scheduled_at, recurrence, timezone_name, after=None):
+    """First run later than after (aware datetimes), None when there is
+       none left"""
+    if scheduled_at is None:
+        return None
+    if after is None or scheduled_at > after:
+        return scheduled_at
+    if not recurrence:
+        return None
+    if recurrence == Broadcast.RECUR_HOURLY:
+        hours = (after - scheduled_at) // timedelta(hours=1) + 1
+        return scheduled_at + timedelta(hours=hours)
+    zone = pytz.timezone(timezone_name)
+    start = scheduled_at.astimezone(zone).replace(tzinfo=None)
+    local_after = after.astimezone(zone).replace(tzinfo=None)
+    if recurrence == Broadcast.RECUR_MONTHLY:
+        number = (local_after.year - start.year) * 12 + local_after.month - start.month
+    else:
+        days = 7 if recurrence == Broadcast.RECUR_WEEKLY else 1
+        number = (local_after - start).days // days
+    # the estimate is at most one run short, DST may add another
+    number = max(number - 1, 1)
+    while True:
+        # wall clock times skipped by DST run an hour later
+        moment = zone.normalize(zone.localize(_occurrence(start, recurrence, number),
+                                              is_dst=False))
+        if moment > after:
+            return moment
+        number += 1
+
+
+def fire(broadcast_id, expected, now=None):
+    """Run a broadcast due at expected, unless its schedule changed or
+       another dispatcher ran it. True when it ran"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        broadcast = (Broadcast.objects
+                     .select_for_update()
+                     .filter(pk=broadcast_id, next_run_at=expected)
+                     .first())
+        if broadcast is None:
+            return False
+        OutboxEvent.objects.create(
+            topic='broadcast.run',
+            tenant_id=broadcast.tenant_id,
+            object_id=str(broadcast.pk),
+            payload={'fields': {'run_at': expected, 'fired_on': now,
+                                'recurrence': broadcast.recurrence,
+                                'dataset_version': broadcast.dataset_version_id},
+                     'changed': {}})
+        notify(OutboxEvent.CHANNEL)
+        # update(), save() would compute next_run_at from the last run
+        Broadcast.objects.filter(pk=broadcast.pk).update(
+            last_run_at=now,
+            next_run_at=next_run(broadcast.scheduled_at, broadcast.recurrence,
+                                 broadcast.schedule_timezone, max(now, expected)))
+    return True
+
+
+class Dispatcher:
+    """Fires the broadcasts of the next horizon seconds from a TimingWheel"""
+
+    def __init__(self, horizon=None, tick=None, clock=time.time):
+        self.horizon = horizon or settings.DDS2API_SCHEDULE_HORIZON_SECONDS
+        self.clock = clock
+        self.wheel = TimingWheel(clock(), tick or settings.DDS2API_SCHEDULE_TICK_SECONDS)
+        self.loaded_until = None
+
+    def load(self, broadcast_ids=None):
+        """(Re)load the runs within the horizon, of broadcast_ids or all"""
+        until = self.clock() + self.horizon
+        runs = Broadcast.objects.filter(
+            next_run_at__lte=datetime.fromtimestamp(until, pytz.utc))
+        if broadcast_ids is not None:
+            runs = Broadcast.objects.filter(pk__in=broadcast_ids)
+            for broadcast_id in broadcast_ids:
+                self.wheel.remove(broadcast_id)
+        else:
+            self.loaded_until = until
+        for broadcast_id, next_run_at in runs.values_list('pk', 'next_run_at').iterator():
+            if next_run_at is not None and next_run_at.timestamp() <= until:
+                self.wheel.add(broadcast_id, next_run_at.timestamp(), next_run_at)
+
+    def run_due(self):
+        """Fire the due broadcasts, returns how many ran"""
+        if self.loaded_until is None or self.clock() + self.horizon / 2 > self.loaded_until:
+            self.load()
+        fired = 0
+        for broadcast_id, expected in self.wheel.advance(self.clock()):
+            if fire(broadcast_id, expected):
+                fired += 1
+                # the next run of an hourly broadcast is within the horizon
+                self.load([broadcast_id])
+        return fired
+
+    def seconds_to_next_tick(self):
+        tick = self.wheel.tick
+        return tick - self.clock() % tick
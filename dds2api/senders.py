@@ -0,0 +1,105 @@
+"""
+Sender e-mail verification
+
+issue_token() mails nothing itself, it returns the token to send and
+keeps only its sha256, unique and indexed, so that confirm_token() is a
+single index lookup and a database leak does not leak usable tokens.
+
+sender_verified() is what the send pipeline asks for every message: it
+answers from a short lived per process memo, then from the shared cache,
+which the post_save receiver keeps up to date, and only then from the
+database.
+"""
+
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Sender
+
+ISSUE_KEY = 'dds2api:sender-token-issued:{}'
+STATE_KEY = 'dds2api:sender-verified:{}'
+# seconds a process trusts its own copy of a sender state
+LOCAL_STATE_SECONDS = 10
+
+_local_state = {}  # pylint: disable=C0103
+
+
+class TokenRateLimited(Exception):
+
+    def __init__(self, wait):
+        super().__init__(f'retry in {wait} seconds')
+        self.wait = wait
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_token(sender):
+    """New verification token of sender, replaces the pending one. At most
+       DDS2API_SENDER_TOKENS_PER_HOUR per sender"""
+    key = ISSUE_KEY.format(sender.pk)
+    # add() starts the window, incr() counts inside it
+    if not cache.add(key, 1, 3600):
+        issued = cache.incr(key)
+        if issued > settings.DDS2API_SENDER_TOKENS_PER_HOUR:
+            raise TokenRateLimited(3600)
+    token = secrets.token_urlsafe(32)
+    sender.verification_token = hash_token(token)
+    sender.verification_expires_on = timezone.now() + timedelta(
+        seconds=settings.DDS2API_SENDER_TOKEN_SECONDS)
+    sender.save(update_fields=['verification_token', 'verification_expires_on'])
+    return token
+
+
+def confirm_token(token):
+    """Mark the sender of a pending, unexpired token as verified and return
+       it, None for unknown or expired tokens"""
+    sender = Sender.objects.filter(verification_token=hash_token(token)).first()
+    if sender is None:
+        return None
+    valid = sender.verification_expires_on > timezone.now()
+    sender.email_verified = sender.email_verified or valid
+    sender.verification_token = None
+    sender.verification_expires_on = None
+    sender.save(update_fields=['email_verified', 'verification_token',
+                               'verification_expires_on'])
+    return sender if valid else None
+
+
+def expire_token(sender):
+    """Invalidate the pending token of sender"""
+    sender.verification_token = None
+    sender.verification_expires_on = None
+    sender.save(update_fields=['verification_token', 'verification_expires_on'])
+
+
+def cache_sender_state(sender):
+    cache.set(STATE_KEY.format(sender.pk), sender.email_verified, None)
+    _local_state.pop(sender.pk, None)
+
+
+def forget_sender_state(sender_id):
+    cache.delete(STATE_KEY.format(sender_id))
+    _local_state.pop(sender_id, None)
+
+
+def sender_verified(sender_id):
+    """Whether the e-mail of sender_id is verified, without a query in the
+       common case"""
+    now = time.monotonic()
+    local = _local_state.get(sender_id)
+    if local is not None and local[0] > now:
+        return local[1]
+    verified = cache.get(STATE_KEY.format(sender_id))
+    if verified is None:
+        verified = Sender.objects.filter(pk=sender_id, email_verified=True).exists()
+        cache.set(STATE_KEY.format(sender_id), verified, None)
+    _local_state[sender_id] = (now + LOCAL_STATE_SECONDS, verified)
+    return verified
@@ -1,5 +1,15 @@
+import pytz
+from django.conf import settings
+from django.template import TemplateSyntaxError
 from django.utils.text import slugify
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import add_tenant_claims
+from .datasets import PARSING_FIELDS
+from .instrumentation import TimedSerializerMixin
+from .permissions import user_tenants
+from .jobs import enqueue_on_commit
+from .messages import compile_template
 from .models import (
     Profile,
     Tenant,
@@ -12,34 +22,58 @@ from .models import (
     Attachment,
     Broadcast,
     DataSet,
+    DataSetDelta,
+    DataSetStats,
+    DataSetVersion,
+    Suppression,
+    Archive,
+    BalanceSummary,
+    BalanceRollup,
+    BroadcastRollup,
 )
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    ModelSerializer whose serialization time is in the request metrics
+    """
+
+
+class TenantTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Token pair whose claims include the user's tenants and roles
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return add_tenant_claims(super().get_token(user), user)
+
+
+class ProfileSerializer(ModelSerializer):
     class Meta:
         model = Profile
         fields = '__all__'
 
 
-class TenantSerializer(serializers.ModelSerializer):
+class TenantSerializer(ModelSerializer):
     class Meta:
         model = Tenant
         fields = ('id', 'tenant', 'description')
 
 
-class RoleSerializer(serializers.ModelSerializer):
+class RoleSerializer(ModelSerializer):
     class Meta:
         model = Role
         fields = '__all__'
 
 
-class BalanceEntrySerializer(serializers.ModelSerializer):
+class BalanceEntrySerializer(ModelSerializer):
     class Meta:
         model = BalanceEntry
         fields = '__all__'
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ModelSerializer):
     # pylint: disable=W0221
     def validate(self, data):
         """
@@ -56,39 +90,301 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'tenant', 'tag', 'slug')
 
 
-class StorageCredentialSerializer(serializers.ModelSerializer):
+class StorageCredentialSerializer(ModelSerializer):
+    """The secrets are write only, giving new ones rotates them"""
+    access_key_id = serializers.CharField(max_length=128, write_only=True, required=False)
+    secret_access_key = serializers.CharField(max_length=128, write_only=True, required=False)
+
     class Meta:
         model = StorageCredential
-        fields = '__all__'
+        exclude = ('secrets_envelope',)
+
+    def validate(self, attrs):
+        given = [name for name in ('access_key_id', 'secret_access_key') if name in attrs]
+        if len(given) == 1 or (self.instance is None and not given):
+            raise serializers.ValidationError(
+                'access_key_id and secret_access_key are required together')
+        return attrs
 
+    @staticmethod
+    def _pop_secrets(validated_data):
+        return (validated_data.pop('access_key_id', None),
+                validated_data.pop('secret_access_key', None))
 
-class DomainSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        secrets = self._pop_secrets(validated_data)
+        instance = StorageCredential(**validated_data)
+        instance.set_secrets(*secrets)
+        instance.save()
+        return instance
+
+    def update(self, instance, validated_data):
+        secrets = self._pop_secrets(validated_data)
+        if secrets[0] is not None:
+            instance.set_secrets(*secrets)
+        return super().update(instance, validated_data)
+
+
+class DomainSerializer(ModelSerializer):
     class Meta:
         model = Domain
         fields = '__all__'
 
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        enqueue_on_commit('domain.verify_due')
+        return instance
+
+    def update(self, instance, validated_data):
+        if validated_data.get('name', instance.name) != instance.name:
+            # due at once, for the next verify_domains pass
+            instance.verified = False
+            instance.next_check_on = None
+            enqueue_on_commit('domain.verify_due')
+        return super().update(instance, validated_data)
 
-class SenderSerializer(serializers.ModelSerializer):
+
+class SenderSerializer(ModelSerializer):
     class Meta:
         model = Sender
-        fields = '__all__'
+        exclude = ('verification_token',)
+
+    def update(self, instance, validated_data):
+        if validated_data.get('email', instance.email) != instance.email:
+            instance.email_verified = False
+            instance.verification_token = None
+            instance.verification_expires_on = None
+        return super().update(instance, validated_data)
+
 
+class SenderConfirmSerializer(serializers.Serializer):  # pylint: disable=W0223
+    token = serializers.CharField(max_length=64)
 
-class AttachmentSerializer(serializers.ModelSerializer):
+
+class AttachmentSerializer(ModelSerializer):
     original_filename = serializers.ReadOnlyField()
 
     class Meta:
         model = Attachment
         fields = '__all__'
 
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        origin = attrs.get('origin', getattr(self.instance, 'origin', ''))
+        if origin == Attachment.ORIGIN_FROM_S3_OBJECT_KEY:
+            credentials = attrs.get('credentials', getattr(self.instance, 'credentials', None))
+            tenant = attrs.get('tenant', getattr(self.instance, 'tenant', None))
+            if credentials is None:
+                raise serializers.ValidationError(
+                    {'credentials': 'An S3 attachment needs storage credentials.'})
+            if credentials.tenant_id != getattr(tenant, 'pk', None):
+                raise serializers.ValidationError({'credentials': 'Not found.'})
+        if origin != Attachment.ORIGIN_GENERATED:
+            return attrs
+        source = attrs.get('document_template', getattr(self.instance, 'document_template', ''))
+        if not source:
+            raise serializers.ValidationError(
+                {'document_template': 'A generated attachment needs a template.'})
+        try:
+            compile_template(source)
+        except TemplateSyntaxError as exc:
+            raise serializers.ValidationError({'document_template': str(exc)})
+        return attrs
+
+
+class BroadcastSerializer(ModelSerializer):
+    # sent as a domain or sender of the broadcast tenant only
+    tenant_fields = ('domain', 'sender')
 
-class BroadcastSerializer(serializers.ModelSerializer):
     class Meta:
         model = Broadcast
         fields = '__all__'
 
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None:
+            tenants = user_tenants(request)
+            for name in self.tenant_fields:
+                fields[name].queryset = fields[name].queryset.filter(tenant__in=tenants)
+        return fields
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        status = attrs.get('status', getattr(self.instance, 'status', None))
+        domain = attrs.get('domain', getattr(self.instance, 'domain', None))
+        sender = attrs.get('sender', getattr(self.instance, 'sender', None))
+        timezone_name = attrs.get('schedule_timezone')
+        if timezone_name is not None and timezone_name not in pytz.all_timezones_set:
+            raise serializers.ValidationError(
+                {'schedule_timezone': f'{timezone_name} is not a time zone.'})
+        if (
+                attrs.get('recurrence', getattr(self.instance, 'recurrence', '')) and
+                not attrs.get('scheduled_at', getattr(self.instance, 'scheduled_at', None))
+        ):
+            raise serializers.ValidationError(
+                {'scheduled_at': 'A recurrence needs the time of the first run.'})
+        dataset_version = attrs.get('dataset_version')
+        tenant = attrs.get('tenant', getattr(self.instance, 'tenant', None))
+        if (dataset_version is not None and
+                dataset_version.dataset.tenant_id != getattr(tenant, 'pk', None)):
+            raise serializers.ValidationError(
+                {'dataset_version': 'Not found.'})
+        for name, obj in (('domain', domain), ('sender', sender)):
+            if obj is not None and obj.tenant_id != getattr(tenant, 'pk', None):
+                raise serializers.ValidationError({name: 'Not found.'})
+        if status == Broadcast.STATUS_DRAFT:
+            return attrs
+        if domain is not None and not domain.is_sendable():
+            raise serializers.ValidationError(
+                {'domain': f'{domain.name} is not verified.'})
+        if sender is not None and not sender.email_verified:
+            raise serializers.ValidationError(
+                {'sender': f'{sender.email} is not verified.'})
+        return attrs
+
+
+class DataSetSerializer(ModelSerializer):
+    # changing any of these makes the DataSet statistics stale and the file
+    # is ingested again
+    parsing_fields = PARSING_FIELDS
 
-class DataSetSerializer(serializers.ModelSerializer):
     class Meta:
         model = DataSet
         fields = '__all__'
+
+    def changed_parsing_fields(self, attrs):
+        """Parsing fields attrs changes, a new file always does"""
+        if self.instance is None:
+            return []
+        return [name for name in self.parsing_fields
+                if name in attrs and (name == 'uploaded_file' or
+                                      attrs[name] != getattr(self.instance, name))]
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        key_field = attrs.get('key_field', getattr(self.instance, 'key_field', ''))
+        file_fields = attrs.get('file_fields', getattr(self.instance, 'file_fields', []))
+        if key_field and key_field not in file_fields:
+            raise serializers.ValidationError(
+                {'key_field': f'{key_field} is not one of the file fields.'})
+        changed = self.changed_parsing_fields(attrs)
+        # ingesting the same file again would drop the rows of the deltas
+        if (changed and 'uploaded_file' not in changed and
+                self.instance.deltas.exclude(status=DataSetDelta.REJECTED).exists()):
+            raise serializers.ValidationError(
+                {name: 'The DataSet has deltas, upload a new file to change it.'
+                 for name in changed})
+        return attrs
+
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        if instance.uploaded_file:
+            enqueue_on_commit('dataset.ingest', {'dataset': instance.pk},
+                              tenant=instance.tenant)
+        return instance
+
+    def update(self, instance, validated_data):
+        if self.changed_parsing_fields(validated_data):
+            DataSetStats.objects.filter(dataset=instance).delete()
+            enqueue_on_commit('dataset.ingest', {'dataset': instance.pk},
+                              tenant=instance.tenant)
+        return super().update(instance, validated_data)
+
+
+class DataSetVersionSerializer(ModelSerializer):
+    class Meta:
+        model = DataSetVersion
+        exclude = ('segments',)
+
+
+class DataSetDeltaSerializer(ModelSerializer):
+    class Meta:
+        model = DataSetDelta
+        fields = '__all__'
+        read_only_fields = ('tenant', 'dataset')
+
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        enqueue_on_commit('dataset.apply_delta', {'delta': instance.pk},
+                          tenant=instance.tenant)
+        return instance
+
+
+class SuppressionSerializer(ModelSerializer):
+    class Meta:
+        model = Suppression
+        fields = '__all__'
+
+    def validate_address(self, value):  # pylint: disable=R0201
+        # before the unique together check
+        return value.strip().lower()
+
+
+class ArchiveSerializer(ModelSerializer):
+    class Meta:
+        model = Archive
+        exclude = ('file',)
+
+
+class BalanceSummarySerializer(ModelSerializer):
+    class Meta:
+        model = BalanceSummary
+        fields = '__all__'
+
+
+class BalanceRollupSerializer(ModelSerializer):
+    class Meta:
+        model = BalanceRollup
+        exclude = ('id',)
+
+
+class BroadcastRollupSerializer(ModelSerializer):
+    delivery_rate = serializers.SerializerMethodField()
+    bounce_rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BroadcastRollup
+        exclude = ('id',)
+
+    def get_delivery_rate(self, obj):  # pylint: disable=R0201
+        return obj.delivered / obj.sends if obj.sends else None
+
+    def get_bounce_rate(self, obj):  # pylint: disable=R0201
+        return obj.bounced / obj.sends if obj.sends else None
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):  # pylint: disable=W0223
+    granularity = serializers.ChoiceField(choices=BalanceRollup.GRANULARITIES,
+                                          default=BalanceRollup.DAY)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    tenant = serializers.IntegerField(required=False)
+    channel_type = serializers.ChoiceField(choices=BalanceEntry.CHANNEL_TYPES, required=False)
+    broadcast = serializers.IntegerField(required=False)
+
+
+class BroadcastPlanSerializer(serializers.Serializer):  # pylint: disable=W0223
+    dataset = serializers.IntegerField()
+    recipient_field = serializers.CharField(max_length=64, required=False)
+
+
+class TestSendSerializer(serializers.Serializer):  # pylint: disable=W0223
+    to = serializers.EmailField()
+    row = serializers.DictField(required=False, default=dict)
+
+
+class BroadcastPreviewSerializer(serializers.Serializer):  # pylint: disable=W0223
+    dataset = serializers.IntegerField()
+    rows = serializers.IntegerField(min_value=1,
+                                    max_value=settings.DDS2API_PREVIEW_MAX_ROWS,
+                                    default=3)
+    # row numbers, instead of random rows
+    row = serializers.ListField(
+        child=serializers.IntegerField(min_value=0,
+                                       max_value=settings.DDS2API_PREVIEW_SCAN_ROWS - 1),
+        max_length=settings.DDS2API_PREVIEW_MAX_ROWS,
+        required=False)
+    # unsaved template, POST only
+    email_subject = serializers.CharField(required=False, allow_blank=True)
+    email_body = serializers.CharField(required=False, allow_blank=True)
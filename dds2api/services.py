@@ -0,0 +1,96 @@
+"""
+I/O bound services
+
+They are coroutines so that the ASGI endpoints wait on the network without
+holding a thread; the sync viewsets call them through async_to_sync.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from .aio import HTTPError, database_sync_to_async, fetch
+from .attachments import attachment_filename, attachment_request
+from .documents import RenderError, render_attachment
+from .messages import email_message, render_email
+from .models import Attachment
+
+
+class GeneratedContent:
+    """A rendered document, read like an HTTPResponse"""
+
+    def __init__(self, content_type, chunks):
+        self.headers = {'content-type': content_type}
+        self._chunks = chunks
+
+    async def iter_chunks(self):
+        for chunk in self._chunks:
+            yield chunk
+
+    async def read(self, limit=None):
+        content = b''.join(self._chunks)
+        if limit is not None and len(content) > limit:
+            raise HTTPError(f'document is over {limit} bytes')
+        return content
+
+    def close(self):
+        pass
+
+
+async def open_attachment(attachment, row, supplied_row=False):
+    """(HTTPResponse, filename) of the attachment content for row, the
+       body is streamed with response.iter_chunks(). See attachment_request
+       for supplied_row"""
+    if attachment.origin == Attachment.ORIGIN_GENERATED:
+        # waits on a renderer of the pool, in a thread of its own
+        try:
+            content_type, chunks = await sync_to_async(
+                render_attachment, thread_sensitive=False)(attachment, row)
+        except RenderError as exc:
+            raise HTTPError(f'{attachment} could not be rendered: {exc}')
+        return (GeneratedContent(content_type, chunks),
+                attachment_filename(attachment, row, None, {}))
+    # may load the credentials and set up boto3, keep it off the loop
+    method, url, body = await database_sync_to_async(attachment_request)(
+        attachment, row, supplied_row)
+    headers = {'Content-Type': 'application/json'} if body is not None else None
+    response = await fetch(url, method=method, headers=headers, body=body)
+    if response.status != 200:
+        response.close()
+        raise HTTPError(f'{attachment} answered {response.status}')
+    return response, attachment_filename(attachment, row, url, response.headers)
+
+
+async def fetch_attachment(attachment, row, supplied_row=False):
+    """(filename, content, mimetype) of the attachment for row, up to
+       DDS2API_ATTACHMENT_MAX_BYTES"""
+    response, filename = await open_attachment(attachment, row, supplied_row)
+    content = await response.read(settings.DDS2API_ATTACHMENT_MAX_BYTES)
+    return filename, content, response.headers.get('content-type', 'application/octet-stream')
+
+
+async def send_test_email(broadcast, to, row):
+    """Render broadcast for row, given by the caller, and send it to the
+       address to, the attachments are fetched concurrently"""
+    attachments = await database_sync_to_async(list)(
+        broadcast.email_attachments.select_related('credentials'))
+    files = await asyncio.gather(*(fetch_attachment(attachment, row, supplied_row=True)
+                                   for attachment in attachments))
+    subject, body = render_email(broadcast, row)
+    message = email_message(subject, body, settings.DEFAULT_FROM_EMAIL, to, files)
+    await sync_to_async(message.send)()
+
+
+async def send_sender_verification(sender, token):
+    """Mail a verification token (dds2api.senders.issue_token) to the
+       address of sender"""
+    confirm_url = settings.DDS2API_SENDER_CONFIRM_URL
+    if confirm_url:
+        body = f'Confirm your sender address: {confirm_url.format(token=token)}'
+    else:
+        body = f'Your verification code is {token}'
+    message = EmailMessage('Verify your sender address', body,
+                           settings.DEFAULT_FROM_EMAIL, [sender.email])
+    await sync_to_async(message.send)()
@@ -0,0 +1,84 @@
+"""dds2api signal receivers"""
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import revoke_tenant_claims
+from .credentials import invalidate
+from .models import BalanceEntry, Broadcast, Profile, Role, Sender, StorageCredential, Tag
+from .rollups import add_balance_entry
+from .senders import cache_sender_state, forget_sender_state
+from .tags import bump_version
+
+
+@receiver(m2m_changed, sender=Profile.tenant.through)
+@receiver(m2m_changed, sender=Profile.roles.through)
+def profile_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Revoke the token tenant claims of every affected user"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        revoke_tenant_claims(instance.user_id)
+        return
+    # changed from the Tenant / Role side, instance is not a profile
+    if pk_set is None:
+        field = 'tenant' if sender is Profile.tenant.through else 'roles'
+        profiles = Profile.objects.filter(**{field: instance})
+    else:
+        profiles = Profile.objects.filter(pk__in=pk_set)
+    for user_id in profiles.values_list('user_id', flat=True):
+        revoke_tenant_claims(user_id)
+
+
+@receiver(pre_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    """Deleting a role removes it from profiles without m2m_changed"""
+    for user_id in Profile.objects.filter(roles=instance).values_list('user_id', flat=True):
+        revoke_tenant_claims(user_id)
+
+
+@receiver(post_save, sender=Sender)
+def sender_saved(sender, instance, **kwargs):
+    cache_sender_state(instance)
+
+
+@receiver(post_delete, sender=Sender)
+def sender_deleted(sender, instance, **kwargs):
+    forget_sender_state(instance.pk)
+
+
+@receiver(post_save, sender=StorageCredential)
+@receiver(post_delete, sender=StorageCredential)
+def storage_credential_changed(sender, instance, **kwargs):
+    """Drop the cached secrets, other processes miss on the new
+       secrets_version"""
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=BalanceEntry)
+def balance_entry_saved(sender, instance, created, raw=False, using='default', **kwargs):
+    """Count a new entry in the rollups, in the transaction of the insert"""
+    if created and not raw:
+        add_balance_entry(instance, using)
+
+
+@receiver(m2m_changed, sender=Broadcast.tags.through)
+def broadcast_tags_changed(sender, instance, action, **kwargs):
+    """instance is the broadcast, or the tag when changed from its side,
+       both belong to the tenant whose index changes"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_version(instance.tenant_id))
+
+
+@receiver(post_save, sender=Broadcast)
+def broadcast_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: bump_version(instance.tenant_id))
+
+
+@receiver(post_delete, sender=Broadcast)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_index_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version(instance.tenant_id))
@@ -0,0 +1,227 @@
+"""
+Tag expressions
+
+Expressions combine tag names (or slugs) with AND, OR, NOT and
+parentheses, e.g. ``vip AND NOT churned``. They are evaluated in memory
+against inverted indexes of Bitmaps:
+
+- broadcasts: per tenant, tag slug -> Broadcast ids, built from the
+  Broadcast.tags table and rebuilt when the tenant's version in the
+  default cache is bumped by the signal receivers. That cache must be
+  shared by the processes, a LocMem one only reaches the process that made
+  the change and the others wait for DDS2API_TAG_INDEX_SECONDS.
+- recipients: per DataSet file, tag -> row numbers, built from a column
+  holding the tags of each row separated by DDS2API_RECIPIENT_TAG_SEPARATOR.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.text import slugify
+
+from .bitmaps import Bitmap
+from .datasets import open_rows, snapshot_key
+from .models import Broadcast
+
+VERSION_KEY = 'dds2api:tag-index:{}'
+TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+OPERATORS = ('and', 'or', 'not')
+
+
+class TagExpressionError(ValueError):
+    pass
+
+
+def parse(expression):
+    """Syntax tree of an expression: ('tag', slug), ('not', node),
+       ('and', left, right) or ('or', left, right). NOT binds tighter than
+       AND, which binds tighter than OR"""
+    tokens = TOKEN_RE.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].lower() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == 'or':
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() == 'and':
+            take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == 'not':
+            take()
+            return ('not', parse_not())
+        if peek() == '(':
+            take()
+            node = parse_or()
+            if peek() != ')':
+                raise TagExpressionError('missing )')
+            take()
+            return node
+        if peek() in (None, ')') or peek() in OPERATORS:
+            raise TagExpressionError(f'tag expected at "{peek() or "end"}"')
+        return ('tag', slugify(take()))
+
+    tree = parse_or()
+    if position != len(tokens):
+        raise TagExpressionError(f'unexpected "{tokens[position]}"')
+    return tree
+
+
+class TagIndex:
+    """tag -> Bitmap of ids, all is the set NOT is taken against"""
+
+    def __init__(self):
+        self.tags = {}
+        self.all = Bitmap()
+
+    def add(self, id_, tags=()):
+        self.all.add(id_)
+        for tag in tags:
+            bitmap = self.tags.get(tag)
+            if bitmap is None:
+                bitmap = self.tags[tag] = Bitmap()
+            bitmap.add(id_)
+
+    def evaluate(self, tree):
+        operator = tree[0]
+        if operator == 'tag':
+            return self.tags.get(tree[1]) or Bitmap()
+        if operator == 'not':
+            return self.all - self.evaluate(tree[1])
+        left, right = self.evaluate(tree[1]), self.evaluate(tree[2])
+        return left & right if operator == 'and' else left | right
+
+
+class IndexCache:
+    """LRU of the indexes built by this process, an index is rebuilt when
+       its version changes or, with a max_age, when it gets older"""
+
+    def __init__(self, max_entries, max_age=None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                    entry is not None and entry[0] == version and
+                    (entry[1] is None or entry[1] > now)
+            ):
+                self._entries.move_to_end(key)
+                return entry[2]
+        index = build()
+        with self._lock:
+            expires = None if self.max_age is None else now + self.max_age
+            self._entries[key] = (version, expires, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# the age limit covers versions lost with the shared cache
+broadcast_indexes = IndexCache(settings.DDS2API_TAG_INDEX_TENANTS,  # pylint: disable=C0103
+                               settings.DDS2API_TAG_INDEX_SECONDS)
+# the version of a file is exact, no age limit
+recipient_indexes = IndexCache(settings.DDS2API_TAG_INDEX_DATASETS)  # pylint: disable=C0103
+
+
+def bump_version(tenant_id):
+    """Make the processes rebuild the broadcast index of tenant_id, call
+       it once the change is committed"""
+    key = VERSION_KEY.format(tenant_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted since add()
+            cache.set(key, 1, None)
+
+
+def _build_broadcast_index(tenant_id):
+    index = TagIndex()
+    for broadcast_id in Broadcast.objects.filter(tenant_id=tenant_id).values_list('pk', flat=True):
+        index.add(broadcast_id)
+    tagged = (Broadcast.tags.through.objects
+              .filter(broadcast__tenant_id=tenant_id)
+              .values_list('tag__slug', 'broadcast_id'))
+    for slug, broadcast_id in tagged:
+        index.add(broadcast_id, [slug])
+    return index
+
+
+def select_broadcasts(tenant_ids, expression):
+    """Bitmap of the ids of the broadcasts of tenant_ids matching
+       expression"""
+    tree = parse(expression)
+    tenant_ids = list(tenant_ids)
+    versions = cache.get_many([VERSION_KEY.format(tenant_id) for tenant_id in tenant_ids])
+    selected = Bitmap()
+    for tenant_id in tenant_ids:
+        index = broadcast_indexes.get(
+            tenant_id, versions.get(VERSION_KEY.format(tenant_id), 0),
+            lambda tenant_id=tenant_id: _build_broadcast_index(tenant_id))
+        selected = selected | index.evaluate(tree)
+    return selected
+
+
+def row_tags(row, tag_field):
+    return [slugify(tag) for tag in
+            row.get(tag_field, '').split(settings.DDS2API_RECIPIENT_TAG_SEPARATOR)
+            if tag.strip()]
+
+
+def _build_recipient_index(dataset, tag_field):
+    index = TagIndex()
+    for number, row in enumerate(open_rows(dataset)):
+        index.add(number, row_tags(row, tag_field))
+    return index
+
+
+def select_rows(dataset, expression, tag_field='tags'):
+    """Bitmap of the numbers of the DataSet rows matching expression, the
+       index of a file is built once per process"""
+    tree = parse(expression)
+    index = recipient_indexes.get(
+        (dataset.pk, tag_field), snapshot_key(dataset),
+        lambda: _build_recipient_index(dataset, tag_field))
+    return index.evaluate(tree)
+
+
+def tagged_rows(dataset, expression, tag_field='tags'):
+    """(number, row) of the DataSet rows matching expression, for sends"""
+    selected = select_rows(dataset, expression, tag_field)
+    if not selected:
+        return
+    last = max(selected)
+    for number, row in enumerate(open_rows(dataset)):
+        if number > last:
+            return
+        if number in selected:
+            yield number, row
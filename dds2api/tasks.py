@@ -0,0 +1,44 @@
+"""Background tasks, run by the run_jobs workers (dds2api.jobs)"""
+
+from .datasets import apply_delta, compact, compute_stats, ingest, needs_compaction
+from .domains import verify_due_domains
+from .jobs import enqueue, task
+from .models import DataSet, DataSetStats
+
+
+@task('dataset.compute_stats', lane='bulk', timeout=3600)
+def compute_dataset_stats(dataset):
+    """Statistics of an uploaded or re-parsed DataSet, for the dry run and
+       the previews"""
+    dataset = DataSet.objects.filter(pk=dataset).exclude(uploaded_file='').first()
+    if dataset is None:
+        return
+    stats = compute_stats(dataset)
+    DataSetStats.objects.filter(dataset=dataset).delete()
+    stats.save()
+
+
+@task('dataset.ingest', lane='bulk', timeout=3600)
+def ingest_dataset(dataset):
+    """New version of an uploaded or re-parsed DataSet, with its statistics"""
+    ingest(dataset)
+
+
+@task('dataset.apply_delta', timeout=3600)
+def apply_dataset_delta(delta):
+    version = apply_delta(delta)
+    if version is not None and needs_compaction(version):
+        enqueue('dataset.compact', {'dataset': version.dataset_id},
+                tenant=version.dataset.tenant)
+
+
+@task('dataset.compact', lane='bulk', timeout=3600)
+def compact_dataset(dataset):
+    """Rewrite a DataSet without its upserted segments"""
+    compact(dataset)
+
+
+@task('domain.verify_due', lane='interactive')
+def verify_domains(batch_size=500):
+    """Check the domains that are due, new ones are due at once"""
+    verify_due_domains(batch_size)
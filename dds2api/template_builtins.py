@@ -0,0 +1,21 @@
+"""
+Tags and filters of the templates tenants write
+
+The stock builtins without debug, which prints the whole context and the
+loaded modules of the process.
+"""
+
+from django.template import Engine, Library, defaulttags
+
+EXCLUDED_TAGS = ('debug',)
+
+register = Library()  # pylint: disable=C0103
+register.tags.update((name, tag) for name, tag in defaulttags.register.tags.items()
+                     if name not in EXCLUDED_TAGS)
+register.filters.update(defaulttags.register.filters)
+
+
+class TenantEngine(Engine):
+    """Engine of e-mail and document templates"""
+    default_builtins = [__name__ if builtin == 'django.template.defaulttags' else builtin
+                        for builtin in Engine.default_builtins]
@@ -1,3 +1,1722 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import random
+import struct
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import psycopg2
+import pytz
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, QueryDict
+from django.template import TemplateSyntaxError
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework import serializers, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from dds2be.db_backends.postgresql.base import ConnectionPool, close_pools
+from dds2be.db_routers import ReplicaRouter, allow_replica_reads, replica_reads
+from dds2api.admin import AdminBalanceEntry, EstimatedCountPaginator
+from dds2api import aio, asgi_views, jobs, kms, senders
+from dds2api.benchmarks import api as benchmark_api, compare, load_baseline
+from dds2api.authentication import (
+    PERMS_CLAIM,
+    ROLES_CLAIM,
+    TENANTS_CLAIM,
+    TenantJWTAuthentication,
+    TenantTokenUser,
+    add_tenant_claims,
+    claims_are_fresh,
+)
+from dds2api.checks import check_shared_cache
+from dds2api.attachments import AttachmentSourceError, SuppliedRowError, attachment_request
+from dds2api.credentials import CredentialCache
+from dds2api.datasets import (
+    _delta_rows,
+    _pack_keys,
+    _unpack_keys,
+    live_rows,
+    merge_sample,
+    replaced_rows,
+)
+from dds2api.documents import (
+    Document,
+    DocumentRenderer,
+    RenderError,
+    RendererPool,
+    load_assets,
+    read_frame,
+    serve,
+    write_frame,
+)
+from dds2api.domains import check_domain
+from dds2api.instrumentation import (
+    MetricsRegistry,
+    RequestMetricsMiddleware,
+    RequestStats,
+    TimedJSONRenderer,
+    TimedSerializerMixin,
+    current_stats,
+    metrics_view,
+    registry,
+)
+from dds2api.models import (
+    BalanceEntry,
+    Archive,
+    Attachment,
+    BalanceRollup,
+    Broadcast,
+    DataSet,
+    DataSetDelta,
+    DataSetSegment,
+    Domain,
+    Job,
+    OutboxEvent,
+    Profile,
+    RetentionPolicy,
+    Role,
+    Sender,
+    StorageCredential,
+    Tenant,
+)
+from dds2api.outbox import FileSink, relay_batch
+from dds2api.bitmaps import Bitmap
+from dds2api.messages import render
+from dds2api.planner import attachment_sizes, sms_segments
+from dds2api.serializers import (
+    AttachmentSerializer,
+    BroadcastPreviewSerializer,
+    BroadcastSerializer,
+    DataSetSerializer,
+)
+from dds2api.previews import SampleRowCache
+from dds2api.permissions import UserIsTenantMember, action_tenants, required_permission
+from dds2api.rbac import (
+    PERM_MANAGE,
+    PERM_READ,
+    PERM_TEMPLATES,
+    PermissionSet,
+    compile_permissions,
+)
+from dds2api.urls import router
+from dds2api.views import (
+    REPLICA_PIN_KEY,
+    BroadcastViewSet,
+    DomainViewSet,
+    ReplicaReadMixin,
+    TagViewSet,
+)
+from dds2api.sketches import HyperLogLog, hash64
+from dds2api.tags import TagExpressionError, TagIndex, parse
+from dds2api.throttling import (
+    ACQUIRE_SCRIPT,
+    LocalCounterStore,
+    RedisCounterStore,
+    TenantRateThrottle,
+)
+from dds2api.planner import current_balance
+from dds2api.retention import (
+    due_months,
+    purge_archived,
+    read_archive,
+    row_filters,
+    write_archive,
+)
+from dds2api.rollups import buckets, rebuild_balance_rollups
+from dds2api.schedules import next_run
+from dds2api.timewheel import TimingWheel
+from dds2api.resolver import (
+    Answer,
+    DNSCache,
+    HEADER,
+    RR_HEADER,
+    Resolver,
+    TYPE_MX,
+    TYPE_SOA,
+    TYPE_TXT,
+    CLASS_IN,
+    decode_name,
+    encode_name,
+)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+
+    def test_locmem_without_debug(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        memcached = {'default': {
+            'BACKEND': 'dds2api.instrumentation.InstrumentedMemcachedCache',
+            'LOCATION': '127.0.0.1:11211'}}
+        with override_settings(DEBUG=False, CACHES=locmem):
+            self.assertEqual([error.id for error in check_shared_cache(None)],
+                             ['dds2api.E001'])
+        with override_settings(DEBUG=True, CACHES=locmem):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(DEBUG=False, CACHES=memcached):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class PermissionTests(SimpleTestCase):
+    # permission each viewset needs for its unsafe methods, safe ones need
+    # PERM_READ
+    write_permissions = {
+        'RoleViewSet': PERM_MANAGE,
+        'BalanceEntryViewSet': PERM_MANAGE,
+        'TagViewSet': PERM_TEMPLATES,
+        'StorageCredentialViewSet': PERM_MANAGE,
+        'DomainViewSet': PERM_MANAGE,
+        'SenderViewSet': PERM_MANAGE,
+        'AttachmentViewSet': PERM_TEMPLATES,
+        'BroadcastViewSet': PERM_TEMPLATES,
+        'DataSetViewSet': PERM_MANAGE,
+        'SuppressionViewSet': PERM_MANAGE,
+        'ArchiveViewSet': PERM_MANAGE,
+        'BalanceSummaryViewSet': PERM_MANAGE,
+        'SpendAnalyticsViewSet': PERM_MANAGE,
+        'BroadcastAnalyticsViewSet': PERM_MANAGE,
+    }
+
+    def test_roles_compile_to_bits(self):
+        perms = compile_permissions([1, 2, 3], [(1, Role.ADMIN), (2, Role.TEMPLATE_EDITOR),
+                                                (4, Role.ADMIN)])
+        self.assertEqual(perms.table, {1: PERM_READ | PERM_TEMPLATES | PERM_MANAGE,
+                                       2: PERM_READ | PERM_TEMPLATES,
+                                       3: PERM_READ})
+        self.assertEqual(perms.tenants(), [1, 2, 3])
+        self.assertEqual(perms.tenants(PERM_TEMPLATES), [1, 2])
+        self.assertEqual(perms.tenants(PERM_MANAGE), [1])
+        self.assertFalse(perms.allows(4, PERM_READ))
+        self.assertEqual(PermissionSet.from_claim(perms.to_claim()).table, perms.table)
+
+    def test_every_action_requires_its_permission(self):
+        perms = compile_permissions([1, 2, 3], [(1, Role.ADMIN), (2, Role.TEMPLATE_EDITOR)])
+        admin, editor, member = 1, 2, 3
+        checked = set()
+        for _, viewset, _ in router.registry:
+            if UserIsTenantMember not in viewset.permission_classes:
+                continue
+            for route in router.get_routes(viewset):
+                if UserIsTenantMember not in route.initkwargs.get(
+                        'permission_classes', viewset.permission_classes):
+                    continue
+                for method, action_name in route.mapping.items():
+                    if not hasattr(viewset, action_name):
+                        continue
+                    request = SimpleNamespace(method=method.upper())
+                    view = viewset(action=action_name)
+                    required = required_permission(request, view)
+                    expected = (PERM_READ if method in ('get', 'head', 'options')
+                                else self.write_permissions[viewset.__name__])
+                    self.assertEqual(required, expected, (viewset.__name__, action_name))
+                    self.assertTrue(perms.allows(admin, required))
+                    self.assertEqual(perms.allows(editor, required), expected != PERM_MANAGE)
+                    self.assertEqual(perms.allows(member, required), expected == PERM_READ)
+                    checked.add(viewset.__name__)
+        self.assertEqual(checked, set(self.write_permissions))
+
+    def test_action_tenants(self):
+        perms = compile_permissions([1, 2, 3], [(1, Role.ADMIN), (2, Role.TEMPLATE_EDITOR)])
+        for method, viewset, tenants in (('GET', DomainViewSet, [1, 2, 3]),
+                                         ('PATCH', DomainViewSet, [1]),
+                                         ('POST', TagViewSet, [1, 2]),
+                                         ('DELETE', BroadcastViewSet, [1, 2])):
+            request = SimpleNamespace(method=method, _dds2api_perms=perms)
+            self.assertEqual(action_tenants(request, viewset()), tenants, (method, viewset))
+
+
+@override_settings(DDS2API_JWT_STATELESS=True)
+class TenantClaimTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(tenant='claim-tests')
+        self.other = Tenant.objects.create(tenant='claim-tests-other')
+        self.user = get_user_model().objects.create_user('claim-tests')
+        self.profile = Profile.objects.create(user=self.user, mobile_number='',
+                                              verified_number=False, enable_2fa=False)
+        self.profile.tenant.add(self.tenant, self.other)
+        self.role = Role.objects.create(tenant=self.tenant, role=Role.TEMPLATE_EDITOR)
+        self.profile.roles.add(self.role)
+        # the changes above revoked the claims of earlier tokens
+        cache.clear()
+
+    def token(self):
+        return add_tenant_claims(AccessToken.for_user(self.user), self.user)
+
+    def test_claims(self):
+        token = self.token()
+        self.assertEqual(sorted(token[TENANTS_CLAIM]), sorted([self.tenant.pk, self.other.pk]))
+        self.assertEqual(token[ROLES_CLAIM], [[self.tenant.pk, Role.TEMPLATE_EDITOR]])
+        perms = PermissionSet.from_claim(token[PERMS_CLAIM])
+        self.assertTrue(perms.allows(self.tenant.pk, PERM_READ | PERM_TEMPLATES))
+        self.assertFalse(perms.allows(self.tenant.pk, PERM_MANAGE))
+        self.assertFalse(perms.allows(self.other.pk, PERM_TEMPLATES))
+
+    def test_fresh_claims_skip_the_user_lookup(self):
+        user = TenantJWTAuthentication().get_user(self.token())
+        self.assertIsInstance(user, TenantTokenUser)
+        self.assertEqual(user.roles, [(self.tenant.pk, Role.TEMPLATE_EDITOR)])
+
+    def test_membership_changes_revoke_the_claims(self):
+        for change in (lambda: self.profile.roles.remove(self.role),
+                       lambda: self.profile.tenant.remove(self.other),
+                       lambda: self.tenant.profile_set.clear(),
+                       self.role.delete):
+            cache.clear()
+            token = self.token()
+            self.assertTrue(claims_are_fresh(token))
+            change()
+            self.assertFalse(claims_are_fresh(token))
+
+    def test_stale_claims_load_the_user(self):
+        token = self.token()
+        self.profile.roles.remove(self.role)
+        user = TenantJWTAuthentication().get_user(token)
+        self.assertEqual(user, self.user)
+        self.assertNotIsInstance(user, TenantTokenUser)
+
+
+class ReplicaProbeViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """Answers with the database its reads go to"""
+    authentication_classes = ()
+    permission_classes = ()
+    throttle_classes = ()
+    replica_actions = ('list',)
+
+    def list(self, request):
+        return Response(ReplicaRouter().db_for_read(None))
+
+    def create(self, request):
+        ReplicaRouter().db_for_write(None)
+        return Response(ReplicaRouter().db_for_read(None))
+
+
+@mock.patch('dds2be.db_routers.replica_aliases', return_value=['replica_0'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.view = ReplicaProbeViewSet.as_view({'get': 'list', 'post': 'create'})
+
+    def call(self, method, user):
+        request = getattr(APIRequestFactory(), method)('/probe/')
+        force_authenticate(request, user)
+        return self.view(request).data
+
+    def test_routing(self, _aliases):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(None), 'default')
+        with replica_reads(False) as state:
+            self.assertEqual(router.db_for_read(None), 'default')
+            allow_replica_reads(True)
+            self.assertEqual(router.db_for_read(None), 'replica_0')
+            self.assertEqual(router.db_for_write(None), 'default')
+            self.assertTrue(state.wrote)
+            self.assertEqual(router.db_for_read(None), 'default')
+        self.assertEqual(router.db_for_read(None), 'default')
+
+    def test_read_your_writes(self, _aliases):
+        user = SimpleNamespace(id=7, is_authenticated=True)
+        other = SimpleNamespace(id=8, is_authenticated=True)
+        self.assertEqual(self.call('get', user), 'replica_0')
+        self.assertEqual(self.call('post', user), 'default')
+        self.assertEqual(self.call('get', user), 'default')
+        self.assertEqual(self.call('get', other), 'replica_0')
+
+    def test_anonymous_requests_are_not_pinned(self, _aliases):
+        anonymous = AnonymousUser()
+        self.call('post', anonymous)
+        self.assertIsNone(cache.get(REPLICA_PIN_KEY.format(None)))
+        self.assertEqual(self.call('get', anonymous), 'replica_0')
+
+
+class ConnectionPoolTests(TransactionTestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        self.conn_params = connection.get_connection_params()
+
+    def make_pool(self, **kwargs):
+        pool = ConnectionPool(self.conn_params, **kwargs)
+        self.addCleanup(pool.closeall)
+        return pool
+
+    def test_connection_is_reused(self):
+        pool = self.make_pool(max_size=2)
+        conn = pool.getconn()
+        pid = conn.get_backend_pid()
+        pool.putconn(conn)
+        self.assertEqual(pool.getconn().get_backend_pid(), pid)
+
+    def test_open_transaction_is_rolled_back(self):
+        pool = self.make_pool(max_size=1)
+        conn = pool.getconn()
+        conn.cursor().execute('SELECT 1')
+        pool.putconn(conn)
+        self.assertEqual(pool.getconn().status, psycopg2.extensions.STATUS_READY)
+
+    def test_dead_connection_is_replaced(self):
+        pool = self.make_pool(max_size=1, check_interval=0)
+        conn = pool.getconn()
+        pid = conn.get_backend_pid()
+        pool.putconn(conn)
+        killer = psycopg2.connect(**self.conn_params)
+        self.addCleanup(killer.close)
+        killer.cursor().execute('SELECT pg_terminate_backend(%s)', [pid])
+        killer.commit()
+        conn = pool.getconn()
+        self.assertNotEqual(conn.get_backend_pid(), pid)
+
+    def test_exhausted_pool_times_out(self):
+        pool = self.make_pool(max_size=1, timeout=0.1)
+        pool.getconn()
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+
+
+class PooledDatabaseWrapperTests(TransactionTestCase):
+    """needs a local PostgreSQL"""
+
+    def tearDown(self):
+        connection.close()
+        close_pools()
+
+    def test_close_returns_connection_to_pool(self):
+        connection.close()
+        previous = connection.settings_dict.get('POOL')
+        self.addCleanup(connection.settings_dict.__setitem__, 'POOL', previous)
+        connection.settings_dict['POOL'] = {'MAX_SIZE': 2, 'TIMEOUT': 1}
+        connection.ensure_connection()
+        pid = connection.connection.get_backend_pid()
+        connection.close()
+        connection.ensure_connection()
+        self.assertEqual(connection.connection.get_backend_pid(), pid)
+
+    def test_health_check_reconnects(self):
+        connection.ensure_connection()
+        connection.connection.close()
+        connection.close_if_unusable_or_obsolete()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except OperationalError:
+            self.fail('unusable persistent connection was not replaced')
+
+
+def txt(*strings):
+    return b''.join(bytes([len(value)]) + value.encode() for value in strings)
+
+
+def mx(preference, host):
+    return struct.pack('!H', preference) + encode_name(host)
+
+
+SOA = (encode_name('ns.example.com') + encode_name('admin.example.com') +
+       struct.pack('!IIIII', 1, 3600, 600, 86400, 60))
+
+
+class StubNameserver(asyncio.DatagramProtocol):
+    """Answers from zone, {(name, type): [(ttl, rdata)]}, over UDP on
+       127.0.0.1, names missing from zone are NXDOMAIN"""
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.queries = []
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query_id, = struct.unpack_from('!H', data)
+        name, offset = decode_name(data, HEADER.size)
+        rtype, = struct.unpack_from('!H', data, offset)
+        self.queries.append((name, rtype))
+        question = data[HEADER.size:offset + 4]
+        records = self.zone.get((name, rtype), [])
+        exists = any(key[0] == name for key in self.zone)
+        authority = [] if records else [(300, TYPE_SOA, SOA)]
+        answer = b''.join(
+            encode_name(name) + RR_HEADER.pack(record_type, CLASS_IN, ttl, len(rdata)) + rdata
+            for ttl, record_type, rdata in [(ttl, rtype, rdata) for ttl, rdata in records] +
+            authority)
+        flags = 0x8180 | (0 if exists else 3)
+        self.transport.sendto(
+            HEADER.pack(query_id, flags, 1, len(records), len(authority), 0) +
+            question + answer, addr)
+
+
+class InstrumentationTests(SimpleTestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_metrics_need_the_token(self):
+        factory = RequestFactory()
+        with override_settings(DDS2API_METRICS_TOKEN=''):
+            self.assertEqual(metrics_view(factory.get('/metrics')).status_code, 403)
+        with override_settings(DDS2API_METRICS_TOKEN='s3cret'):
+            for authorization, status in (('', 403), ('Bearer wrong', 403),
+                                          ('Bearer s3cret', 200)):
+                request = factory.get('/metrics', HTTP_AUTHORIZATION=authorization)
+                self.assertEqual(metrics_view(request).status_code, status, authorization)
+
+    def test_middleware_records_the_request(self):
+        def view(request):
+            current_stats().cache_hits += 1
+            return HttpResponse(TimedJSONRenderer().render({'rows': list(range(1000))}),
+                                status=201)
+        view.cls = type('DataSetViewSet', (), {})
+        view.actions = {'post': 'create'}
+        middleware = RequestMetricsMiddleware(None)
+        request = RequestFactory().post('/api/dataset/')
+        middleware.get_response = lambda request: (
+            middleware.process_view(request, view, (), {}) or view(request))
+        self.assertEqual(middleware(request).status_code, 201)
+        self.assertIsNone(current_stats())
+        series = registry.snapshot()[('DataSetViewSet', 'create', 'POST', '2xx')]
+        self.assertEqual((series['count'], series['cache_hits'], series['db_queries']), (1, 1, 0))
+        self.assertGreater(series['render_seconds'], 0)
+        self.assertLessEqual(series['render_seconds'], series['seconds'])
+        self.assertEqual(sum(series['buckets']), 1)
+
+    def test_serialization_is_timed_once(self):
+        class PointSerializer(TimedSerializerMixin, serializers.Serializer):
+            x = serializers.IntegerField()
+
+        class ShapeSerializer(TimedSerializerMixin, serializers.Serializer):
+            points = PointSerializer(many=True)
+
+        def view(request):
+            shapes = [{'points': [{'x': x} for x in range(100)]}] * 10
+            data = ShapeSerializer(shapes, many=True).data
+            self.assertFalse(current_stats().serializing)
+            return HttpResponse(json.dumps(data))
+        middleware = RequestMetricsMiddleware(None)
+        request = RequestFactory().get('/api/shape/')
+        middleware.get_response = lambda request: (
+            middleware.process_view(request, view, (), {}) or view(request))
+        middleware(request)
+        series = registry.snapshot()[('view', '', 'GET', '2xx')]
+        self.assertGreater(series['serialize_seconds'], 0)
+        self.assertLessEqual(series['serialize_seconds'], series['seconds'])
+
+    def test_exposition(self):
+        metrics = MetricsRegistry()
+        labels = ('BroadcastViewSet', 'list', 'GET', '2xx')
+        stats = RequestStats()
+        stats.db_queries = 3
+        for seconds in (0.004, 0.02, 20):
+            metrics.observe(labels, seconds, stats)
+        lines = metrics.exposition().splitlines()
+        series = 'view="BroadcastViewSet",action="list",method="GET",status="2xx"'
+        self.assertIn('# TYPE dds2_requests_total counter', lines)
+        self.assertIn(f'dds2_requests_total{{{series}}} 3', lines)
+        self.assertIn(f'dds2_db_queries_total{{{series}}} 9', lines)
+        self.assertIn('# TYPE dds2_request_duration_seconds histogram', lines)
+        self.assertIn(f'dds2_request_duration_seconds_bucket{{{series},le="0.005"}} 1', lines)
+        self.assertIn(f'dds2_request_duration_seconds_bucket{{{series},le="0.025"}} 2', lines)
+        self.assertIn(f'dds2_request_duration_seconds_bucket{{{series},le="10.0"}} 2', lines)
+        self.assertIn(f'dds2_request_duration_seconds_bucket{{{series},le="+Inf"}} 3', lines)
+        self.assertIn(f'dds2_request_duration_seconds_count{{{series}}} 3', lines)
+
+
+class ResolverTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.zone = {
+            ('example.com', TYPE_TXT): [(120, txt('v=spf1 ', 'include:spf.dds2.io -all'))],
+            ('example.com', TYPE_MX): [(600, mx(20, 'mx2.example.com')),
+                                       (300, mx(10, 'mx1.example.com'))],
+        }
+        self.resolver = Resolver(['127.0.0.1'], timeout=1, tries=1,
+                                 cache=DNSCache(clock=lambda: self.now))
+
+    def resolve(self, *queries):
+        async def run():
+            loop = asyncio.get_event_loop()
+            transport, nameserver = await loop.create_datagram_endpoint(
+                lambda: StubNameserver(self.zone), local_addr=('127.0.0.1', 0))
+            self.resolver.port = transport.get_extra_info('sockname')[1]
+            try:
+                answers = await asyncio.gather(
+                    *(self.resolver.query(name, rtype) for name, rtype in queries))
+            finally:
+                transport.close()
+            return answers, nameserver.queries
+        return asyncio.run(run())
+
+    def test_records_and_ttl(self):
+        (spf, mail), _ = self.resolve(('example.com', TYPE_TXT), ('EXAMPLE.com.', TYPE_MX))
+        self.assertEqual(spf, Answer(('v=spf1 include:spf.dds2.io -all',), 120, 0))
+        self.assertEqual(set(mail.records), {(10, 'mx1.example.com'), (20, 'mx2.example.com')})
+        self.assertEqual(mail.ttl, 300)
+
+    def test_answers_are_cached_until_their_ttl(self):
+        _, queries = self.resolve(('example.com', TYPE_TXT))
+        self.assertEqual(len(queries), 1)
+        self.now += 119
+        (answer,), queries = self.resolve(('example.com', TYPE_TXT))
+        self.assertEqual((queries, answer.ttl), ([], 1))
+        self.now += 1
+        _, queries = self.resolve(('example.com', TYPE_TXT))
+        self.assertEqual(len(queries), 1)
+
+    def test_negative_answers_use_the_soa_minimum(self):
+        (answer,), _ = self.resolve(('missing.example.com', TYPE_TXT))
+        self.assertEqual(answer, Answer((), 60, 3))
+        self.now += 59
+        _, queries = self.resolve(('missing.example.com', TYPE_TXT))
+        self.assertEqual(queries, [])
+
+    def test_concurrent_queries_share_a_lookup(self):
+        answers, queries = self.resolve(*[('example.com', TYPE_TXT)] * 20)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(set(answers)), 1)
+
+
+class StubResolver:
+
+    def __init__(self, records):
+        self.records = records
+
+    async def query(self, name, rtype):
+        return Answer(tuple(self.records.get((name, rtype), ())), 300, 0)
+
+
+@override_settings(DDS2API_DKIM_SELECTOR='dds2', DDS2API_SPF_INCLUDE='spf.dds2.io')
+class DomainCheckTests(SimpleTestCase):
+    records = {
+        ('example.com', TYPE_TXT): ['google-site-verification=x',
+                                    'v=spf1 include:spf.dds2.io ~all'],
+        ('dds2._domainkey.example.com', TYPE_TXT): ['v=DKIM1; k=rsa; p=MIGfMA0G'],
+        ('_dmarc.example.com', TYPE_TXT): ['v=DMARC1; p=none'],
+        ('example.com', TYPE_MX): [(10, 'mx.example.com')],
+    }
+
+    def check(self, changes=None):
+        return asyncio.run(check_domain(StubResolver({**self.records, **(changes or {})}),
+                                        'example.com'))
+
+    def test_verified(self):
+        result = self.check()
+        self.assertTrue(result['verified'])
+        self.assertEqual(result['records']['spf'], 'v=spf1 include:spf.dds2.io ~all')
+        self.assertEqual(result['records']['mx'], ['mx.example.com'])
+
+    def test_spf_without_our_include(self):
+        self.assertFalse(self.check({('example.com', TYPE_TXT): ['v=spf1 mx -all']})['verified'])
+
+    def test_revoked_dkim_key(self):
+        changes = {('dds2._domainkey.example.com', TYPE_TXT): ['v=DKIM1; p=']}
+        self.assertFalse(self.check(changes)['verified'])
+
+    def test_missing_dmarc(self):
+        self.assertFalse(self.check({('_dmarc.example.com', TYPE_TXT): []})['verified'])
+
+
+class AttachmentFetchTests(SimpleTestCase):
+
+    def fetch(self, url):
+        return asyncio.run(aio.fetch(url, timeout=2))
+
+    def test_private_hosts_are_refused(self):
+        for url in ('http://127.0.0.1:8000/', 'http://localhost/', 'http://10.1.2.3/',
+                    'http://169.254.169.254/latest/meta-data/', 'http://[::1]/',
+                    'http://[::ffff:127.0.0.1]/', 'file:///etc/passwd'):
+            with self.assertRaises(aio.HTTPError, msg=url):
+                self.fetch(url)
+
+    def test_redirects_are_checked(self):
+        async def redirect(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.0 302 Found\r\n'
+                         b'Location: http://169.254.169.254/latest/meta-data/\r\n\r\n')
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(redirect, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                with mock.patch.object(aio, 'is_public', lambda address: address == '127.0.0.1'):
+                    await aio.fetch(f'http://127.0.0.1:{port}/', timeout=2)
+            finally:
+                server.close()
+        with self.assertRaisesRegex(aio.HTTPError, '169.254.169.254'):
+            asyncio.run(run())
+
+    def test_read_is_bounded(self):
+        async def read(headers, limit):
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'x' * 100)
+            reader.feed_eof()
+            return await aio.HTTPResponse(200, headers, reader, mock.Mock(), 1).read(limit)
+        self.assertEqual(len(asyncio.run(read({}, 100))), 100)
+        with self.assertRaises(aio.HTTPError):
+            asyncio.run(read({}, 99))
+        with self.assertRaises(aio.HTTPError):
+            asyncio.run(read({'content-length': '1000000'}, 99))
+
+    def test_supplied_rows_cannot_name_the_url(self):
+        attachment = Attachment(origin=Attachment.ORIGIN_FROM_URL, field_name='url')
+        row = {'url': 'http://169.254.169.254/'}
+        self.assertEqual(attachment_request(attachment, row)[1], row['url'])
+        with self.assertRaises(SuppliedRowError):
+            attachment_request(attachment, row, supplied_row=True)
+
+    def test_s3_objects_need_their_credentials(self):
+        credentials = StorageCredential(pk=1, tenant_id=1)
+        attachment = Attachment(origin=Attachment.ORIGIN_FROM_S3_OBJECT_KEY,
+                                aws_s3_bucket_name='statements', aws_s3_object_key='{{ key }}')
+        with self.assertRaises(AttachmentSourceError):
+            attachment_request(attachment, {'key': 'a.pdf'})
+        attachment.credentials = credentials
+        with mock.patch('dds2api.attachments.s3_client') as client:
+            client.return_value.generate_presigned_url.return_value = 'https://s3/a.pdf'
+            self.assertEqual(attachment_request(attachment, {'key': 'a.pdf'})[1],
+                             'https://s3/a.pdf')
+            client.assert_called_once_with(credentials)
+            with self.assertRaises(SuppliedRowError):
+                attachment_request(attachment, {'key': 'a.pdf'}, supplied_row=True)
+            attachment.aws_s3_object_key = 'terms.pdf'
+            self.assertEqual(attachment_request(attachment, {}, supplied_row=True)[1],
+                             'https://s3/a.pdf')
+        serializer = AttachmentSerializer()
+        for attrs in ({'tenant': Tenant(pk=2)},
+                      {'tenant': Tenant(pk=2), 'credentials': credentials}):
+            attrs['origin'] = Attachment.ORIGIN_FROM_S3_OBJECT_KEY
+            with self.assertRaises(ValidationError):
+                serializer.validate(attrs)
+
+
+class ASGITests(SimpleTestCase):
+
+    def call(self, headers, chunks):
+        sent, fallback = [], mock.AsyncMock()
+        messages = iter([{'type': 'http.request', 'body': chunk, 'more_body': True}
+                         for chunk in chunks] + [{'type': 'http.request', 'body': b''}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/broadcast/1/test-send/',
+                 'headers': headers}
+        with mock.patch.object(asgi_views, 'authenticate', mock.AsyncMock()), \
+                mock.patch.object(asgi_views, 'get_object', mock.AsyncMock()), \
+                mock.patch.object(asgi_views, 'charge_tenants', return_value=None):
+            asyncio.run(asgi_views.asgi_application(fallback)(scope, receive, send))
+        return sent, fallback
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_body_is_limited(self):
+        bearer = (b'authorization', b'Bearer token')
+        for headers in ([bearer, (b'content-length', b'101')], [bearer]):
+            sent, fallback = self.call(headers, [b'x' * 60, b'x' * 60])
+            self.assertEqual(sent[0]['status'], 413)
+            fallback.assert_not_called()
+
+    def test_other_credentials_go_to_the_viewsets(self):
+        sent, fallback = self.call([(b'cookie', b'sessionid=1')], [])
+        self.assertEqual(sent, [])
+        fallback.assert_called_once()
+
+
+@override_settings(DDS2API_SENDER_TOKENS_PER_HOUR=2)
+class SenderVerificationTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        cache.clear()
+        tenant = Tenant.objects.create(tenant='sender-tests')
+        self.sender = Sender.objects.create(tenant=tenant, name='News',
+                                            email='news@example.com', mobile_number='')
+
+    def test_confirm(self):
+        token = senders.issue_token(self.sender)
+        self.assertNotEqual(self.sender.verification_token, token)
+        self.assertEqual(senders.confirm_token(token), self.sender)
+        self.sender.refresh_from_db()
+        self.assertTrue(self.sender.email_verified)
+        self.assertIsNone(senders.confirm_token(token))
+
+    def test_expired_token(self):
+        token = senders.issue_token(self.sender)
+        Sender.objects.filter(pk=self.sender.pk).update(verification_expires_on=timezone.now())
+        self.assertIsNone(senders.confirm_token(token))
+        self.sender.refresh_from_db()
+        self.assertFalse(self.sender.email_verified)
+
+    def test_expire(self):
+        token = senders.issue_token(self.sender)
+        senders.expire_token(self.sender)
+        self.assertIsNone(senders.confirm_token(token))
+
+    def test_issue_is_rate_limited(self):
+        senders.issue_token(self.sender)
+        senders.issue_token(self.sender)
+        with self.assertRaises(senders.TokenRateLimited):
+            senders.issue_token(self.sender)
+
+    def test_state_is_cached(self):
+        senders.confirm_token(senders.issue_token(self.sender))
+        with self.assertNumQueries(0):
+            self.assertTrue(senders.sender_verified(self.sender.pk))
+
+
+class PlannerEstimateTests(SimpleTestCase):
+
+    def test_distinct_count(self):
+        sketch = HyperLogLog()
+        for number in range(100000):
+            sketch.add(f'user{number % 50000}@example.com')
+        self.assertAlmostEqual(sketch.count(), 50000, delta=50000 * 0.03)
+
+    def test_small_distinct_count(self):
+        sketch = HyperLogLog()
+        for value in ['a', 'b', 'c', 'a']:
+            sketch.add(value)
+        self.assertEqual(sketch.count(), 3)
+
+    def test_sms_segments(self):
+        self.assertEqual(sms_segments('a' * 160), 1)
+        self.assertEqual(sms_segments('a' * 161), 2)
+        self.assertEqual(sms_segments('ñ' * 160), 1)
+        self.assertEqual(sms_segments('€' * 71), 2)
+
+    def test_file_size_is_recorded_at_upload(self):
+        attachment = Attachment(file=SimpleUploadedFile('a.pdf', b'x' * 42))
+        with mock.patch('django.db.models.Model.save') as save:
+            attachment.save(update_fields=['file'])
+        self.assertEqual(attachment.file_size, 42)
+        save.assert_called_once_with(update_fields=['file', 'file_size'])
+
+    def test_attachment_sizes(self):
+        attachments = [Attachment(pk=1, file='uploads/a', file_size=100),
+                       Attachment(pk=2, file='uploads/b'),
+                       Attachment(pk=3, origin=Attachment.ORIGIN_FROM_URL)]
+        broadcast = SimpleNamespace(email_attachments=SimpleNamespace(all=lambda: attachments))
+        with mock.patch('django.db.models.fields.files.FieldFile.size',
+                        new_callable=mock.PropertyMock, return_value=7) as size:
+            self.assertEqual(attachment_sizes(broadcast), (107, [3]))
+        size.assert_called_once_with()
+
+
+class BroadcastSerializerTests(SimpleTestCase):
+
+    def test_domain_and_sender_of_the_tenant(self):
+        tenant = Tenant(pk=1)
+        for name, other in (('domain', Domain(tenant_id=2, name='other.example')),
+                            ('sender', Sender(tenant_id=2, email='ceo@other.example',
+                                              email_verified=True))):
+            with self.assertRaises(ValidationError) as raised:
+                BroadcastSerializer().validate({'tenant': tenant, name: other,
+                                                'status': Broadcast.STATUS_DRAFT})
+            self.assertIn(name, raised.exception.detail)
+
+    def test_choices_are_limited_to_the_user_tenants(self):
+        request = SimpleNamespace(_dds2api_perms=compile_permissions([1, 3], []))
+        fields = BroadcastSerializer(context={'request': request}).fields
+        for name in ('domain', 'sender'):
+            self.assertIn('"tenant_id" IN (1, 3)', str(fields[name].queryset.query))
+
+
+class DataSetVersionTests(SimpleTestCase):
+
+    def test_merged_sketches_count_the_union(self):
+        first, second = HyperLogLog(12), HyperLogLog(12)
+        for number in range(20000):
+            first.add(f'user{number}')
+            second.add(f'user{number + 10000}')
+        first.merge(HyperLogLog.from_bytes(second.to_bytes()))
+        self.assertAlmostEqual(first.count(), 30000, delta=30000 * 0.05)
+        with self.assertRaises(ValueError):
+            first.merge(HyperLogLog())
+
+    def test_keys_round_trip(self):
+        self.assertEqual(list(_unpack_keys(_pack_keys([3, 2 ** 64 - 1, 1]))),
+                         [1, 3, 2 ** 64 - 1])
+
+    def test_upserts_replace_earlier_rows(self):
+        segments = [
+            [{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b'}, {'id': '3', 'name': 'c'}],
+            [{'id': '2', 'name': 'B'}, {'id': '4', 'name': 'd'}],
+            [{'id': '4', 'name': 'D'}],
+        ]
+        # segments 1 and 2 are UPSERT ones
+        latest = {hash64('2'): 1, hash64('4'): 2}
+        self.assertEqual([row['name'] for row in live_rows(segments, 'id', latest)],
+                         ['a', 'c', 'B', 'D'])
+
+    def test_replaced_rows(self):
+        # a base segment with key 1 twice, an UPSERT segment of key 2
+        segments = [SimpleNamespace(kind=DataSetSegment.BASE, keys=[1, 1, 2, 3]),
+                    SimpleNamespace(kind=DataSetSegment.UPSERT, keys=[2])]
+        with mock.patch('dds2api.datasets.segment_keys', lambda segment: segment.keys):
+            self.assertEqual(replaced_rows(segments, {1, 2, 4}), 3)
+            self.assertEqual(replaced_rows(segments, {3}), 1)
+
+    def test_upsert_delta_writes_a_key_once(self):
+        dataset = SimpleNamespace(file_encoding='utf-8', file_delimiter=',', file_quotechar='"',
+                                  file_has_header=False, file_fields=['id', 'name'])
+        delta = SimpleNamespace(mode=DataSetDelta.UPSERT,
+                                uploaded_file=ContentFile(b'1,a\n2,b\n1,c\n'))
+        self.assertEqual(list(_delta_rows(dataset, delta, 'id')),
+                         [{'id': '1', 'name': 'c'}, {'id': '2', 'name': 'b'}])
+
+    def test_merged_sample_is_weighted_by_segment_rows(self):
+        rng = random.Random(1)
+        picked = 0
+        for _ in range(200):
+            sample = merge_sample([([{'segment': 'big'}] * 100, 9000),
+                                   ([{'segment': 'small'}] * 100, 1000)], 10, rng)
+            self.assertEqual(len(sample), 10)
+            picked += sum(row['segment'] == 'big' for row in sample)
+        self.assertAlmostEqual(picked / 2000, 0.9, delta=0.05)
+
+
+    def test_only_changed_parsing_fields_ingest_again(self):
+        serializer = DataSetSerializer(DataSet(key_field='id', file_fields=['id', 'name']))
+        self.assertEqual(serializer.changed_parsing_fields(
+            {'key_field': 'id', 'file_fields': ['id', 'name'], 'description': 'x'}), [])
+        self.assertEqual(serializer.changed_parsing_fields({'key_field': 'name'}),
+                         ['key_field'])
+
+    def test_listing_deltas_is_not_an_upload(self):
+        match = resolve('/api/dataset/1/deltas/')
+        scopes = match.func.cls.tenant_throttle_scopes
+        self.assertNotIn(match.func.actions['get'], scopes)
+        self.assertEqual(scopes[match.func.actions['post']], 'dataset-upload')
+
+class DocumentRendererTests(SimpleTestCase):
+
+    def test_serve_caches_templates(self):
+        requests = io.BytesIO()
+        for request in ({'key': '1:0', 'format': 'HTML', 'row': {'name': 'Ann'},
+                         'source': '<p>{{ name }}</p>'},
+                        {'key': '1:0', 'format': 'HTML', 'row': {'name': '<b>'}},
+                        {'key': '2:0', 'format': 'HTML', 'row': {}}):
+            write_frame(requests, json.dumps(request).encode('utf-8'))
+        requests.seek(0)
+        responses = io.BytesIO()
+        serve(requests, responses, DocumentRenderer(max_templates=2))
+        responses.seek(0)
+        frames = iter(lambda: read_frame(responses), None)
+        self.assertEqual(json.loads(next(frames)), {'content_type': 'text/html; charset=utf-8'})
+        self.assertEqual(next(frames), b'<p>Ann</p>')
+        self.assertEqual(next(frames), b'')
+        next(frames)
+        self.assertEqual(next(frames), b'<p>&lt;b&gt;</p>')
+        next(frames)
+        self.assertEqual(json.loads(next(frames)), {'missing': True})
+        self.assertIsNone(next(frames, None))
+
+    def test_pool_reuses_warm_renderers(self):
+        pool = RendererPool(size=1, timeout=60, max_templates=2)
+        document = Document('1:0', 'HTML', 'Dear {{ name }}', {})
+        try:
+            for name in ('Ann', 'Bob'):
+                content_type, chunks = pool.render(document, {'name': name})
+                self.assertEqual(b''.join(chunks), f'Dear {name}'.encode('utf-8'))
+            self.assertEqual(content_type, 'text/html; charset=utf-8')
+            process = pool._idle.get_nowait()
+            self.assertIn('1:0', process.known)
+            pool._idle.put(process)
+        finally:
+            pool.close()
+
+    def test_debug_tag_is_not_available(self):
+        with self.assertRaises(TemplateSyntaxError):
+            DocumentRenderer(max_templates=1)._engine.from_string('{% debug %}')
+        with self.assertRaises(ValidationError) as raised:
+            AttachmentSerializer().validate({'origin': Attachment.ORIGIN_GENERATED,
+                                             'document_template': '<pre>{% debug %}</pre>'})
+        self.assertIn('document_template', raised.exception.detail)
+        self.assertEqual(render('{% if name %}{{ name|upper }}{% endif %}', {'name': 'ann'}),
+                         'ANN')
+
+    @override_settings(DDS2API_DOCUMENT_ASSETS_MAX_BYTES=1000)
+    def test_assets_are_capped(self):
+        def attachment(assets):
+            content = io.BytesIO()
+            with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for name, data in assets.items():
+                    archive.writestr(name, data)
+            stored = mock.Mock()
+            stored.file.open.return_value = io.BytesIO(content.getvalue())
+            return stored
+
+        self.assertEqual(load_assets(attachment({'logo.png': b'png'})),
+                         {'logo.png': 'cG5n'})
+        with self.assertRaisesMessage(RenderError, 'uncompress to over 1000 bytes'):
+            load_assets(attachment({'a.css': b' ' * 600, 'b.css': b' ' * 600}))
+        with self.assertRaisesMessage(RenderError, 'over 1000 bytes'):
+            load_assets(attachment({'noise.bin': os.urandom(2000)}))
+
+
+class RetentionTests(SimpleTestCase):
+
+    def test_due_months_end_before_the_cutoff(self):
+        months = due_months(datetime(2018, 11, 20, 8, tzinfo=pytz.utc),
+                            datetime(2019, 2, 14, tzinfo=pytz.utc))
+        self.assertEqual([(start.month, end.month) for start, end in months],
+                         [(11, 12), (12, 1), (1, 2)])
+        self.assertEqual(months[1][1], datetime(2019, 1, 1, tzinfo=pytz.utc))
+        self.assertEqual(due_months(datetime(2019, 2, 1, tzinfo=pytz.utc),
+                                    datetime(2019, 2, 14, tzinfo=pytz.utc)), [])
+
+    def test_archive_round_trip(self):
+        stream = io.BytesIO()
+        created_on = datetime(2019, 1, 5, tzinfo=pytz.utc)
+        count = write_archive(['id', 'qty', 'created_on'],
+                              iter([[1, 10.0, created_on], [2, -1.5, created_on]]), stream)
+        self.assertEqual(count, 2)
+        stream.seek(0)
+        self.assertEqual(list(read_archive(stream)),
+                         [{'id': 1, 'qty': 10.0, 'created_on': '2019-01-05T00:00:00Z'},
+                          {'id': 2, 'qty': -1.5, 'created_on': '2019-01-05T00:00:00Z'}])
+
+    def test_row_filters_are_archive_fields(self):
+        archive = Archive(table=RetentionPolicy.TABLE_BALANCE_ENTRIES)
+        params = QueryDict('channel_type=SMS&tenant_id=3&format=json&page=2&cursor=abc')
+        self.assertEqual(row_filters(archive, params), {'channel_type': 'SMS', 'tenant_id': '3'})
+
+
+class RetentionPurgeTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def test_latest_balance_is_kept(self):
+        tenant = Tenant.objects.create(tenant='retention-tests')
+        january = datetime(2019, 1, 10, tzinfo=pytz.utc)
+        for day, channel_type, balance in ((1, 'SMS', 100), (2, 'SMS', 70),
+                                           (3, 'EMAIL', 5), (4, 'EMAIL', 3)):
+            entry = BalanceEntry.objects.create(tenant=tenant, channel_type=channel_type,
+                                                qty=0, balance=balance,
+                                                origin_type='PAYMENT', origin_id='1')
+            BalanceEntry.objects.filter(pk=entry.pk).update(
+                created_on=january + timedelta(days=day))
+        archive = Archive.objects.create(
+            tenant=tenant, table='balanceentry', rows=4,
+            period_start=datetime(2019, 1, 1, tzinfo=pytz.utc),
+            period_end=datetime(2019, 2, 1, tzinfo=pytz.utc),
+            last_id=BalanceEntry.objects.latest('pk').pk, file='archives/test.jsonl.gz')
+        self.assertEqual(purge_archived(archive, batch_size=1), 2)
+        self.assertEqual(BalanceEntry.objects.filter(tenant=tenant).count(), 2)
+        self.assertEqual(current_balance(tenant.pk, 'SMS'), 70)
+        self.assertEqual(current_balance(tenant.pk, 'EMAIL'), 3)
+
+
+class RollupTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(tenant='rollup-tests')
+
+    def test_buckets(self):
+        moment = pytz.timezone('America/Mexico_City').localize(datetime(2019, 3, 31, 23, 45))
+        self.assertEqual([bucket.isoformat() for _, bucket in buckets(moment)],
+                         ['2019-04-01T05:00:00+00:00', '2019-04-01T00:00:00+00:00',
+                          '2019-04-01T00:00:00+00:00'])
+
+    def test_entries_update_the_rollups(self):
+        for qty, balance in ((100, 100), (-30, 70), (-20, 50)):
+            BalanceEntry.objects.create(tenant=self.tenant, channel_type='SMS', qty=qty,
+                                        balance=balance, origin_type='PAYMENT', origin_id='1')
+        rollups = BalanceRollup.objects.filter(tenant=self.tenant)
+        self.assertEqual(rollups.count(), 3)
+        day = rollups.get(granularity=BalanceRollup.DAY)
+        self.assertEqual((day.entries, day.credits, day.debits, day.closing_balance),
+                         (3, 100, -50, 50))
+        rollups.delete()
+        self.assertEqual(rebuild_balance_rollups(self.tenant.pk), 3)
+        day = rollups.get(granularity=BalanceRollup.DAY)
+        self.assertEqual((day.entries, day.credits, day.debits, day.closing_balance),
+                         (3, 100, -50, 50))
+
+
+
+@override_settings(DDS2API_ANALYTICS_MAX_POINTS=2)
+class AnalyticsViewTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(tenant='analytics-tests')
+        user = get_user_model().objects.create_user('analytics-tests')
+        profile = Profile.objects.create(user=user, mobile_number='', verified_number=False,
+                                         enable_2fa=False)
+        profile.tenant.add(self.tenant)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        for day in (1, 2, 3):
+            BalanceRollup.objects.create(tenant=self.tenant, granularity=BalanceRollup.DAY,
+                                         channel_type='SMS', entries=day,
+                                         bucket=datetime(2019, 5, day, tzinfo=pytz.utc))
+
+    def test_newest_points_oldest_first(self):
+        response = self.client.get('/api/analytics/spend/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([point['entries'] for point in response.json()], [2, 3])
+        response = self.client.get('/api/analytics/spend/',
+                                   {'until': '2019-05-03T00:00:00Z'})
+        self.assertEqual([point['entries'] for point in response.json()], [1, 2])
+
+    def test_no_detail_route(self):
+        point = BalanceRollup.objects.first()
+        response = self.client.get(f'/api/analytics/spend/{point.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class AdminPerformanceTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        tenant = Tenant.objects.create(tenant='admin-tests')
+        self.ids = [BalanceEntry.objects.create(tenant=tenant, channel_type='SMS', qty=1,
+                                                balance=number, origin_type='PAYMENT',
+                                                origin_id='1').pk
+                    for number in range(5)]
+        self.client.force_login(get_user_model().objects.create_superuser(
+            'admin-tests', 'admin@example.com', 'x'))
+
+    def test_small_tables_are_counted_exactly(self):
+        entries = BalanceEntry.objects.all()
+        self.assertEqual(EstimatedCountPaginator(entries, 2).count, 5)
+        self.assertEqual(EstimatedCountPaginator(entries.filter(balance__gte=3), 2).count, 2)
+
+    def test_filtered_tables_are_estimated(self):
+        with mock.patch('dds2api.admin.EXACT_COUNT_THRESHOLD', 0):
+            count = EstimatedCountPaginator(BalanceEntry.objects.filter(balance__gte=3), 2).count
+        self.assertIsInstance(count, int)
+        with mock.patch.object(AdminBalanceEntry, 'list_per_page', 2):
+            response = self.client.get('/admin/dds2api/balanceentry/',
+                                       {'channel_type__exact': 'SMS', 'balance__gte': '3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry.pk for entry in response.context['cl'].result_list],
+                         self.ids[4:2:-1])
+
+    def test_cursor_pages(self):
+        url = '/admin/dds2api/balanceentry/'
+        with mock.patch.object(AdminBalanceEntry, 'list_per_page', 2):
+            first = self.client.get(url).context['cl']
+            self.assertEqual([entry.pk for entry in first.result_list], self.ids[4:2:-1])
+            second = self.client.get(url, {'cursor': first.next_cursor}).context['cl']
+            self.assertEqual([entry.pk for entry in second.result_list], self.ids[2:0:-1])
+            # a cursor that is not a primary key shows the first page
+            response = self.client.get(url, {'cursor': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), list(first.result_list))
+
+
+class CountingFile:
+
+    def __init__(self, content):
+        self.name = 'datasets/rows.csv'
+        self.content = content
+        self.opened = 0
+
+    def open(self, mode):
+        self.opened += 1
+        return io.BytesIO(self.content)
+
+
+class SampleRowCacheTests(SimpleTestCase):
+
+    def dataset(self, pk=1, modified_on=None):
+        return SimpleNamespace(pk=pk, modified_on=modified_on,
+                               current_version=None, current_version_id=None,
+                               uploaded_file=CountingFile(b'name,email\na,a@x\nb,b@x\nc,c@x\n'),
+                               file_encoding='utf-8', file_has_header=True,
+                               file_delimiter=',', file_quotechar='"',
+                               file_fields=['name', 'email'])
+
+    def test_numbered_rows_are_read_once(self):
+        dataset = self.dataset()
+        rows = SampleRowCache(2).get(dataset)
+        self.assertEqual(rows.numbers([2, 0, 9]),
+                         [(2, {'name': 'c', 'email': 'c@x'}), (0, {'name': 'a', 'email': 'a@x'})])
+        rows.numbers([0, 2])
+        self.assertEqual(dataset.uploaded_file.opened, 1)
+
+    def test_numbers_are_bounded(self):
+        dataset = self.dataset()
+        dataset.uploaded_file = CountingFile(
+            b'name,email\n' + b''.join(b'%d,x\n' % number for number in range(1500)))
+        rows = SampleRowCache(2).get(dataset)
+        with override_settings(DDS2API_PREVIEW_SCAN_ROWS=1200):
+            self.assertEqual(rows.numbers([1199, 1200]), [(1199, {'name': '1199', 'email': 'x'})])
+            self.assertEqual(len(rows.numbered), 1)
+            rows.numbers([1199] + list(range(0, 1200, 2)))
+        self.assertLessEqual(len(rows.numbered), 1000)
+        self.assertIn(1199, rows.numbered)
+        errors = BroadcastPreviewSerializer(data={'dataset': 1, 'row': [10 ** 7]})
+        self.assertFalse(errors.is_valid())
+
+    def test_lru(self):
+        cache = SampleRowCache(2)
+        first = self.dataset(1)
+        entry = cache.get(first)
+        cache.get(self.dataset(2))
+        self.assertIs(cache.get(first), entry)
+        cache.get(self.dataset(3))
+        cache.get(self.dataset(2))
+        self.assertIsNot(cache.get(first), entry)
+
+    def test_new_version_is_a_new_entry(self):
+        cache = SampleRowCache(2)
+        entry = cache.get(self.dataset(1, modified_on=1))
+        self.assertIsNot(cache.get(self.dataset(1, modified_on=2)), entry)
+
+
+class BitmapTests(SimpleTestCase):
+
+    def test_matches_set_operations(self):
+        rng = random.Random(7)
+        sparse = set(rng.sample(range(500000), 3000))
+        dense = set(rng.sample(range(140000), 60000))
+        for left, right in ((sparse, dense), (dense, sparse), (dense, dense - sparse)):
+            with self.subTest(left=len(left), right=len(right)):
+                self.assertEqual(list(Bitmap(left) & Bitmap(right)), sorted(left & right))
+                self.assertEqual(list(Bitmap(left) | Bitmap(right)), sorted(left | right))
+                self.assertEqual(list(Bitmap(left) - Bitmap(right)), sorted(left - right))
+
+    def test_add_and_contains(self):
+        bitmap = Bitmap()
+        for value in range(0, 20000, 2):
+            bitmap.add(value)
+        self.assertEqual(len(bitmap), 10000)
+        self.assertIn(19998, bitmap)
+        self.assertNotIn(19999, bitmap)
+
+
+class TagExpressionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = TagIndex()
+        self.index.add(1, ['vip'])
+        self.index.add(2, ['vip', 'churned'])
+        self.index.add(3, ['churned'])
+        self.index.add(4)
+
+    def select(self, expression):
+        return list(self.index.evaluate(parse(expression)))
+
+    def test_precedence(self):
+        self.assertEqual(parse('a or not b and c'),
+                         ('or', ('tag', 'a'), ('and', ('not', ('tag', 'b')), ('tag', 'c'))))
+
+    def test_evaluate(self):
+        self.assertEqual(self.select('vip AND NOT churned'), [1])
+        self.assertEqual(self.select('NOT (vip OR churned)'), [4])
+        self.assertEqual(self.select('VIP or unknown'), [1, 2])
+
+    def test_errors(self):
+        for expression in ('', 'vip AND', '(vip', 'vip churned', 'NOT'):
+            with self.subTest(expression=expression), self.assertRaises(TagExpressionError):
+                parse(expression)
+
+
+class KMSTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'kms.key')
+        kms.add_key(self.path)
+
+    def test_round_trip(self):
+        envelope = kms.encrypt(b'secret', kms.LocalKMS(self.path))
+        self.assertNotIn('secret', envelope)
+        self.assertEqual(kms.decrypt(envelope, kms.LocalKMS(self.path)), b'secret')
+
+    def test_rewrap_after_rotation(self):
+        envelope = kms.encrypt(b'secret', kms.LocalKMS(self.path))
+        active = kms.add_key(self.path)
+        rewrapped = kms.rewrap(envelope, kms.LocalKMS(self.path))
+        self.assertEqual(rewrapped.split(':')[1], active)
+        self.assertEqual(rewrapped.split(':')[3], envelope.split(':')[3])
+        self.assertEqual(kms.decrypt(rewrapped, kms.LocalKMS(self.path)), b'secret')
+
+    def test_key_added_by_another_process(self):
+        local = kms.LocalKMS(self.path)
+        kms.add_key(self.path)
+        self.assertEqual(kms.decrypt(kms.encrypt(b'secret', kms.LocalKMS(self.path)), local),
+                         b'secret')
+
+    def test_tampered_envelope(self):
+        envelope = kms.encrypt(b'secret', kms.LocalKMS(self.path))
+        version, key_id, wrapped, payload = envelope.split(':')
+        tampered = kms._b64(bytes(byte ^ 1 for byte in kms._unb64(payload)))
+        with self.assertRaises(kms.DecryptionError):
+            kms.decrypt(':'.join((version, key_id, wrapped, tampered)), kms.LocalKMS(self.path))
+
+
+class FakeCredentials(list):
+    """The StorageCredential manager of a migration, in memory"""
+
+    def using(self, alias):  # pylint: disable=W0613
+        return self
+
+    def exclude(self, secrets_envelope):
+        return FakeCredentials(credential for credential in self
+                               if credential.secrets_envelope != secrets_envelope)
+
+    def count(self):
+        return len(self)
+
+    def iterator(self):
+        return iter(self)
+
+
+class SecretsMigrationTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'kms.key')
+        self.migration = importlib.import_module(
+            'dds2api.migrations.0008_storagecredential_secrets_envelope')
+        self.credential = SimpleNamespace(pk=1, access_key_id='AKIA', secret_access_key='s3cr3t',
+                                          secrets_envelope='', secrets_version=0,
+                                          save=mock.Mock())
+        self.credentials = FakeCredentials([self.credential])
+        model = SimpleNamespace(objects=self.credentials)
+        self.apps = SimpleNamespace(get_model=lambda app_label, name: model)
+        self.schema_editor = SimpleNamespace(connection=SimpleNamespace(alias='default'))
+
+    def test_missing_key_file(self):
+        with override_settings(DDS2API_KMS_KEY_FILE=self.path):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'rotate_kms_key --key-only'):
+                self.migration.encrypt_secrets(self.apps, self.schema_editor)
+            self.credentials.clear()
+            self.migration.encrypt_secrets(self.apps, self.schema_editor)
+
+    def test_reverse(self):
+        kms.add_key(self.path)
+        with override_settings(DDS2API_KMS_KEY_FILE=self.path):
+            self.migration.encrypt_secrets(self.apps, self.schema_editor)
+            self.assertNotIn('s3cr3t', self.credential.secrets_envelope)
+            self.credential.access_key_id = self.credential.secret_access_key = ''
+            self.migration.decrypt_secrets(self.apps, self.schema_editor)
+        self.assertEqual((self.credential.access_key_id, self.credential.secret_access_key),
+                         ('AKIA', 's3cr3t'))
+
+
+class CredentialCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'kms.key')
+        kms.add_key(path)
+        settings_override = override_settings(DDS2API_KMS_KEY_FILE=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_credential(self, pk=1):
+        credential = StorageCredential(pk=pk)
+        credential.set_secrets('AKIA', 'secret')
+        return credential
+
+    def test_secrets_are_decrypted_once(self):
+        cache = CredentialCache(4, 60)
+        credential = self.make_credential()
+        entry = cache.get(credential)
+        self.assertEqual(entry.secrets, {'access_key_id': 'AKIA', 'secret_access_key': 'secret'})
+        credential.secrets_envelope = 'v1:gone'
+        self.assertIs(cache.get(credential), entry)
+
+    def test_new_secrets_miss(self):
+        cache = CredentialCache(4, 60)
+        credential = self.make_credential()
+        cache.get(credential)
+        credential.set_secrets('AKIB', 'rotated')
+        self.assertEqual(cache.get(credential).secrets['access_key_id'], 'AKIB')
+
+    def test_invalidate_and_expiry(self):
+        cache = CredentialCache(4, 60)
+        credential = self.make_credential()
+        entry = cache.get(credential)
+        cache.invalidate(credential.pk)
+        self.assertIsNot(cache.get(credential), entry)
+        cache = CredentialCache(4, 0)
+        entry = cache.get(credential)
+        self.assertIsNot(cache.get(credential), entry)
+
+
+class OutboxTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(tenant='outbox-tests')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.sink = FileSink(os.path.join(directory.name, 'outbox.jsonl'))
+
+    def published(self):
+        with open(self.sink.path) as sink_file:
+            return [json.loads(line) for line in sink_file]
+
+    def test_status_changes(self):
+        dataset = DataSet.objects.create(tenant=self.tenant, description='d', system_tag='',
+                                         file_fields=[], status='NEW')
+        dataset = DataSet.objects.get(pk=dataset.pk)
+        dataset.description = 'no event'
+        dataset.save()
+        dataset.status = 'PARSED'
+        dataset.save()
+        self.assertEqual(relay_batch(self.sink), 2)
+        created, changed = self.published()
+        self.assertEqual(created['topic'], 'dataset.created')
+        self.assertEqual(changed['topic'], 'dataset.changed')
+        self.assertEqual(changed['payload']['changed'], {'status': ['NEW', 'PARSED']})
+        self.assertEqual(relay_batch(self.sink), 0)
+
+    def test_balance_entry_inserts(self):
+        BalanceEntry.objects.create(tenant=self.tenant, channel_type='EMAIL', qty=10,
+                                    balance=10, origin_type='PAYMENT', origin_id='1')
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.topic, 'balanceentry.created')
+        self.assertEqual(event.tenant_id, self.tenant.pk)
+        self.assertEqual(event.payload['fields']['balance'], 10)
+
+    def test_failed_publish_is_retried(self):
+        BalanceEntry.objects.create(tenant=self.tenant, channel_type='EMAIL', qty=10,
+                                    balance=10, origin_type='PAYMENT', origin_id='1')
+
+        class FailingSink:
+            def publish(self, events):
+                raise OSError('sink down')
+
+        with self.assertRaises(OSError):
+            relay_batch(FailingSink())
+        self.assertEqual(relay_batch(self.sink), 1)
+
+
+TEST_RUNS = []
+
+
+@jobs.task('test.record', lane='bulk', max_attempts=2)
+def record_task(value, fail=False):
+    TEST_RUNS.append(value)
+    if fail:
+        raise ValueError(value)
+
+
+@override_settings(DDS2API_JOB_TENANT_CONCURRENCY=1)
+class JobQueueTests(TestCase):
+    """needs a local PostgreSQL"""
+
+    def setUp(self):
+        del TEST_RUNS[:]
+        self.tenant = Tenant.objects.create(tenant='job-tests')
+
+    def test_lanes(self):
+        jobs.enqueue('test.record', {'value': 'bulk'})
+        jobs.enqueue('test.record', {'value': 'preview'}, lane='interactive')
+        claimed = jobs.claim('worker', 2)
+        self.assertEqual([job.args['value'] for job in claimed], ['preview', 'bulk'])
+        self.assertEqual(jobs.claim('worker', 2), [])
+
+    def test_tenant_cap(self):
+        for value in range(3):
+            jobs.enqueue('test.record', {'value': value}, tenant=self.tenant)
+        jobs.enqueue('test.record', {'value': 'other'})
+        claimed = jobs.claim('worker', 4)
+        self.assertEqual([job.args['value'] for job in claimed], [0, 'other'])
+        jobs.run(claimed[0])
+        self.assertEqual([job.args['value'] for job in jobs.claim('worker', 4)], [1])
+
+    def test_capped_tenant_does_not_hide_the_others(self):
+        other = Tenant.objects.create(tenant='job-tests-other')
+        for value in range(30):
+            jobs.enqueue('test.record', {'value': value}, tenant=self.tenant,
+                         lane='interactive')
+        jobs.enqueue('test.record', {'value': 'other'}, tenant=other)
+        claimed = jobs.claim('worker', 2)
+        self.assertEqual([job.args['value'] for job in claimed], [0, 'other'])
+        self.assertEqual(jobs.claim('worker', 2), [])
+
+    def test_retry_then_fail(self):
+        job = jobs.enqueue('test.record', {'value': 1, 'fail': True})
+        jobs.run(jobs.claim('worker', 1)[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run(jobs.claim('worker', 1)[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('ValueError', job.last_error)
+        self.assertEqual(TEST_RUNS, [1, 1])
+
+    def test_expired_lease_is_taken_over(self):
+        jobs.enqueue('test.record', {'value': 1})
+        stale = jobs.claim('crashed', 1)[0]
+        Job.objects.filter(pk=stale.pk).update(run_after=timezone.now())
+        current = jobs.claim('worker', 1)[0]
+        jobs.run(stale)
+        jobs.run(current)
+        current.refresh_from_db()
+        # the outcome of the stale attempt is ignored
+        self.assertEqual((current.status, current.worker, current.attempts),
+                         (Job.DONE, 'worker', 2))
+
+    def test_next_due(self):
+        self.assertIsNone(jobs.next_due())
+        jobs.enqueue('test.record', {'value': 1}, delay=60, lane='bulk')
+        self.assertAlmostEqual(jobs.next_due(), 60, delta=5)
+        self.assertIsNone(jobs.next_due([jobs.LANES['interactive']]))
+        jobs.enqueue('test.record', {'value': 2}, lane='interactive')
+        # a running job is due when its lease runs out
+        jobs.claim('worker', 1, [jobs.LANES['interactive']])
+        self.assertAlmostEqual(jobs.next_due([jobs.LANES['interactive']]),
+                               settings.DDS2API_JOB_VISIBILITY_SECONDS, delta=5)
+
+
+class SlidingWindowTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 6000.0
+        self.store = LocalCounterStore(clock=lambda: self.now)
+
+    def test_limit_within_window(self):
+        for _ in range(3):
+            self.assertIsNone(self.store.acquire(['a'], 3, 60))
+        self.assertEqual(self.store.acquire(['a'], 3, 60), 60.0)
+        self.assertIsNone(self.store.acquire(['b'], 3, 60))
+
+    def test_previous_window_is_weighted(self):
+        for _ in range(4):
+            self.store.acquire(['a'], 4, 60)
+        # 2/3 of the previous window still overlaps the last minute
+        self.now += 80
+        self.assertIsNone(self.store.acquire(['a'], 4, 60))
+        self.assertIsNone(self.store.acquire(['a'], 4, 60))
+        wait = self.store.acquire(['a'], 4, 60)
+        self.assertAlmostEqual(wait, 10.0)
+        self.now += wait + 0.001
+        self.assertIsNone(self.store.acquire(['a'], 4, 60))
+
+    def test_all_keys_or_none(self):
+        self.store.acquire(['tenant-1'], 1, 60)
+        self.assertIsNotNone(self.store.acquire(['tenant-1', 'tenant-2'], 1, 60))
+        self.assertIsNone(self.store.acquire(['tenant-2'], 1, 60))
+
+
+class FakeRedis:
+    """Runs ACQUIRE_SCRIPT as the Lua script does, on a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    @classmethod
+    def from_url(cls, url):  # pylint: disable=W0613
+        return cls()
+
+    def register_script(self, script):
+        self.script = script
+
+        def run(keys, args):
+            weight, limit = float(args[0]), int(args[1])
+            counts = [self.values.get(key, 0) for key in keys]
+            allowed = all(previous * weight + current < limit
+                          for current, previous in zip(counts[::2], counts[1::2]))
+            if allowed:
+                for key in keys[::2]:
+                    self.values[key] = self.values.get(key, 0) + 1
+            return [int(allowed), counts]
+        return run
+
+
+class RedisCounterStoreTests(SlidingWindowTests):
+
+    def setUp(self):
+        self.now = 6000.0
+        with mock.patch.dict('sys.modules', {'redis': SimpleNamespace(Redis=FakeRedis)}):
+            self.store = RedisCounterStore('redis://fake', clock=lambda: self.now)
+
+    def test_script(self):
+        self.assertIs(self.store._client.script, ACQUIRE_SCRIPT)  # pylint: disable=W0212
+
+    def test_keys_of_the_windows(self):
+        self.store.acquire(['a'], 3, 60)
+        self.assertEqual(self.store._client.values, {'a:100': 1})  # pylint: disable=W0212
+
+
+class ThrottleProbeViewSet(viewsets.ViewSet):
+    authentication_classes = ()
+    permission_classes = ()
+    throttle_classes = (TenantRateThrottle,)
+    tenant_throttle_scopes = {'create': 'probe-create'}
+
+    def list(self, request):
+        return Response()
+
+    def create(self, request):
+        return Response()
+
+
+PROBE_RATES = {'default': '2/minute', 'probe-create': '1/minute'}
+
+
+@override_settings(DDS2API_JWT_STATELESS=True)
+class TenantRateThrottleTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('dds2api.throttling._store', LocalCounterStore(lambda: 6000.0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.view = ThrottleProbeViewSet.as_view({'get': 'list', 'post': 'create'})
+
+    def call(self, method, data=None):
+        request = getattr(APIRequestFactory(), method)('/probe/', data, format='json')
+        token = {'user_id': 7, PERMS_CLAIM: compile_permissions([1, 2], []).to_claim()}
+        force_authenticate(request, SimpleNamespace(id=7, is_authenticated=True), token)
+        return self.view(request)
+
+    def test_scopes_of_the_viewsets(self):
+        for _, viewset, _ in router.registry:
+            for action_name, scope in getattr(viewset, 'tenant_throttle_scopes', {}).items():
+                self.assertTrue(hasattr(viewset, action_name), (viewset, action_name))
+                self.assertIn(scope, settings.DDS2API_TENANT_THROTTLE_RATES)
+
+    @override_settings(DDS2API_TENANT_THROTTLE_RATES=PROBE_RATES)
+    def test_create_is_charged_to_its_tenant(self):
+        self.assertEqual(self.call('post', {'tenant': 1}).status_code, 200)
+        response = self.call('post', {'tenant': 1})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(self.call('post', {'tenant': 2}).status_code, 200)
+        # no tenant named: charged to every tenant of the user
+        self.assertEqual(self.call('post', {}).status_code, 429)
+
+    @override_settings(DDS2API_TENANT_THROTTLE_RATES=PROBE_RATES)
+    def test_other_actions_share_the_default_scope(self):
+        self.assertEqual(self.call('get').status_code, 200)
+        self.assertEqual(self.call('get').status_code, 200)
+        self.assertEqual(self.call('get').status_code, 429)
+        self.assertEqual(self.call('post', {'tenant': 1}).status_code, 200)
+
+
+class BenchmarkTests(SimpleTestCase):
+
+    def test_compare(self):
+        baseline = {'api.tag.list.p95_ms': 10.0, 'api.tag.list.queries': 3,
+                    'pipeline.render.rows_per_sec': 1000.0, 'startup.web.setup_ms': 400.0}
+        results = {'api.tag.list.p95_ms': 11.0, 'api.tag.list.queries': 4,
+                   'pipeline.render.rows_per_sec': 800.0, 'startup.web.setup_ms': 300.0,
+                   'api.dataset.list.p95_ms': 50.0}
+        self.assertEqual(compare(results, baseline, 0.15),
+                         [('api.tag.list.queries', 3, 4, 1 / 3),
+                          ('pipeline.render.rows_per_sec', 1000.0, 800.0, 0.2)])
+        self.assertEqual(compare(baseline, baseline, 0), [])
+
+    def test_compare_scales_by_host_speed(self):
+        baseline = {'host.calibration_ms': 100.0, 'startup.web.setup_ms': 400.0,
+                    'pipeline.render.rows_per_sec': 1000.0, 'api.tag.list.queries': 3}
+        slower = {'host.calibration_ms': 200.0, 'startup.web.setup_ms': 780.0,
+                  'pipeline.render.rows_per_sec': 520.0, 'api.tag.list.queries': 3}
+        self.assertEqual(compare(slower, baseline, 0.05), [])
+        slower['api.tag.list.queries'] = 4
+        slower['startup.web.setup_ms'] = 1000.0
+        self.assertEqual([metric for metric, *_ in compare(slower, baseline, 0.05)],
+                         ['api.tag.list.queries', 'startup.web.setup_ms'])
+
+    def test_committed_baseline(self):
+        baseline = load_baseline(os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'))
+        self.assertTrue(baseline)
+        self.assertEqual(compare(baseline, baseline, 0), [])
+
+    @override_settings(REST_FRAMEWORK={'PAGE_SIZE': 10})
+    def test_deep_page(self):
+        user = SimpleNamespace(username='bench-0')
+        with mock.patch('dds2api.benchmarks.api.BalanceEntry') as model:
+            count = model.objects.filter.return_value.count
+            for entries, page in ((100000, 100), (995, 100), (991, 100), (250, 25), (11, 2),
+                                  (10, None), (0, None)):
+                count.return_value = entries
+                self.assertEqual(benchmark_api.deep_page(user), page, entries)
+
+
+class TimingWheelTests(SimpleTestCase):
+
+    def test_timers_expire_on_their_tick(self):
+        wheel = TimingWheel(0, tick=0.1, size=4, levels=2)
+        for key, when in (('soon', 0.25), ('level1', 1.05), ('overflow', 7.5)):
+            wheel.add(key, when)
+        self.assertEqual(wheel.advance(0.2), [])
+        self.assertEqual(wheel.advance(0.3), [('soon', None)])
+        self.assertEqual(wheel.advance(1.0), [])
+        self.assertEqual(wheel.advance(1.1), [('level1', None)])
+        self.assertEqual(wheel.advance(7.4), [])
+        self.assertEqual(wheel.advance(7.5), [('overflow', None)])
+
+    def test_replace_remove_and_overdue(self):
+        wheel = TimingWheel(10, tick=1, size=8)
+        wheel.add('a', 15, 'first')
+        wheel.add('a', 12, 'second')
+        wheel.add('b', 13)
+        wheel.remove('b')
+        wheel.add('late', 3)
+        self.assertEqual(wheel.advance(11), [('late', None)])
+        self.assertEqual(wheel.advance(20), [('a', 'second')])
+        self.assertEqual(len(wheel), 0)
+
+
+class ScheduleTests(SimpleTestCase):
+
+    def at(self, *args, zone='UTC'):
+        return pytz.timezone(zone).localize(datetime(*args))
+
+    def test_one_off(self):
+        first = self.at(2026, 1, 1, 9)
+        self.assertEqual(next_run(first, '', 'UTC'), first)
+        self.assertIsNone(next_run(first, '', 'UTC', first))
+
+    def test_monthly_keeps_the_day(self):
+        first = self.at(2026, 1, 31, 9)
+        self.assertEqual(next_run(first, 'MONTHLY', 'UTC', first), self.at(2026, 2, 28, 9))
+        self.assertEqual(next_run(first, 'MONTHLY', 'UTC', self.at(2026, 2, 28, 9)),
+                         self.at(2026, 3, 31, 9))
+
+    def test_daily_follows_the_wall_clock(self):
+        zone = 'America/Santiago'
+        first = self.at(2026, 3, 30, 9, zone=zone)
+        # clocks go back an hour on 2026-04-05
+        after = self.at(2026, 4, 5, 9, zone=zone)
+        self.assertEqual(next_run(first, 'DAILY', zone, after), self.at(2026, 4, 6, 9, zone=zone))
+        self.assertEqual(after - first, timedelta(days=6, hours=1))
+
+    def test_hourly_skips_missed_runs(self):
+        first = self.at(2026, 1, 1, 9)
+        self.assertEqual(next_run(first, 'HOURLY', 'UTC', self.at(2026, 1, 1, 12, 30)),
+                         self.at(2026, 1, 1, 13))
@@ -0,0 +1,193 @@
+"""
+Tenant rate limits
+
+TenantRateThrottle charges requests to tenants rather than users, so that
+all the users (and tokens) of a tenant share its budget. A request that
+names a tenant (creates) is charged to it, others to every tenant of the
+user. Budgets are DDS2API_TENANT_THROTTLE_RATES entries, by scope: a view
+maps its actions to scopes with tenant_throttle_scopes, the rest use
+'default'.
+
+Windows slide: the count is the one of the current fixed window plus the
+previous one weighted by how much of it still overlaps the last window
+length, which needs two counters per key instead of a log of requests.
+The counters live in Redis when DDS2API_THROTTLE_STORE is a redis:// URL,
+otherwise in process memory, which limits each process on its own.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+from .permissions import user_tenants
+
+KEY_PREFIX = 'dds2api:throttle:'
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# counters kept by LocalCounterStore before the stale ones are dropped
+LOCAL_MAX_KEYS = 10000
+
+# KEYS: current and previous window counter of every key, ARGV: weight of
+# the previous window, limit, window seconds. Increments all the keys or
+# none, returns the counters that were read
+ACQUIRE_SCRIPT = """
+local counts = {}
+local allowed = 1
+for index = 1, #KEYS, 2 do
+    local current = tonumber(redis.call('GET', KEYS[index]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[index + 1]) or '0')
+    counts[#counts + 1] = current
+    counts[#counts + 1] = previous
+    if previous * tonumber(ARGV[1]) + current >= tonumber(ARGV[2]) then
+        allowed = 0
+    end
+end
+if allowed == 1 then
+    for index = 1, #KEYS, 2 do
+        redis.call('INCR', KEYS[index])
+        redis.call('EXPIRE', KEYS[index], 2 * tonumber(ARGV[3]))
+    end
+end
+return {allowed, counts}
+"""
+
+
+def parse_rate(rate):
+    """(requests, seconds) of a rate like 100/minute"""
+    requests, period = rate.split('/')
+    return int(requests), DURATIONS[period[0]]
+
+
+def window_wait(current, previous, elapsed, limit, window):
+    """Seconds until a window whose counters are current and previous, and
+       that is elapsed seconds old, lets one more request through"""
+    if limit <= 0:
+        return float(window)
+    if current < limit:
+        if not previous:
+            return 0.0
+        # previous * (1 - t / window) + current < limit
+        return max(0.0, (1 - (limit - current) / previous) * window - elapsed)
+    # once the window rolls over current is the previous one
+    return window - elapsed + (1 - limit / current) * window
+
+
+class LocalCounterStore:
+    """Counters of this process"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, keys, limit, window):
+        """None when a request is allowed on all keys and was counted,
+           otherwise the seconds to wait"""
+        number, elapsed = divmod(self.clock(), window)
+        number = int(number)
+        weight = 1 - elapsed / window
+        with self._lock:
+            counters = []
+            for key in keys:
+                counter = self._counters.get(key)
+                if counter is None or counter[0] < number - 1:
+                    counter = [number, 0, 0]
+                elif counter[0] == number - 1:
+                    counter = [number, 0, counter[1]]
+                counters.append(counter)
+            waits = [window_wait(current, previous, elapsed, limit, window)
+                     for _, current, previous in counters
+                     if previous * weight + current >= limit]
+            if waits:
+                return max(waits)
+            for key, counter in zip(keys, counters):
+                counter[1] += 1
+                self._counters[key] = counter
+            if len(self._counters) > LOCAL_MAX_KEYS:
+                self._counters = {key: counter for key, counter in self._counters.items()
+                                  if counter[0] >= number - 1}
+        return None
+
+
+class RedisCounterStore:
+    """Counters shared by every process, updated by a script so that a
+       check and its increment are atomic"""
+
+    def __init__(self, url, clock=time.time):
+        try:
+            import redis  # optional, only needed with a redis:// store
+        except ImportError:
+            raise ImproperlyConfigured('DDS2API_THROTTLE_STORE needs the redis package')
+        self.clock = clock
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(ACQUIRE_SCRIPT)
+
+    def acquire(self, keys, limit, window):
+        number, elapsed = divmod(self.clock(), window)
+        number = int(number)
+        redis_keys = []
+        for key in keys:
+            redis_keys += [f'{key}:{number}', f'{key}:{number - 1}']
+        allowed, counts = self._script(keys=redis_keys,
+                                       args=[1 - elapsed / window, limit, window])
+        if allowed:
+            return None
+        return max(window_wait(current, previous, elapsed, limit, window)
+                   for current, previous in zip(counts[::2], counts[1::2]))
+
+
+_store = None  # pylint: disable=C0103
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store  # pylint: disable=W0603,C0103
+    with _store_lock:
+        if _store is None:
+            url = settings.DDS2API_THROTTLE_STORE
+            _store = RedisCounterStore(url) if url else LocalCounterStore()
+        return _store
+
+
+def throttled_tenants(request):
+    tenants = user_tenants(request)
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and 'tenant' in request.data:
+        try:
+            tenant_id = int(request.data['tenant'])
+        except (TypeError, ValueError):
+            return tenants
+        if tenant_id in tenants:
+            return [tenant_id]
+    return tenants
+
+
+def charge_tenants(scope, tenant_ids):
+    """None when the budget of scope lets one more request of tenant_ids
+       through (and counts it), otherwise the seconds to wait"""
+    rate = settings.DDS2API_TENANT_THROTTLE_RATES.get(scope)
+    if not rate or not tenant_ids:
+        return None
+    limit, window = parse_rate(rate)
+    keys = [f'{KEY_PREFIX}{scope}:{tenant_id}' for tenant_id in sorted(tenant_ids)]
+    return get_store().acquire(keys, limit, window)
+
+
+class TenantRateThrottle(BaseThrottle):
+    """Shared per tenant budget of the scope of the view action"""
+
+    def __init__(self):
+        self._wait = None
+
+    def allow_request(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return True
+        scope = getattr(view, 'tenant_throttle_scopes', {}).get(
+            getattr(view, 'action', None), 'default')
+        self._wait = charge_tenants(scope, throttled_tenants(request))
+        return self._wait is None
+
+    def wait(self):
+        return math.ceil(self._wait) if self._wait is not None else None
@@ -0,0 +1,84 @@
+"""
+Hierarchical timing wheel
+
+Timers are kept in slots of tick seconds. Level 0 has a slot per tick for
+the next `size` ticks, each higher level has slots `size` times wider, and
+when a lower level wraps around the next slot of the level above is
+cascaded down. Adding, removing and expiring a timer is O(1) however many
+timers are kept; timers beyond the last level wait in an overflow set
+that is cascaded like a level.
+"""
+
+import math
+
+# floating point slack when times are turned into ticks, 0.3 / 0.1 is
+# 2.9999999999999996
+EPSILON = 1e-6
+
+
+class TimingWheel:
+
+    def __init__(self, start, tick=0.1, size=64, levels=3):
+        self.tick = tick
+        self.size = size
+        self.levels = [[{} for _ in range(size)] for _ in range(levels)]
+        self.overflow = {}
+        self.current = math.floor(start / tick + EPSILON)
+        # key -> (tick, slot dict)
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _place(self, key, tick, value):
+        delta = tick - self.current
+        for level, slots in enumerate(self.levels):
+            if delta < self.size ** (level + 1):
+                slot = slots[(tick // self.size ** level) % self.size]
+                break
+        else:
+            slot = self.overflow
+        slot[key] = (tick, value)
+        self._timers[key] = (tick, slot)
+
+    def add(self, key, when, value=None):
+        """Expire key at when (seconds, same clock as start), replacing its
+           current timer"""
+        self.remove(key)
+        # the current tick has expired already, overdue timers take the next
+        self._place(key, max(math.ceil(when / self.tick - EPSILON), self.current + 1), value)
+
+    def remove(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            del timer[1][key]
+
+    def _cascade(self, slot):
+        timers = list(slot.items())
+        slot.clear()
+        for key, (tick, value) in timers:
+            self._place(key, tick, value)
+
+    def advance(self, now):
+        """(key, value) of the timers expired up to now, in tick order"""
+        target = math.floor(now / self.tick + EPSILON)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            # cascade the widest levels first, so that their timers reach
+            # level 0 in the same step when due
+            if self.current % self.size ** len(self.levels) == 0:
+                self._cascade(self.overflow)
+            for level in range(len(self.levels) - 1, 0, -1):
+                if self.current % self.size ** level == 0:
+                    self._cascade(self.levels[level][(self.current // self.size ** level)
+                                                     % self.size])
+            slot = self.levels[0][self.current % self.size]
+            for key, (_, value) in list(slot.items()):
+                del self._timers[key]
+                expired.append((key, value))
+            slot.clear()
+        return expired
@@ -10,6 +10,9 @@ router.register(r'profile',
                 base_name='Profile')
 router.register(r'tenant',
                 views.TenantViewSet)
+router.register(r'role',
+                views.RoleViewSet,
+                base_name='Role')
 router.register(r'balance-entry',
                 views.BalanceEntryViewSet,
                 base_name='BalanceEntry')
@@ -34,11 +37,26 @@ router.register(r'broadcast',
 router.register(r'dataset',
                 views.DataSetViewSet,
                 base_name='DataSet')
+router.register(r'suppression',
+                views.SuppressionViewSet,
+                base_name='Suppression')
+router.register(r'archive',
+                views.ArchiveViewSet,
+                base_name='Archive')
+router.register(r'balance-summary',
+                views.BalanceSummaryViewSet,
+                base_name='BalanceSummary')
+router.register(r'analytics/spend',
+                views.SpendAnalyticsViewSet,
+                base_name='SpendAnalytics')
+router.register(r'analytics/broadcasts',
+                views.BroadcastAnalyticsViewSet,
+                base_name='BroadcastAnalytics')
 
 
 urlpatterns = [
     # jwt endpoints
-    path('token/', jwt_views.TokenObtainPairView.as_view(),
+    path('token/', views.TenantTokenObtainPairView.as_view(),
          name='token_obtain_pair'),
     path('token/refresh/', jwt_views.TokenRefreshView.as_view(),
          name='token_refresh'),
@@ -1,10 +1,20 @@
-from rest_framework import viewsets, permissions
-#from rest_framework.decorators import action
-#from rest_framework.response import Response
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import TemplateSyntaxError
+from rest_framework import mixins, viewsets, permissions, status, exceptions
+from rest_framework_simplejwt import views as jwt_views
+from dds2be.db_routers import replica_reads, allow_replica_reads
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from .models import (
     Profile,
     Tenant,
-    # Role,
+    Role,
     BalanceEntry,
     Tag,
     StorageCredential,
@@ -13,26 +23,103 @@ from .models import (
     Attachment,
     Broadcast,
     DataSet,
+    DataSetDelta,
+    DataSetStats,
+    DataSetVersion,
+    Suppression,
+    Archive,
+    BalanceSummary,
+    BalanceRollup,
+    BroadcastRollup,
 )
 from .serializers import (
+    TenantTokenObtainPairSerializer,
     ProfileSerializer,
     TenantSerializer,
-    # RoleSerializer,
+    RoleSerializer,
     BalanceEntrySerializer,
     TagSerializer,
     StorageCredentialSerializer,
     DomainSerializer,
     SenderSerializer,
+    SenderConfirmSerializer,
     AttachmentSerializer,
     BroadcastSerializer,
     DataSetSerializer,
+    DataSetDeltaSerializer,
+    DataSetVersionSerializer,
+    TestSendSerializer,
+    SuppressionSerializer,
+    BroadcastPlanSerializer,
+    BroadcastPreviewSerializer,
+    ArchiveSerializer,
+    BalanceSummarySerializer,
+    BalanceRollupSerializer,
+    BroadcastRollupSerializer,
+    AnalyticsQuerySerializer,
 )
 
 from .permissions import (
     UserIsTenantMember,
     IsOwner,
-    user_tenants
+    action_tenants,
 )
+from .rbac import PERM_TEMPLATES
+from .aio import HTTPError
+from .attachments import AttachmentSourceError, content_disposition
+from .messages import render_email
+from .planner import default_recipient_field, plan_broadcast
+from .previews import sample_rows
+from .retention import archived_rows, row_filters
+from .tags import TagExpressionError, select_broadcasts
+from .senders import TokenRateLimited, confirm_token, expire_token, issue_token
+from .services import fetch_attachment, send_sender_verification, send_test_email
+
+REPLICA_PIN_KEY = 'dds2api:db-pin:{}'
+
+
+class ReplicaReadMixin:
+    """
+    Serve the replica_actions of a viewset from a read replica. After a
+    write the user reads from the primary for DDS2API_REPLICA_PIN_SECONDS,
+    the pin is kept in the default cache, which must be shared by the
+    processes (see dds2api.checks). Anonymous requests are never pinned.
+    DDS2API_REPLICA_ACTIONS = {'ViewSetName': [actions]} overrides
+    replica_actions.
+    """
+    replica_actions = ()
+
+    def get_replica_actions(self):
+        overrides = getattr(settings, 'DDS2API_REPLICA_ACTIONS', {})
+        return overrides.get(type(self).__name__, self.replica_actions)
+
+    @staticmethod
+    def pin_key(request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return REPLICA_PIN_KEY.format(user.id)
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(False) as state:
+            response = super().dispatch(request, *args, **kwargs)
+        key = self.pin_key(self.request)
+        if state.wrote and key is not None:
+            cache.set(key, True, settings.DDS2API_REPLICA_PIN_SECONDS)
+        return response
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = self.pin_key(request)
+        allow_replica_reads(
+            request.method in permissions.SAFE_METHODS and
+            self.action in self.get_replica_actions() and
+            not (key is not None and cache.get(key))
+        )
+
+
+class TenantTokenObtainPairView(jwt_views.TokenObtainPairView):
+    serializer_class = TenantTokenObtainPairSerializer
 
 
 class ProfileViewSet(viewsets.ModelViewSet):
@@ -40,7 +127,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, IsOwner)
 
     def get_queryset(self):
-        return Profile.objects.filter(user=self.request.user)
+        return Profile.objects.filter(user_id=self.request.user.id)
 
 
 class TenantViewSet(viewsets.ModelViewSet):
@@ -49,20 +136,30 @@ class TenantViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
 
 
-class BalanceEntryViewSet(viewsets.ModelViewSet):
+class RoleViewSet(viewsets.ModelViewSet):
+    serializer_class = RoleSerializer
+    permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
+
+    def get_queryset(self):
+        return Role.objects.filter(tenant__in=action_tenants(self.request, self))
+
+
+class BalanceEntryViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    replica_actions = ('list', 'retrieve')
     serializer_class = BalanceEntrySerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return BalanceEntry.objects.filter(tenant__in=user_tenants(self.request))
+        return BalanceEntry.objects.filter(tenant__in=action_tenants(self.request, self))
 
 
 class TagViewSet(viewsets.ModelViewSet):
+    write_permission = PERM_TEMPLATES
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return Tag.objects.filter(tenant__in=user_tenants(self.request))
+        return Tag.objects.filter(tenant__in=action_tenants(self.request, self))
 
 
 class StorageCredentialViewSet(viewsets.ModelViewSet):
@@ -70,7 +167,7 @@ class StorageCredentialViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return StorageCredential.objects.filter(tenant__in=user_tenants(self.request))
+        return StorageCredential.objects.filter(tenant__in=action_tenants(self.request, self))
 
 
 class DomainViewSet(viewsets.ModelViewSet):
@@ -78,36 +175,293 @@ class DomainViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return Domain.objects.filter(tenant__in=user_tenants(self.request))
+        return Domain.objects.filter(tenant__in=action_tenants(self.request, self))
 
 
 class SenderViewSet(viewsets.ModelViewSet):
+    # ScopedRateThrottle only applies to confirm
+    throttle_scope = 'sender-confirm'
     serializer_class = SenderSerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return Sender.objects.filter(tenant__in=user_tenants(self.request))
+        return Sender.objects.filter(tenant__in=action_tenants(self.request, self))
+
+    @action(detail=True, methods=['post'])
+    def verify(self, request, pk=None):
+        """Issue a verification token and mail it to the sender"""
+        sender = self.get_object()
+        try:
+            token = issue_token(sender)
+        except TokenRateLimited as exc:
+            raise exceptions.Throttled(exc.wait)
+        async_to_sync(send_sender_verification)(sender, token)
+        return Response({'detail': 'Verification code sent.'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'],
+            permission_classes=(permissions.AllowAny,),
+            throttle_classes=(ScopedRateThrottle,))
+    def confirm(self, request):
+        """Verify the sender of a token, the recipient of the mail doesn't
+           need to be logged in"""
+        serializer = SenderConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if confirm_token(serializer.validated_data['token']) is None:
+            raise exceptions.ValidationError({'token': 'Invalid or expired token.'})
+        return Response({'detail': 'Sender verified.'})
+
+    @action(detail=True, methods=['post'])
+    def expire(self, request, pk=None):
+        """Invalidate the pending verification token"""
+        expire_token(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class AttachmentViewSet(viewsets.ModelViewSet):
+    write_permission = PERM_TEMPLATES
     serializer_class = AttachmentSerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return Attachment.objects.filter(tenant__in=user_tenants(self.request))
+        return Attachment.objects.filter(tenant__in=action_tenants(self.request, self))
 
+    @action(detail=True)
+    def preview(self, request, pk=None):
+        """Content of the attachment for the row given in the query string.
+           Buffered here, dds2be.asgi streams it"""
+        attachment = self.get_object()
+        try:
+            filename, content, mimetype = async_to_sync(fetch_attachment)(
+                attachment, request.query_params.dict(), supplied_row=True)
+        except AttachmentSourceError as exc:
+            raise exceptions.ValidationError({'detail': str(exc)})
+        except (HTTPError, OSError, asyncio.TimeoutError) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        response = HttpResponse(content, content_type=mimetype)
+        response['Content-Disposition'] = content_disposition(filename)
+        return response
 
-class BroadcastViewSet(viewsets.ModelViewSet):
+
+class BroadcastViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    replica_actions = ('list', 'retrieve', 'plan', 'preview')
+    tenant_throttle_scopes = {
+        'create': 'broadcast-create',
+        'test_send': 'broadcast-test-send',
+    }
+    write_permission = PERM_TEMPLATES
     serializer_class = BroadcastSerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return Broadcast.objects.filter(tenant__in=user_tenants(self.request))
+        return Broadcast.objects.filter(tenant__in=action_tenants(self.request, self))
+
+    def list(self, request, *args, **kwargs):
+        expression = request.query_params.get('tags')
+        if not expression:
+            return super().list(request, *args, **kwargs)
+        # ?tags=vip AND NOT churned
+        try:
+            selected = select_broadcasts(action_tenants(request, self), expression)
+        except TagExpressionError as exc:
+            raise exceptions.ValidationError({'tags': str(exc)})
+        # the page is cut from the bitmap, newest first, and only its ids
+        # are looked up
+        ids = sorted(selected, reverse=True)
+        page = self.paginate_queryset(ids)
+        broadcasts = self.get_queryset().in_bulk(ids if page is None else page)
+        broadcasts = [broadcasts[pk] for pk in (ids if page is None else page)
+                      if pk in broadcasts]
+        serializer = self.get_serializer(broadcasts, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def plan(self, request, pk=None):
+        """Dry run of sending the broadcast to ?dataset=<id>, from the
+           DataSet statistics. ?recipient_field= defaults to email or
+           mobile_number depending on the channel"""
+        broadcast = self.get_object()
+        serializer = BroadcastPlanSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        dataset = (DataSet.objects
+                   .filter(pk=serializer.validated_data['dataset'], tenant_id=broadcast.tenant_id)
+                   .select_related('stats')
+                   .first())
+        if dataset is None:
+            raise exceptions.ValidationError({'dataset': 'Not found.'})
+        try:
+            stats = dataset.stats
+        except DataSetStats.DoesNotExist:
+            return Response({'detail': 'DataSet statistics are not computed yet.'},
+                            status=status.HTTP_409_CONFLICT)
+        recipient_field = serializer.validated_data.get(
+            'recipient_field', default_recipient_field(broadcast.channel_type))
+        return Response(plan_broadcast(broadcast, stats, recipient_field))
 
+    @action(detail=True, methods=['get', 'post'])
+    def preview(self, request, pk=None):
+        """Render the broadcast for ?rows= random rows or the ?row= numbers
+           of ?dataset=. A POST renders its email_subject / email_body
+           instead of the saved ones"""
+        broadcast = self.get_object()
+        data = request.query_params if request.method == 'GET' else request.data
+        serializer = BroadcastPreviewSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        dataset = DataSet.objects.filter(pk=options['dataset'],
+                                         tenant_id=broadcast.tenant_id).first()
+        if dataset is None:
+            raise exceptions.ValidationError({'dataset': 'Not found.'})
+        if request.method == 'POST':
+            broadcast.email_subject = options.get('email_subject', broadcast.email_subject)
+            broadcast.email_body = options.get('email_body', broadcast.email_body)
+        rows = sample_rows.get(dataset)
+        if 'row' in options:
+            numbered = rows.numbers(options['row'])
+        else:
+            numbered = [(None, row) for row in rows.random(options['rows'])]
+        try:
+            rendered = [dict(zip(('subject', 'body'), render_email(broadcast, row)),
+                             number=number, row=row)
+                        for number, row in numbered]
+        except TemplateSyntaxError as exc:
+            raise exceptions.ValidationError(str(exc))
+        return Response(rendered)
 
-class DataSetViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'], url_path='test-send')
+    def test_send(self, request, pk=None):
+        broadcast = self.get_object()
+        serializer = TestSendSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            async_to_sync(send_test_email)(broadcast, serializer.validated_data['to'],
+                                           serializer.validated_data['row'])
+        except AttachmentSourceError as exc:
+            raise exceptions.ValidationError({'row': str(exc)})
+        except (HTTPError, OSError, asyncio.TimeoutError) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({'detail': 'Test e-mail sent.'}, status=status.HTTP_202_ACCEPTED)
+
+
+class DataSetViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    replica_actions = ('list', 'retrieve')
+    tenant_throttle_scopes = {
+        'create': 'dataset-upload',
+        'update': 'dataset-upload',
+        'partial_update': 'dataset-upload',
+        'add_delta': 'dataset-upload',
+    }
     serializer_class = DataSetSerializer
     permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
 
     def get_queryset(self):
-        return DataSet.objects.filter(tenant__in=user_tenants(self.request))
+        return DataSet.objects.filter(tenant__in=action_tenants(self.request, self))
+
+    @action(detail=True)
+    def deltas(self, request, pk=None):
+        """Rows to append or, by the key field, upsert, uploaded in the
+           format of the DataSet file and applied in the background"""
+        dataset = self.get_object()
+        page = self.paginate_queryset(DataSetDelta.objects.filter(dataset=dataset))
+        return self.get_paginated_response(DataSetDeltaSerializer(page, many=True).data)
+
+    @deltas.mapping.post
+    def add_delta(self, request, pk=None):
+        dataset = self.get_object()
+        serializer = DataSetDeltaSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(tenant=dataset.tenant, dataset=dataset)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True)
+    def versions(self, request, pk=None):
+        """Snapshots of the DataSet, a Broadcast pins one with
+           dataset_version"""
+        dataset = self.get_object()
+        page = self.paginate_queryset(DataSetVersion.objects.filter(dataset=dataset))
+        return self.get_paginated_response(DataSetVersionSerializer(page, many=True).data)
+
+
+class SuppressionViewSet(viewsets.ModelViewSet):
+    serializer_class = SuppressionSerializer
+    permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
+
+    def get_queryset(self):
+        return Suppression.objects.filter(tenant__in=action_tenants(self.request, self))
+
+
+class ArchiveViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ArchiveSerializer
+    permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
+
+    def get_queryset(self):
+        return Archive.objects.filter(tenant__in=action_tenants(self.request, self))
+
+    @action(detail=True)
+    def rows(self, request, pk=None):
+        """The archived rows as JSON lines, ?field=value keeps the rows
+           whose field has that value, for the fields of the archive"""
+        archive = self.get_object()
+        filters = row_filters(archive, request.query_params)
+        lines = (json.dumps(row).encode('utf-8') + b'\n'
+                 for row in archived_rows(archive)
+                 if all(str(row.get(name)) == value for name, value in filters.items()))
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+class BalanceSummaryViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = BalanceSummarySerializer
+    permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
+
+    def get_queryset(self):
+        return BalanceSummary.objects.filter(tenant__in=action_tenants(self.request, self))
+
+
+class RollupViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Points of a dashboard series, ?granularity=hour|day|month (day),
+       ?since= and ?until= bound the buckets, ?tenant= picks one tenant.
+       The newest DDS2API_ANALYTICS_MAX_POINTS points, oldest first. Reads
+       the rollups only"""
+    permission_classes = (permissions.IsAuthenticated, UserIsTenantMember)
+    pagination_class = None
+    model = None
+    # query params that filter the rollups as they are
+    filter_fields = ()
+
+    def get_queryset(self):
+        query = AnalyticsQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        options = query.validated_data
+        tenants = action_tenants(self.request, self)
+        if 'tenant' in options:
+            tenants = [tenant for tenant in tenants if tenant == options['tenant']]
+        queryset = self.model.objects.filter(tenant__in=tenants,
+                                             granularity=options['granularity'])
+        if 'since' in options:
+            queryset = queryset.filter(bucket__gte=options['since'])
+        if 'until' in options:
+            queryset = queryset.filter(bucket__lt=options['until'])
+        for name in self.filter_fields:
+            if name in options:
+                queryset = queryset.filter(**{name: options[name]})
+        return queryset.order_by('-bucket', '-pk')[:settings.DDS2API_ANALYTICS_MAX_POINTS]
+
+    def list(self, request, *args, **kwargs):
+        points = list(self.get_queryset())
+        points.reverse()
+        return Response(self.get_serializer(points, many=True).data)
+
+
+class SpendAnalyticsViewSet(RollupViewSet):
+    """Balance entries per channel over time"""
+    serializer_class = BalanceRollupSerializer
+    model = BalanceRollup
+    filter_fields = ('channel_type',)
+
+
+class BroadcastAnalyticsViewSet(RollupViewSet):
+    """Sends, delivery and bounce rates of broadcasts over time"""
+    serializer_class = BroadcastRollupSerializer
+    model = BroadcastRollup
+    filter_fields = ('broadcast',)
@@ -0,0 +1,22 @@
+"""
+ASGI config for dds2be project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The endpoints in dds2api.asgi_views are served natively, the rest of the
+project runs as the WSGI application in asgiref's thread pool.
+
+    uvicorn dds2be.asgi:application
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dds2be.settings')
+
+wsgi_application = get_wsgi_application()  # pylint: disable=C0103
+
+from dds2api.asgi_views import asgi_application  # noqa: E402 pylint: disable=C0413
+
+application = asgi_application(WsgiToAsgi(wsgi_application))  # pylint: disable=C0103
@@ -0,0 +1,181 @@
+"""
+PostgreSQL backend with connection health checks and an optional
+client-side connection pool.
+
+Two extra keys are read from the DATABASES entry:
+
+    CONN_HEALTH_CHECKS  check a persistent connection with ``SELECT 1``
+                        the first time it is used in a request.
+    POOL                dict with MIN_SIZE, MAX_SIZE, TIMEOUT (seconds to
+                        wait for a free connection) and CHECK_INTERVAL
+                        (idle seconds after which a pooled connection is
+                        checked before being handed out). When MAX_SIZE is
+                        set, closing a connection returns it to a per
+                        process pool instead of disconnecting.
+"""
+
+import os
+import threading
+import time
+
+from django.db.backends.postgresql import base, creation
+from psycopg2 import extensions, pool as pg_pool
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Thread safe pool that waits for a free slot and checks the health
+       of connections that were idle for more than check_interval"""
+
+    def __init__(self, conn_params, min_size=0, max_size=10, timeout=30,
+                 check_interval=30):
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._pool = pg_pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._returned_at = {}
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                f'connection pool exhausted, no connection freed in {self.timeout}s')
+        try:
+            while True:
+                connection = self._pool.getconn()
+                if self._is_healthy(connection):
+                    return connection
+                self._discard(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        if not close and not connection.closed:
+            try:
+                if connection.status != extensions.STATUS_READY:
+                    connection.rollback()
+            except Database.Error:
+                close = True
+        if close or connection.closed:
+            self._discard(connection)
+        else:
+            self._returned_at[id(connection)] = time.monotonic()
+            self._pool.putconn(connection)
+        self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._returned_at.clear()
+
+    def _discard(self, connection):
+        self._returned_at.pop(id(connection), None)
+        self._pool.putconn(connection, close=True)
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        returned_at = self._returned_at.get(id(connection))
+        if returned_at is None or time.monotonic() - returned_at < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.status != extensions.STATUS_READY:
+                connection.rollback()
+        except Database.Error:
+            return False
+        return True
+
+
+def get_pool(alias, conn_params, options):
+    """Pools are per process (safe to fork after settings are loaded) and
+       per connection parameters (the test database gets its own)"""
+    key = (os.getpid(), alias, repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                conn_params,
+                min_size=options.get('MIN_SIZE', 0),
+                max_size=options['MAX_SIZE'],
+                timeout=options.get('TIMEOUT', 30),
+                check_interval=options.get('CHECK_INTERVAL', 30),
+            )
+        return _pools[key]
+
+
+def close_pools():
+    """Disconnect every pooled connection of this process"""
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            _pools.pop(key).closeall()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections would block DROP DATABASE
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pool_options(self):
+        options = self.settings_dict.get('POOL') or {}
+        return options if options.get('MAX_SIZE') else None
+
+    def get_new_connection(self, conn_params):
+        pool_options = self.pool_options
+        if pool_options is None:
+            return super().get_new_connection(conn_params)
+        connection = get_pool(self.alias, conn_params, pool_options).getconn()
+        # same isolation level handling as the stock backend
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        options = self.pool_options
+        if options is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            get_pool(self.alias, self.get_connection_params(), options).putconn(
+                self.connection, close=self.errors_occurred and not self.is_usable())
+        return None
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+                self.connection is not None and
+                not self.health_check_done and
+                not self.in_atomic_block and
+                self.pool_options is None and
+                self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
@@ -0,0 +1,70 @@
+"""
+Read replica routing
+
+Reads go to a replica only inside ``replica_reads(True)``, which the
+dds2api viewsets enter for the actions listed in their ``replica_actions``.
+Everything else, and every read after a write in the same block, goes to
+the primary (``default``).
+"""
+
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+class RoutingState:
+    __slots__ = ('use_replica', 'wrote')
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+@contextmanager
+def replica_reads(enabled):
+    """Route the reads of the block to a replica when enabled, the yielded
+       state tells whether the block wrote to the primary"""
+    previous = getattr(_state, 'current', None)
+    _state.current = RoutingState(enabled)
+    try:
+        yield _state.current
+    finally:
+        _state.current = previous
+
+
+def allow_replica_reads(enabled):
+    """Switch replica reads on or off for the rest of the current block"""
+    current = getattr(_state, 'current', None)
+    if current is not None:
+        current.use_replica = enabled
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        current = getattr(_state, 'current', None)
+        if current is None or not current.use_replica or current.wrote:
+            return 'default'
+        replicas = replica_aliases()
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        current = getattr(_state, 'current', None)
+        if current is not None:
+            # read your writes for the rest of the block
+            current.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,26 @@
+"""
+Storages built on first use
+
+Instantiating the S3 storages imports boto3, which is a large part of the
+process start up. Model fields get a LazyStorage instead so that importing
+the models does not import boto3.
+"""
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+
+class LazyStorage(SimpleLazyObject):
+    """Proxy to an instance of the storage class named by the setting
+       storage_setting, created on first access"""
+
+    def __init__(self, storage_setting):
+        super().__init__(lambda: import_string(getattr(settings, storage_setting))())
+
+    def __bool__(self):
+        # FileField does `storage or default_storage`, don't set up for it
+        return True
+
+
+private_media_storage = LazyStorage('PRIVATE_FILE_STORAGE')  # pylint: disable=C0103
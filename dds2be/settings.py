@@ -44,14 +44,14 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'storages',
     # apps
-    'dds2api'
+    'dds2api.apps.Dds2ApiConfig'
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'dds2api.authentication.TenantJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': (
@@ -59,9 +59,45 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'dds2api.throttling.TenantRateThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'sender-confirm': '30/minute',
+    },
+    'DEFAULT_RENDERER_CLASSES': (
+        'dds2api.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# when True, tenant ids and roles are read from the JWT claims instead of
+# loading the user and profile on every request
+DDS2API_JWT_STATELESS = CONFIG.get('DDS2API_JWT_STATELESS', '') == 'true'
+
+# the token claim revocation markers live here, it must be shared by all
+# the workers (memcached) in production, check --deploy fails on LocMem
+CACHES = {
+    'default': {
+        'BACKEND': CONFIG.get('DJANGO_CACHE_BACKEND',
+                              'dds2api.instrumentation.InstrumentedLocMemCache'),
+        'LOCATION': CONFIG.get('DJANGO_CACHE_LOCATION', ''),
+    }
 }
 
+# request metrics, exported on /metrics (Bearer DDS2API_METRICS_TOKEN), which
+# answers 403 while the token is empty
+DDS2API_METRICS_TOKEN = CONFIG.get('DDS2API_METRICS_TOKEN', '')
+# fraction of the requests watched by the stack sampler, the stacks of the
+# ones slower than DDS2API_SLOW_REQUEST_SECONDS are written to
+# DDS2API_PROFILE_DIR as folded stacks
+DDS2API_PROFILE_SAMPLE_RATE = float(CONFIG.get('DDS2API_PROFILE_SAMPLE_RATE', 0))
+DDS2API_SLOW_REQUEST_SECONDS = float(CONFIG.get('DDS2API_SLOW_REQUEST_SECONDS', 1))
+DDS2API_PROFILE_INTERVAL = 0.005
+DDS2API_PROFILE_DIR = CONFIG.get('DDS2API_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
 MIDDLEWARE = [
+    'dds2api.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,14 +131,146 @@ WSGI_APPLICATION = 'dds2be.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Connections are kept open for DJANGO_DB_CONN_MAX_AGE seconds and checked
+# with SELECT 1 before their first use in a request. Setting
+# DJANGO_DB_POOL_MAX_SIZE enables a per process pool instead, see README.md
+# for sizing.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'dds2be.db_backends.postgresql',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': 'dbpassword',
         'HOST': 'localhost',
+        'CONN_MAX_AGE': int(CONFIG.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'MIN_SIZE': int(CONFIG.get('DJANGO_DB_POOL_MIN_SIZE', 0)),
+            'MAX_SIZE': int(CONFIG.get('DJANGO_DB_POOL_MAX_SIZE', 0)),
+            'TIMEOUT': float(CONFIG.get('DJANGO_DB_POOL_TIMEOUT', 30)),
+            'CHECK_INTERVAL': float(CONFIG.get('DJANGO_DB_POOL_CHECK_INTERVAL', 30)),
+        },
+    }
+}
+
+# read replicas, comma separated hosts sharing the primary credentials
+for index, replica_host in enumerate(
+        filter(None, CONFIG.get('DJANGO_DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host.strip(),
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['dds2be.db_routers.ReplicaRouter']
+
+# seconds a user keeps reading from the primary after a write
+DDS2API_REPLICA_PIN_SECONDS = 5
+# per viewset override of replica_actions, e.g. {'DataSetViewSet': ['list']}
+DDS2API_REPLICA_ACTIONS = {}
+
+# domain verification (python manage.py verify_domains --loop), a domain
+# needs SPF (with include:DDS2API_SPF_INCLUDE when set), the DKIM key of
+# DDS2API_DKIM_SELECTOR and DMARC records
+DDS2API_DNS_NAMESERVERS = list(
+    filter(None, CONFIG.get('DDS2API_DNS_NAMESERVERS', '').split(',')))
+DDS2API_DNS_TIMEOUT = 2.0
+DDS2API_DKIM_SELECTOR = CONFIG.get('DDS2API_DKIM_SELECTOR', 'dds2')
+DDS2API_SPF_INCLUDE = CONFIG.get('DDS2API_SPF_INCLUDE', '')
+# domains are re-checked when their records' TTL runs out, within these bounds
+DDS2API_DOMAIN_RECHECK_MIN_SECONDS = 300
+DDS2API_DOMAIN_RECHECK_MAX_SECONDS = 6 * 3600
+DDS2API_DOMAIN_RETRY_SECONDS = 300
+# broadcasts can't use a domain whose last successful check is older
+DDS2API_DOMAIN_VERIFICATION_MAX_AGE = 48 * 3600
+
+# sender verification tokens, the mail links to DDS2API_SENDER_CONFIRM_URL
+# (formatted with {token}) when it is set, otherwise it carries the token
+DDS2API_SENDER_TOKEN_SECONDS = 24 * 3600
+DDS2API_SENDER_TOKENS_PER_HOUR = 5
+DDS2API_SENDER_CONFIRM_URL = CONFIG.get('DDS2API_SENDER_CONFIRM_URL', '')
+
+# rows kept in the DataSet statistics sample (compute_dataset_stats)
+DDS2API_DATASET_SAMPLE_ROWS = 1000
+# rows per DataSet segment (dds2api.datasets)
+DDS2API_DATASET_SEGMENT_ROWS = 100000
+# upserted share of the rows of a DataSet that triggers a compaction
+DDS2API_DATASET_COMPACT_RATIO = 0.05
+# DataSet versions neither current nor pinned by a Broadcast are deleted
+# after this long (prune_dataset_versions)
+DDS2API_DATASET_VERSION_RETENTION_SECONDS = 7 * 24 * 3600
+# days the rows of a table are kept before they are archived
+# (apply_retention), RetentionPolicy overrides them per tenant. None keeps
+# them
+DDS2API_RETENTION_DAYS = {
+    'balanceentry': 730,
+}
+# rows deleted per transaction once archived
+DDS2API_RETENTION_BATCH_SIZE = 5000
+# points an analytics series returns at most
+DDS2API_ANALYTICS_MAX_POINTS = 1000
+# warm run_renderer processes of generated attachments, the compiled
+# templates each keeps and the seconds a document may take
+DDS2API_RENDERER_PROCESSES = 4
+DDS2API_RENDERER_TEMPLATES = 64
+DDS2API_RENDERER_TIMEOUT = 30
+# bytes the assets zip of a generated attachment may hold, uncompressed
+DDS2API_DOCUMENT_ASSETS_MAX_BYTES = 20 * 1024 * 1024
+# attachments buffered for a mail (test sends, WSGI previews) may not be
+# larger
+DDS2API_ATTACHMENT_MAX_BYTES = 10 * 1024 * 1024
+# DataSets whose decoded sample rows are kept per process for previews
+DDS2API_PREVIEW_DATASETS = 32
+DDS2API_PREVIEW_MAX_ROWS = 20
+# rows of the file a preview may read to find the ?row= numbers
+DDS2API_PREVIEW_SCAN_ROWS = 10000
+# tag expression indexes kept per process (dds2api.tags), the broadcast
+# ones are rebuilt at least every DDS2API_TAG_INDEX_SECONDS
+DDS2API_TAG_INDEX_TENANTS = 256
+DDS2API_TAG_INDEX_DATASETS = 8
+DDS2API_TAG_INDEX_SECONDS = 300
+# separates the tags in the tags column of a DataSet
+DDS2API_RECIPIENT_TAG_SEPARATOR = '|'
+# StorageCredential secrets are envelope encrypted with the active key of
+# this file (python manage.py rotate_kms_key creates and rotates it), the
+# decrypted ones and their S3 clients are kept per process
+DDS2API_KMS_KEY_FILE = CONFIG.get('DDS2API_KMS_KEY_FILE', os.path.join(BASE_DIR, 'kms.key'))
+DDS2API_CREDENTIAL_CACHE_SIZE = 256
+DDS2API_CREDENTIAL_CACHE_SECONDS = 300
+# change events (python manage.py relay_outbox --loop) are published to a
+# file:///path or tcp://host:port sink, and kept this long once published
+DDS2API_OUTBOX_SINK = CONFIG.get('DDS2API_OUTBOX_SINK',
+                                 'file://' + os.path.join(BASE_DIR, 'outbox.jsonl'))
+DDS2API_OUTBOX_RETENTION_SECONDS = 7 * 24 * 3600
+# background jobs (python manage.py run_jobs --loop): a tenant runs at most
+# DDS2API_JOB_TENANT_CONCURRENCY jobs at a time, a claimed job is handed to
+# another worker after the visibility timeout of its task, failed ones are
+# retried with an exponential backoff
+DDS2API_JOB_TENANT_CONCURRENCY = 4
+DDS2API_JOB_VISIBILITY_SECONDS = 300
+DDS2API_JOB_MAX_ATTEMPTS = 5
+DDS2API_JOB_RETRY_SECONDS = 10
+DDS2API_JOB_RETRY_MAX_SECONDS = 3600
+DDS2API_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+# requests per tenant, by scope (tenant_throttle_scopes of the views), in
+# sliding windows counted in DDS2API_THROTTLE_STORE (redis://host:6379/0),
+# or per process when it is empty
+DDS2API_THROTTLE_STORE = CONFIG.get('DDS2API_THROTTLE_STORE', '')
+DDS2API_TENANT_THROTTLE_RATES = {
+    'default': '1200/minute',
+    'dataset-upload': '60/hour',
+    'broadcast-create': '300/hour',
+    'broadcast-test-send': '60/hour',
+}
+# scheduled broadcasts (python manage.py dispatch_broadcasts): the runs of
+# the next DDS2API_SCHEDULE_HORIZON_SECONDS are kept in a timing wheel of
+# DDS2API_SCHEDULE_TICK_SECONDS slots
+DDS2API_SCHEDULE_HORIZON_SECONDS = 3600
+DDS2API_SCHEDULE_TICK_SECONDS = 0.1
+# messages per second a broadcast is sent at, by channel_type
+DDS2API_SEND_RATES = {
+    'EMAIL': 100,
+    'SMS': 20,
 }
 
 
@@ -158,10 +326,11 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # (optional, None or canned ACL, default public-read)
 AWS_DEFAULT_ACL = None
 
-# storages
-AWS_ACCESS_KEY_ID = CONFIG['AWS_ACCESS_KEY_ID']
-AWS_SECRET_ACCESS_KEY = CONFIG['AWS_SECRET_ACCESS_KEY']
-AWS_STORAGE_BUCKET_NAME = CONFIG['AWS_STORAGE_BUCKET_NAME']
+# storages, only read when a storage is first used (see
+# dds2be.lazy_storage), missing keys fall back to the boto3 credential chain
+AWS_ACCESS_KEY_ID = CONFIG.get('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = CONFIG.get('AWS_SECRET_ACCESS_KEY')
+AWS_STORAGE_BUCKET_NAME = CONFIG.get('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_CUSTOM_DOMAIN = '%s.s3.amazonaws.com' % AWS_STORAGE_BUCKET_NAME
 
 AWS_S3_OBJECT_PARAMETERS = {
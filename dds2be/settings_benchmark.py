@@ -0,0 +1,16 @@
+"""
+Settings for the benchmark command: the private files (DataSet uploads,
+segments and deltas, attachments, archives) are written to a local
+directory instead of S3, so that the benchmarks don't measure the network.
+
+    DJANGO_SETTINGS_MODULE=dds2be.settings_benchmark python manage.py benchmark
+"""
+
+import tempfile
+
+from .settings import *  # noqa pylint: disable=W0401,W0614
+
+PRIVATE_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+# where FileSystemStorage writes the private files
+MEDIA_ROOT = CONFIG.get('DDS2_BENCHMARK_FILES_DIR',
+                        os.path.join(tempfile.gettempdir(), 'dds2-benchmark'))
@@ -0,0 +1,33 @@
+"""
+Lean settings for broadcast workers and management commands that don't
+serve HTTP: no admin, sessions, messages or static files.
+
+    DJANGO_SETTINGS_MODULE=dds2be.settings_worker python manage.py <command>
+"""
+
+from .settings import *  # noqa pylint: disable=W0401,W0614
+
+WORKER_EXCLUDED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework.authtoken',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WORKER_EXCLUDED_APPS]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = 'dds2be.urls_worker'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [],
+        },
+    },
+]
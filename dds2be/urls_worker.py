@@ -0,0 +1,7 @@
+"""URL configuration of dds2be.settings_worker, used only for reversing"""
+from django.urls import include, path
+
+
+urlpatterns = [
+    path('', include('dds2api.urls')),
+]